@@ -20,26 +20,68 @@ def create_app(config_class=Config):
     from app.email import init_mail
     init_mail(app)
 
-    from app.models import User
+    from app.instrumentation import init_instrumentation
+    init_instrumentation(app)
+
+    from app.slow_queries import init_slow_queries
+    init_slow_queries(app)
+
+    from app.metrics import init_metrics
+    init_metrics(app)
+
+    from app.profiling import init_profiling
+    init_profiling(app)
+
+    from app.cache import init_cache
+    init_cache(app)
+
+    from app.user_cache import init_user_cache, user_cache
+    init_user_cache(app)
+
+    from app.consensus import init_consensus
+    init_consensus(app)
+
+    from app.leaderboard import init_leaderboard
+    init_leaderboard(app)
+
+    from app.rank_history import init_rank_history
+    init_rank_history(app)
+
+    from app.recompute import init_recompute
+    init_recompute(app)
+
+    from app.user_import import init_user_import
+    init_user_import(app)
+
+    from app.jobs import init_jobs, job_runner
+    init_jobs(app)
 
     @login_manager.user_loader
     def load_user(user_id):
-        return db.session.get(User, int(user_id))
+        return user_cache.get(int(user_id))
 
     from app.routes.auth import auth_bp
     from app.routes.main import main_bp
     from app.routes.admin import admin_bp
     from app.routes.picks import picks_bp
     from app.routes.standings import standings_bp
+    from app.routes.metrics import metrics_bp
 
     app.register_blueprint(auth_bp)
     app.register_blueprint(main_bp)
     app.register_blueprint(admin_bp, url_prefix='/admin')
     app.register_blueprint(picks_bp, url_prefix='/picks')
     app.register_blueprint(standings_bp, url_prefix='/standings')
+    app.register_blueprint(metrics_bp)
 
     with app.app_context():
+        from app.migrations import upgrade_schema, rebuild_read_models, create_missing_indexes
+        rebuild = upgrade_schema(db.engine)
         db.create_all()
+        create_missing_indexes(db.engine, db.metadata)
+        if rebuild:
+            rebuild_read_models()
+        job_runner.recover()
         _ensure_admin_exists()
 
     return app
@@ -0,0 +1,67 @@
+"""
+Per-player against-the-spread analytics.
+
+Every scored pick in a season is grouped once in SQL by player, picked team,
+favorite/underdog and home/away; the rows are rolled up here into overall,
+per-team, per-side and per-venue buckets and written to
+``player_ats_summary``. calculate_week_results refreshes the season after
+scoring a week, so the profile pages read a handful of summary rows instead
+of joining picks to games.
+"""
+
+from sqlalchemy import case, func
+from app import db
+from app.models import Game, Pick, Week, PlayerAtsSummary
+
+CATEGORIES = ('all', 'side', 'venue', 'team')
+
+
+def _season_groups(season_id):
+    favored = case((Game.favorite == 'home', Game.home_team), (Game.favorite == 'away', Game.away_team))
+    side = case((favored.is_(None), 'even'), (Pick.picked_team == favored, 'favorite'), else_='underdog')
+    venue = case((Pick.picked_team == Game.home_team, 'home'), else_='away')
+    return (
+        db.session.query(
+            Pick.user_id, Pick.picked_team, side, venue, func.count(Pick.id),
+            func.sum(case((Pick.points_x2 > 0, 1), else_=0)),
+            func.sum(case((Pick.points_x2 < 0, 1), else_=0)),
+            func.sum(case((Pick.points_x2 == 0, 1), else_=0)),
+            func.sum(Pick.points_x2),
+        )
+        .join(Game, Game.id == Pick.game_id)
+        .join(Week, Week.id == Game.week_id)
+        .filter(Week.season_id == season_id, Pick.points_x2.isnot(None))
+        .group_by(Pick.user_id, Pick.picked_team, side, venue)
+        .all()
+    )
+
+
+def refresh_player_analytics(season_id):
+    """Recompute every player's buckets for ``season_id`` and replace the stored rows; the caller commits."""
+    buckets = {}
+    for user_id, team, side, venue, picks, wins, losses, pushes, points in _season_groups(season_id):
+        for category, key in (('all', ''), ('side', side), ('venue', venue), ('team', team)):
+            b = buckets.setdefault((user_id, category, key), [0, 0, 0, 0, 0])
+            b[0] += picks
+            b[1] += wins or 0
+            b[2] += losses or 0
+            b[3] += pushes or 0
+            b[4] += points or 0
+    PlayerAtsSummary.query.filter_by(season_id=season_id).delete()
+    if buckets:
+        db.session.execute(PlayerAtsSummary.__table__.insert(), [
+            {'season_id': season_id, 'user_id': user_id, 'category': category, 'key': key,
+             'picks': b[0], 'wins': b[1], 'losses': b[2], 'pushes': b[3], 'points_x2': b[4]}
+            for (user_id, category, key), b in buckets.items()
+        ])
+    db.session.flush()
+
+
+def player_analytics(season_id, user_id):
+    """{category: [PlayerAtsSummary]} for one player, teams by most picked."""
+    rows = (PlayerAtsSummary.query.filter_by(season_id=season_id, user_id=user_id)
+            .order_by(PlayerAtsSummary.picks.desc(), PlayerAtsSummary.key).all())
+    out = {c: [] for c in CATEGORIES}
+    for r in rows:
+        out[r.category].append(r)
+    return out
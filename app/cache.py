@@ -0,0 +1,252 @@
+"""
+Rendered-fragment cache for the standings pages.
+
+Cached HTML is keyed by endpoint, season and that season's data version.
+The version is bumped whenever anything feeding the standings changes
+(week results recalculated, a week completed, entry fees or paid status
+edited), which makes every older entry unreachable; the LRU bound then
+evicts it. Versions and pages live in a small SQLite file next to the app
+database so every worker process shares them, and a cache hit never touches
+the application database.
+
+The same versions drive the ETag / Last-Modified validators on the standings
+and completed-week picks pages, so a revalidating browser gets a 304 without
+any rendering or scoring work.
+
+The store also holds named generation counters. The ``active_season``
+generation guards a per-process snapshot of the active season and its
+weeks, so the lookups every page makes cost no database queries until an
+admin changes a season or a week's flags in any process.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timezone
+from flask import request, session, make_response
+from flask_login import current_user
+from app.metrics import Counter
+
+PAGE_CACHE_REQUESTS = Counter(
+    'pickem_page_cache_requests_total', 'Standings fragment cache lookups by result.', ('result',))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS versions (season_id INTEGER PRIMARY KEY, version INTEGER NOT NULL, updated_at REAL);
+CREATE TABLE IF NOT EXISTS pages (key TEXT PRIMARY KEY, value TEXT NOT NULL, last_used REAL NOT NULL);
+CREATE INDEX IF NOT EXISTS ix_pages_last_used ON pages (last_used);
+CREATE TABLE IF NOT EXISTS generations (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+"""
+
+
+class PageCache:
+    def __init__(self):
+        self.path = None
+        self.max_entries = 200
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+
+    def configure(self, path, max_entries=200):
+        self.path = path or None
+        self.max_entries = max_entries
+        self._local = threading.local()
+        if self.path:
+            self._conn().executescript(_SCHEMA)
+
+    @property
+    def enabled(self):
+        return self.path is not None
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def version(self, season_id):
+        return self.version_info(season_id)[0]
+
+    def version_info(self, season_id):
+        """(version, unix time of the last bump or None) for ``season_id``."""
+        if not self.enabled:
+            return 0, None
+        row = self._conn().execute(
+            'SELECT version, updated_at FROM versions WHERE season_id = ?', (season_id,)).fetchone()
+        return (row[0], row[1]) if row else (0, None)
+
+    def bump(self, season_id):
+        """Invalidate every cached fragment for ``season_id``."""
+        if not self.enabled:
+            return
+        self._conn().execute(
+            'INSERT INTO versions (season_id, version, updated_at) VALUES (?, 1, ?) '
+            'ON CONFLICT(season_id) DO UPDATE SET version = version + 1, updated_at = excluded.updated_at',
+            (season_id, time.time()))
+
+    def bump_all(self):
+        if self.enabled:
+            self._conn().execute('UPDATE versions SET version = version + 1, updated_at = ?', (time.time(),))
+
+    def generation(self, name):
+        if not self.enabled:
+            return None
+        row = self._conn().execute('SELECT value FROM generations WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else 0
+
+    def bump_generation(self, name):
+        if self.enabled:
+            self._conn().execute(
+                'INSERT INTO generations (name, value) VALUES (?, 1) '
+                'ON CONFLICT(name) DO UPDATE SET value = value + 1', (name,))
+
+    def key(self, endpoint, season_id):
+        return f'{endpoint}:{season_id}:v{self.version(season_id)}'
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        conn = self._conn()
+        row = conn.execute('SELECT value FROM pages WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            PAGE_CACHE_REQUESTS.inc(result='miss')
+            return None
+        conn.execute('UPDATE pages SET last_used = ? WHERE key = ?', (time.time(), key))
+        self.hits += 1
+        PAGE_CACHE_REQUESTS.inc(result='hit')
+        return row[0]
+
+    def set(self, key, value):
+        if not self.enabled:
+            return
+        conn = self._conn()
+        conn.execute('INSERT OR REPLACE INTO pages (key, value, last_used) VALUES (?, ?, ?)',
+                     (key, str(value), time.time()))
+        conn.execute(
+            'DELETE FROM pages WHERE key IN (SELECT key FROM pages ORDER BY last_used DESC '
+            'LIMIT -1 OFFSET ?)', (self.max_entries,))
+
+    def clear(self):
+        if self.enabled:
+            self._conn().executescript('DELETE FROM pages; DELETE FROM versions; DELETE FROM generations;')
+
+    def stats(self):
+        entries = 0
+        if self.enabled:
+            entries = self._conn().execute('SELECT COUNT(*) FROM pages').fetchone()[0]
+        return {'hits': self.hits, 'misses': self.misses, 'entries': entries,
+                'max_entries': self.max_entries}
+
+
+page_cache = PageCache()
+
+
+def page_validators(endpoint, season_id, *parts):
+    """
+    (etag, last_modified) for a page that only changes with ``season_id``'s
+    data version, or None when versions aren't tracked or a flash message is
+    pending. The current user is part of the tag because the navbar is.
+    """
+    if not page_cache.enabled or session.get('_flashes'):
+        return None
+    version, updated_at = page_cache.version_info(season_id)
+    tag = ':'.join(str(p) for p in (endpoint, season_id, version, current_user.get_id()) + parts)
+    last_modified = None
+    if updated_at:
+        last_modified = datetime.fromtimestamp(int(updated_at), timezone.utc)
+    return hashlib.sha1(tag.encode()).hexdigest(), last_modified
+
+
+def not_modified(validators):
+    """A 304 response if the request's validators match, else None."""
+    if validators is None:
+        return None
+    etag, last_modified = validators
+    if request.if_none_match:
+        matched = request.if_none_match.contains(etag)
+    else:
+        ims = request.if_modified_since
+        matched = bool(last_modified and ims and ims >= last_modified)
+    if not matched:
+        return None
+    return with_validators(make_response('', 304), validators)
+
+
+def with_validators(response, validators):
+    """Attach ETag / Last-Modified and make browsers revalidate every time."""
+    response = make_response(response)
+    if validators is not None:
+        etag, last_modified = validators
+        response.set_etag(etag)
+        if last_modified:
+            response.last_modified = last_modified
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+    return response
+
+
+WeekInfo = namedtuple('WeekInfo', 'id season_id week_number is_open_for_picks is_completed')
+
+
+class ActiveSeason(namedtuple('ActiveSeason', 'id year total_weeks weeks')):
+    """Detached snapshot of the active season and its weeks in week order."""
+    __slots__ = ()
+
+    @property
+    def current_week(self):
+        """First week not yet completed, else the last week."""
+        for w in self.weeks:
+            if not w.is_completed:
+                return w
+        return self.weeks[-1] if self.weeks else None
+
+    @property
+    def open_week(self):
+        """First week open for picks, else the last week."""
+        for w in self.weeks:
+            if w.is_open_for_picks:
+                return w
+        return self.weeks[-1] if self.weeks else None
+
+
+# (generation, ActiveSeason or None); replaced as a whole so readers never see a torn pair
+_active_season = (None, None)
+
+
+def get_active_season():
+    """The active season snapshot, reloaded only when its generation moved."""
+    global _active_season
+    gen = page_cache.generation('active_season')
+    cached_gen, snapshot = _active_season
+    if gen is not None and gen == cached_gen:
+        return snapshot
+    from app.models import Season, Week
+    season = Season.query.filter_by(is_active=True).first()
+    snapshot = None
+    if season:
+        weeks = Week.query.filter_by(season_id=season.id).order_by(Week.week_number).all()
+        snapshot = ActiveSeason(season.id, season.year, season.total_weeks, tuple(
+            WeekInfo(w.id, w.season_id, w.week_number, bool(w.is_open_for_picks), bool(w.is_completed))
+            for w in weeks))
+    _active_season = (gen, snapshot)
+    return snapshot
+
+
+def invalidate_active_season():
+    """Call after committing a change to any season or week flag."""
+    global _active_season
+    page_cache.bump_generation('active_season')
+    _active_season = (None, None)
+
+
+def init_cache(app):
+    global _active_season
+    page_cache.configure(app.config.get('PAGE_CACHE_PATH'), app.config.get('PAGE_CACHE_MAX_ENTRIES', 200))
+    _active_season = (None, None)
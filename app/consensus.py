@@ -0,0 +1,108 @@
+"""
+Per-game pick consensus counters.
+
+``game_consensus`` holds how many players picked each side of a game so the
+picks page can show the split with one query per week instead of scanning
+every pick. Counters are adjusted in the same transaction that inserts or
+deletes picks; ``flask rebuild-consensus`` recounts them from the picks
+table and reports any that had drifted.
+"""
+
+import click
+from flask import current_app
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from app import db
+from app.models import Game, GameConsensus, Week
+from app.pick_matrix import WeekPickMatrix
+
+
+def record_pick_changes(games_by_id, removed=(), added=()):
+    """
+    Adjust counters for picks being deleted and inserted, as (game_id,
+    picked_team) pairs. Runs in the session's transaction without committing
+    so the caller's commit covers both the picks and the counters. A counter
+    pushed below zero means it had drifted; it is logged, and rebuild-consensus
+    reports and corrects it.
+    """
+    deltas = {}
+    for sign, changes in ((-1, removed), (1, added)):
+        for game_id, team in changes:
+            home, away = deltas.get(game_id, (0, 0))
+            if team == games_by_id[game_id].home_team:
+                home += sign
+            else:
+                away += sign
+            deltas[game_id] = (home, away)
+    deltas = {gid: d for gid, d in deltas.items() if d != (0, 0)}
+    if not deltas:
+        return
+    # one upsert, so two first picks on a game at once can't both try to create its row
+    stmt = _insert().values([{'game_id': gid, 'home_count': home, 'away_count': away}
+                             for gid, (home, away) in sorted(deltas.items())])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[GameConsensus.game_id],
+        set_={'home_count': GameConsensus.home_count + stmt.excluded.home_count,
+              'away_count': GameConsensus.away_count + stmt.excluded.away_count},
+    ).returning(GameConsensus.game_id, GameConsensus.home_count, GameConsensus.away_count)
+    for game_id, home, away in db.session.execute(stmt):
+        if home < 0 or away < 0:
+            current_app.logger.warning('Pick consensus for game %s went negative (%s/%s); '
+                                       'run flask rebuild-consensus', game_id, home, away)
+
+
+def _insert():
+    if db.engine.dialect.name == 'postgresql':
+        return postgresql_insert(GameConsensus)
+    return sqlite_insert(GameConsensus)
+
+
+def consensus_for_games(game_ids):
+    """{game_id: (home count, away count)} for games that have any picks."""
+    if not game_ids:
+        return {}
+    rows = (db.session.query(GameConsensus.game_id, GameConsensus.home_count, GameConsensus.away_count)
+            .filter(GameConsensus.game_id.in_(list(game_ids))).all())
+    return {gid: (home, away) for gid, home, away in rows}
+
+
+def rebuild_consensus(week_ids=None):
+    """Recount every game's counters from its picks; returns [(game_id, stored, actual)] that differed."""
+    mismatches = recount_consensus(week_ids)
+    db.session.commit()
+    return mismatches
+
+
+def recount_consensus(week_ids=None):
+    """rebuild_consensus without the commit, for callers rebuilding in a larger transaction."""
+    if week_ids is None:
+        week_ids = [wid for (wid,) in db.session.query(Week.id).order_by(Week.id)]
+    mismatches = []
+    for week_id in week_ids:
+        actual = WeekPickMatrix.for_week(db.session, week_id).consensus()
+        stored = {c.game_id: c for c in GameConsensus.query.join(Game).filter(Game.week_id == week_id)}
+        for game_id, counts in actual.items():
+            row = stored.get(game_id)
+            have = (row.home_count, row.away_count) if row else (0, 0)
+            if have == counts:
+                continue
+            mismatches.append((game_id, have, counts))
+            if row is None:
+                db.session.add(GameConsensus(game_id=game_id, home_count=counts[0], away_count=counts[1]))
+            else:
+                row.home_count, row.away_count = counts
+    db.session.flush()
+    return mismatches
+
+
+@click.command('rebuild-consensus')
+def rebuild_consensus_command():
+    """Recount pick consensus counters and report any that had drifted."""
+    mismatches = rebuild_consensus()
+    for game_id, stored, actual in mismatches:
+        click.echo(f'game {game_id}: stored {stored[0]}/{stored[1]}, actual {actual[0]}/{actual[1]}')
+    click.echo(f'{len(mismatches)} game(s) corrected.')
+
+
+def init_consensus(app):
+    app.cli.add_command(rebuild_consensus_command)
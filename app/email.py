@@ -1,6 +1,7 @@
 from flask import current_app
 from flask_mail import Mail, Message
 from datetime import datetime
+from app.metrics import EMAIL_QUEUE_DEPTH, EMAILS
 
 mail = Mail()
 
@@ -66,10 +67,16 @@ def send_picks_confirmation(user, week, picks_data):
             sender=current_app.config.get('MAIL_DEFAULT_SENDER')
         )
         
-        mail.send(msg)
+        EMAIL_QUEUE_DEPTH.inc()
+        try:
+            mail.send(msg)
+        finally:
+            EMAIL_QUEUE_DEPTH.dec()
+        EMAILS.inc(result='sent')
         return True
         
     except Exception as e:
         # Log error but don't fail the pick submission
+        EMAILS.inc(result='failed')
         current_app.logger.error(f"Failed to send email to {user.email}: {str(e)}")
         return False
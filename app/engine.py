@@ -0,0 +1,313 @@
+"""
+In-memory scoring engine.
+
+The league rules as plain functions over anything with the right
+attributes: ORM rows when called from app.scoring, or the ``__slots__``
+records below when evaluating hypotheticals. Nothing here touches the
+session.
+
+SeasonSnapshot loads a whole season (weeks, games, picks and the pickers'
+active flags) in one SELECT and answers "what if" questions on copies:
+``with_score`` and ``with_pick`` copy only the week they change, and
+per-week results are memoised, so a hypothetical re-scores one week and
+re-ranks the season without going back to the database.
+"""
+
+from sqlalchemy import text
+from app.models import spread_points_x2
+
+MIN_PICKS = 4
+
+
+class GameRec:
+    __slots__ = ('id', 'week_id', 'home_team', 'away_team', 'spread_x2', 'favorite',
+                 'home_score', 'away_score', 'is_final')
+
+    def __init__(self, id, week_id, home_team, away_team, spread_x2, favorite,
+                 home_score=None, away_score=None, is_final=False):
+        self.id = id
+        self.week_id = week_id
+        self.home_team = home_team
+        self.away_team = away_team
+        self.spread_x2 = spread_x2
+        self.favorite = favorite
+        self.home_score = home_score
+        self.away_score = away_score
+        self.is_final = is_final
+
+    @property
+    def favored_team(self):
+        return self.home_team if self.favorite == 'home' else self.away_team if self.favorite == 'away' else None
+
+
+class PickRec:
+    __slots__ = ('user_id', 'game_id', 'picked_team', 'points_x2')
+
+    def __init__(self, user_id, game_id, picked_team, points_x2=None):
+        self.user_id = user_id
+        self.game_id = game_id
+        self.picked_team = picked_team
+        self.points_x2 = points_x2
+
+
+class WeekRec:
+    __slots__ = ('id', 'week_number', 'is_completed')
+
+    def __init__(self, id, week_number, is_completed=False):
+        self.id = id
+        self.week_number = week_number
+        self.is_completed = is_completed
+
+
+class ResultRec:
+    __slots__ = ('user_id', 'week_id', 'total_points_x2', 'num_picks', 'winning_picks',
+                 'weekly_win_share', 'is_eligible')
+
+    def __init__(self, user_id, week_id, total_points_x2, num_picks, winning_picks, weekly_win_share=0,
+                 is_eligible=True):
+        self.user_id = user_id
+        self.week_id = week_id
+        self.total_points_x2 = total_points_x2
+        self.num_picks = num_picks
+        self.winning_picks = winning_picks
+        self.weekly_win_share = weekly_win_share
+        self.is_eligible = is_eligible
+
+
+class UserRec:
+    __slots__ = ('id', 'username', 'display_name')
+
+    def __init__(self, id, username, display_name):
+        self.id = id
+        self.username = username
+        self.display_name = display_name
+
+
+def pick_points_x2(game, picked_team):
+    return spread_points_x2(game.home_score, game.away_score, game.spread_x2, game.favorite,
+                            picked_team == game.favored_team)
+
+
+def score_week(week_id, games, picks, active_user_ids, record=True):
+    """The week's [ResultRec] with win shares set, for active players with picks, in ``active_user_ids`` order.
+
+    Each final game is scored once per side. With ``record`` the points are
+    also written to the picks, which is how app.scoring persists them.
+    """
+    final = {g.id: {g.home_team: pick_points_x2(g, g.home_team), g.away_team: pick_points_x2(g, g.away_team)}
+             for g in games if g.is_final}
+    by_id = {g.id: g for g in games}
+    tally = {}
+    for p in picks:
+        pts = p.points_x2
+        sides = final.get(p.game_id)
+        if sides is not None:
+            pts = sides[p.picked_team] if p.picked_team in sides else pick_points_x2(by_id[p.game_id], p.picked_team)
+            if record:
+                p.points_x2 = pts
+        t = tally.get(p.user_id)
+        if t is None:
+            t = tally[p.user_id] = [0, 0, 0]
+        t[0] += pts or 0
+        t[1] += 1
+        if pts is not None and pts > 0:
+            t[2] += 1
+    results = [ResultRec(uid, week_id, t[0], t[1], t[2], 0, t[1] >= MIN_PICKS)
+               for uid, t in ((uid, tally.get(uid)) for uid in active_user_ids) if t]
+    award_week(results)
+    return results
+
+
+def award_week(results):
+    """Set weekly_win_share: top points among eligible players, then most winning picks, then split."""
+    eligible = sorted((r for r in results if r.is_eligible), key=lambda r: r.total_points_x2, reverse=True)
+    if not eligible:
+        return
+    best = eligible[0].total_points_x2
+    tied = [r for r in eligible if r.total_points_x2 == best]
+    if len(tied) == 1:
+        tied[0].weekly_win_share = 1.0
+        return
+    mw = max(r.winning_picks for r in tied)
+    fw = [r for r in tied if r.winning_picks == mw]
+    for r in fw:
+        r.weekly_win_share = 1.0 / len(fw)
+
+
+def weekly_prize(weeks, results_by_week, users):
+    """{'winners': [...], 'standings': [...]} for the weekly-wins prize over completed ``weeks``."""
+    us = {}
+    for w in weeks:
+        for r in results_by_week.get(w.id, []):
+            us.setdefault(r.user_id, {'user': users.get(r.user_id), 'total_wins': 0,
+                                       'winning_picks_in_win_weeks': 0, 'win_weeks': []})
+            if r.weekly_win_share > 0:
+                us[r.user_id]['total_wins'] += r.weekly_win_share
+                us[r.user_id]['winning_picks_in_win_weeks'] += r.winning_picks
+                us[r.user_id]['win_weeks'].append(w.week_number)
+    if not us:
+        return {'winners': [], 'standings': []}
+    st = sorted(us.values(), key=lambda x: (-x['total_wins'], -x['winning_picks_in_win_weeks']))
+    ww = [s for s in st if s['total_wins'] > 0]
+    if not ww:
+        return {'winners': [], 'standings': st}
+    b = ww[0]
+    ct = [s for s in ww if s['total_wins'] == b['total_wins']
+          and s['winning_picks_in_win_weeks'] == b['winning_picks_in_win_weeks']]
+    if len(ct) == 1:
+        return {'winners': [ct[0]], 'standings': st}
+    ws = [tuple(sorted(c['win_weeks'])) for c in ct]
+    if len(set(ws)) == 1:
+        return {'winners': ct, 'standings': st}
+    for wn in reversed(range(1, (weeks[-1].week_number if weeks else 0) + 1)):
+        iw = [c for c in ct if wn in c['win_weeks']]
+        nw = [c for c in ct if wn not in c['win_weeks']]
+        if iw and nw:
+            return {'winners': iw, 'standings': st}
+    return {'winners': ct, 'standings': st}
+
+
+def yearly_standings(total_weeks, weeks, results_by_week, users):
+    """Yearly standings rows for ``users`` (in order) over completed ``weeks``, best first."""
+    crit = (total_weeks, total_weeks - 1)
+    rm = {(r.user_id, r.week_id): r for rs in results_by_week.values() for r in rs}
+    st = []
+    for u in users:
+        tp = twp = tpk = ww = wpww = 0
+        wwl = []
+        qual = True
+        for w in weeks:
+            wr = rm.get((u.id, w.id))
+            if wr:
+                tp += wr.total_points_x2
+                twp += wr.winning_picks
+                tpk += wr.num_picks
+                if wr.weekly_win_share > 0:
+                    ww += wr.weekly_win_share
+                    wpww += wr.winning_picks
+                    wwl.append(w.week_number)
+                if w.week_number in crit and wr.num_picks < MIN_PICKS:
+                    qual = False
+            elif w.week_number in crit:
+                qual = False
+        if tpk == 0:
+            continue
+        st.append({'user': u, 'total_points': tp / 2, 'total_points_x2': tp, 'total_winning_picks': twp,
+                   'total_picks': tpk, 'weekly_wins': ww, 'winning_picks_in_win_weeks': wpww, 'win_weeks': wwl,
+                   'is_qualified': qual})
+    st.sort(key=lambda x: (-int(x['is_qualified']), -x['total_points_x2'], -x['weekly_wins'],
+                           -x['winning_picks_in_win_weeks']))
+    return st
+
+
+def yearly_winners(standings):
+    """The qualified players tied with the leader on points, weekly wins and winning picks in win weeks."""
+    qualified = [s for s in standings if s['is_qualified']]
+    if not qualified:
+        return []
+    best = qualified[0]
+    return [s for s in qualified if s['total_points_x2'] == best['total_points_x2']
+            and s['weekly_wins'] == best['weekly_wins']
+            and s['winning_picks_in_win_weeks'] == best['winning_picks_in_win_weeks']]
+
+
+_SEASON_SQL = text(
+    'SELECT w.id, w.week_number, w.is_completed, g.id, g.home_team, g.away_team, g.spread_x2, g.favorite, '
+    'g.home_score, g.away_score, g.is_final, p.user_id, p.picked_team, p.points_x2, '
+    'u.username, u.display_name, u.is_active_player '
+    'FROM weeks w LEFT JOIN games g ON g.week_id = w.id LEFT JOIN picks p ON p.game_id = g.id '
+    'LEFT JOIN users u ON u.id = p.user_id '
+    'WHERE w.season_id = :season_id ORDER BY w.week_number, g.id'
+)
+
+
+class SeasonSnapshot:
+    def __init__(self, total_weeks, weeks, games, picks, users):
+        self.total_weeks = total_weeks
+        self.weeks = weeks              # [WeekRec] by week number
+        self.games = games              # {week_id: [GameRec]}
+        self.picks = picks              # {week_id: [PickRec]}
+        self.users = users              # {user_id: UserRec}, active players only
+        self._user_ids = sorted(users)
+        self._results = {}
+        self._game_weeks = None
+
+    @classmethod
+    def load(cls, session, season):
+        """Snapshot ``season`` from one SELECT over weeks, games, picks and pickers."""
+        rows = session.execute(_SEASON_SQL, {'season_id': season.id}).all()
+        weeks, games, picks, users = {}, {}, {}, {}
+        seen = set()
+        for (wid, wn, done, gid, home, away, spread_x2, fav, hs, aws, final,
+             uid, team, pts2, username, name, active) in rows:
+            if wid not in weeks:
+                weeks[wid] = WeekRec(wid, wn, bool(done))
+            if gid is None:
+                continue
+            if gid not in seen:
+                seen.add(gid)
+                games.setdefault(wid, []).append(GameRec(gid, wid, home, away, spread_x2, fav, hs, aws, bool(final)))
+            if uid is None:
+                continue
+            picks.setdefault(wid, []).append(PickRec(uid, gid, team, pts2))
+            if active and uid not in users:
+                users[uid] = UserRec(uid, username, name)
+        return cls(season.total_weeks, list(weeks.values()), games, picks, users)
+
+    def results(self, week_id):
+        """[ResultRec] for ``week_id`` scored from the snapshot's picks, memoised."""
+        if week_id not in self._results:
+            self._results[week_id] = score_week(week_id, self.games.get(week_id, ()), self.picks.get(week_id, ()),
+                                                self._user_ids, record=False)
+        return self._results[week_id]
+
+    def _copy(self, week_id, weeks=None):
+        other = SeasonSnapshot(self.total_weeks, weeks or self.weeks, dict(self.games), dict(self.picks), self.users)
+        other._results = {wid: rs for wid, rs in self._results.items() if wid != week_id}
+        other._game_weeks = self._game_weeks
+        return other
+
+    def _week_of(self, game_id):
+        if self._game_weeks is None:
+            self._game_weeks = {g.id: wid for wid, games in self.games.items() for g in games}
+        wid = self._game_weeks[game_id]
+        return wid, next(g for g in self.games[wid] if g.id == game_id)
+
+    def with_score(self, game_id, home_score, away_score, final=True):
+        """A copy where ``game_id`` ended ``home_score``-``away_score``."""
+        wid, game = self._week_of(game_id)
+        other = self._copy(wid)
+        other.games[wid] = [
+            GameRec(g.id, g.week_id, g.home_team, g.away_team, g.spread_x2, g.favorite, home_score, away_score, final)
+            if g is game else g for g in self.games[wid]]
+        return other
+
+    def with_pick(self, user_id, game_id, picked_team):
+        """A copy where ``user_id`` picked ``picked_team`` in ``game_id`` (None removes the pick)."""
+        wid, _ = self._week_of(game_id)
+        other = self._copy(wid)
+        kept = [p for p in self.picks.get(wid, ()) if not (p.user_id == user_id and p.game_id == game_id)]
+        if picked_team is not None:
+            kept.append(PickRec(user_id, game_id, picked_team))
+        other.picks[wid] = kept
+        return other
+
+    def with_completed(self, week_id, completed=True):
+        """A copy that treats ``week_id`` as completed (or not)."""
+        weeks = [WeekRec(w.id, w.week_number, completed) if w.id == week_id else w for w in self.weeks]
+        return self._copy(None, weeks)
+
+    def completed_weeks(self):
+        return [w for w in self.weeks if w.is_completed]
+
+    def weekly_prize(self):
+        weeks = self.completed_weeks()
+        return weekly_prize(weeks, {w.id: self.results(w.id) for w in weeks}, self.users)
+
+    def yearly_standings(self):
+        weeks = self.completed_weeks()
+        return yearly_standings(self.total_weeks, weeks, {w.id: self.results(w.id) for w in weeks},
+                                [self.users[uid] for uid in self._user_ids])
+
+    def yearly_winners(self):
+        return yearly_winners(self.yearly_standings())
@@ -0,0 +1,62 @@
+"""
+Season enrollment: which players are entered in a season's prize pool.
+
+Both operations are set-based, a fixed number of statements however many
+players are involved: enrollment is one INSERT ... SELECT of the active
+players without an entry, and marking paid is one UPDATE of the existing
+entries plus one INSERT ... SELECT for listed players not yet entered.
+"""
+
+from sqlalchemy import case, exists, insert, literal, or_, select, update
+from app import db
+from app.cache import page_cache
+from app.models import User, SeasonEntry
+
+
+def _not_entered(season_id):
+    return ~exists().where(SeasonEntry.season_id == season_id, SeasonEntry.user_id == User.id)
+
+
+def _enter(season_id, where, has_paid, amount_paid):
+    """INSERT ... SELECT an entry for each user matching ``where`` who isn't entered; returns rows added."""
+    chosen = select(literal(season_id), User.id, literal(has_paid), literal(amount_paid)).where(
+        where, _not_entered(season_id))
+    stmt = insert(SeasonEntry).from_select(
+        [SeasonEntry.season_id, SeasonEntry.user_id, SeasonEntry.has_paid, SeasonEntry.amount_paid], chosen)
+    return db.session.execute(stmt).rowcount
+
+
+def enroll_active_players(season):
+    """Enter every active player not yet in ``season``; returns how many were added."""
+    count = _enter(season.id, User.is_active_player.is_(True), False, None)
+    db.session.commit()
+    page_cache.bump(season.id)
+    return count
+
+
+def mark_paid(season, user_ids, paid=True):
+    """Set ``user_ids``' entries in ``season`` paid (or unpaid); returns {'updated', 'entered'} counts.
+
+    Marking paid fills in the entry fee where no amount was recorded and
+    enters listed players who had no entry, as the per-player toggle does.
+    Entries already in the requested state are left alone and not counted.
+    """
+    user_ids = sorted({int(uid) for uid in user_ids})
+    if not user_ids:
+        return {'updated': 0, 'entered': 0}
+    values = {'has_paid': paid}
+    if paid:
+        values['amount_paid'] = case(
+            (or_(SeasonEntry.amount_paid.is_(None), SeasonEntry.amount_paid == 0), season.entry_fee),
+            else_=SeasonEntry.amount_paid)
+    stmt = (update(SeasonEntry)
+            .where(SeasonEntry.season_id == season.id, SeasonEntry.user_id.in_(user_ids),
+                   SeasonEntry.has_paid.isnot(True) if paid else SeasonEntry.has_paid.is_(True))
+            .values(**values)
+            .execution_options(synchronize_session=False))
+    updated = db.session.execute(stmt).rowcount
+    entered = _enter(season.id, User.id.in_(user_ids), True, season.entry_fee) if paid else 0
+    db.session.commit()
+    if updated or entered:
+        page_cache.bump(season.id)
+    return {'updated': updated, 'entered': entered}
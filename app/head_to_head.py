@@ -0,0 +1,106 @@
+"""
+Season head-to-head comparisons.
+
+For any two players: how many games they both picked, how often they took
+the same side, and what each scored on the games both had scored. Each
+completed week is packed once into per-player bitmasks (home picks, away
+picks, scored picks and six bit-planes of the points) from its
+WeekPickMatrix and cached under the week's picks generation, so a week is
+only re-packed when its picks or scores change. A season is those masks
+shifted side by side, and every pair then costs a handful of AND and
+popcount operations on Python ints instead of a loop over games.
+
+Points are stored doubled so half-point spreads stay exact.
+"""
+
+import json
+from app.cache import page_cache
+from app.pick_matrix import WeekPickMatrix, HOME, AWAY
+
+_PLANES = 6
+_OFFSET = 30  # doubled points run -30..30; shifted into 0..60 fits six bits
+
+
+def _pack_week(matrix):
+    """(game count, {user_id: [home, away, scored, plane0..plane5]})."""
+    masks = {}
+    for uid in matrix.user_ids:
+        row = [0] * (3 + _PLANES)
+        for j, gid in enumerate(matrix.game_ids):
+            side = matrix.pick(uid, gid)
+            if side == HOME:
+                row[0] |= 1 << j
+            elif side == AWAY:
+                row[1] |= 1 << j
+            else:
+                continue
+            pts2 = matrix.points_x2_for(uid, gid)
+            if pts2 is None:
+                continue
+            row[2] |= 1 << j
+            v = pts2 + _OFFSET
+            for k in range(_PLANES):
+                if v >> k & 1:
+                    row[3 + k] |= 1 << j
+        masks[uid] = row
+    return len(matrix.game_ids), masks
+
+
+def week_masks(week_id):
+    """Packed masks for ``week_id``, cached until its picks or scores change."""
+    from app import db
+    if not page_cache.enabled:
+        return _pack_week(WeekPickMatrix.for_week(db.session, week_id))
+    key = f'h2h_week:{week_id}:g{page_cache.generation(f"picks:{week_id}")}'
+    cached = page_cache.get(key)
+    if cached is not None:
+        data = json.loads(cached)
+        return data['games'], {int(uid): row for uid, row in data['masks'].items()}
+    n_games, masks = _pack_week(WeekPickMatrix.for_week(db.session, week_id))
+    page_cache.set(key, json.dumps({'games': n_games, 'masks': masks}))
+    return n_games, masks
+
+
+class HeadToHead:
+    def __init__(self, masks):
+        self.masks = masks
+
+    @classmethod
+    def for_weeks(cls, week_ids):
+        """Concatenate each week's masks into one bit range per player."""
+        season = {}
+        offset = 0
+        for week_id in week_ids:
+            n_games, masks = week_masks(week_id)
+            for uid, row in masks.items():
+                acc = season.setdefault(uid, [0] * (3 + _PLANES))
+                for k, m in enumerate(row):
+                    acc[k] |= m << offset
+            offset += n_games
+        return cls(season)
+
+    @staticmethod
+    def _points(row, both):
+        total = 0
+        for k in range(_PLANES):
+            total += (row[3 + k] & both).bit_count() << k
+        return (total - _OFFSET * both.bit_count()) / 2
+
+    def compare(self, a, b):
+        """(games both picked, same side, a's points, b's points on games both had scored)."""
+        ra, rb = self.masks.get(a), self.masks.get(b)
+        if ra is None or rb is None:
+            return 0, 0, 0.0, 0.0
+        both = (ra[0] | ra[1]) & (rb[0] | rb[1])
+        agreed = (ra[0] & rb[0]) | (ra[1] & rb[1])
+        scored = ra[2] & rb[2]
+        return both.bit_count(), agreed.bit_count(), self._points(ra, scored), self._points(rb, scored)
+
+    def row(self, user_id):
+        """{opponent_id: compare(user_id, opponent_id)} for every other player."""
+        return {uid: self.compare(user_id, uid) for uid in self.masks if uid != user_id}
+
+    def matrix(self):
+        """{(a, b): compare(a, b)} for every pair with a < b."""
+        uids = sorted(self.masks)
+        return {(a, b): self.compare(a, b) for i, a in enumerate(uids) for b in uids[i + 1:]}
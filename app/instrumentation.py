@@ -0,0 +1,157 @@
+"""
+Per-request SQL instrumentation.
+
+Hooks the SQLAlchemy engine to count and time every statement issued while
+a request is being handled, groups statements that differ only in their
+parameters to flag N+1 patterns, and writes one structured log line per
+request. Set SQL_SERVER_TIMING to also expose the numbers in a
+``Server-Timing`` response header.
+"""
+
+import json
+import re
+import time
+from contextlib import contextmanager
+from flask import g, has_app_context, request, current_app
+from sqlalchemy import event
+from app.metrics import record_request
+from app.slow_queries import record_if_slow
+
+_WS_RE = re.compile(r'\s+')
+_IN_LIST_RE = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_NUM_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+_STR_RE = re.compile(r"'(?:[^']|'')*'")
+
+# Active capture_queries() blocks; every statement is recorded into each.
+_captures = []
+
+
+def normalize_sql(statement):
+    """Collapse whitespace, literals and expanded IN lists so repeats group together."""
+    s = _WS_RE.sub(' ', statement).strip()
+    s = _STR_RE.sub('?', s)
+    s = _NUM_RE.sub('?', s)
+    return _IN_LIST_RE.sub('(?)', s)
+
+
+class QueryStats:
+    """Statement count, total time and per-normalized-statement breakdown."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.queries = []
+        self.by_statement = {}
+
+    def record(self, statement, duration):
+        self.count += 1
+        self.duration += duration
+        self.queries.append((statement, duration))
+        key = normalize_sql(statement)
+        entry = self.by_statement.get(key)
+        if entry is None:
+            self.by_statement[key] = [1, duration]
+        else:
+            entry[0] += 1
+            entry[1] += duration
+
+    def repeated(self, threshold):
+        """Normalized statements issued at least ``threshold`` times, worst first."""
+        rows = [(sql, n, dur) for sql, (n, dur) in self.by_statement.items() if n >= threshold]
+        rows.sort(key=lambda r: (-r[1], -r[2]))
+        return rows
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('query_start_time')
+    if not starts:
+        return
+    duration = time.perf_counter() - starts.pop()
+    record_if_slow(conn, cursor, statement, parameters, executemany, duration)
+    for stats in _captures:
+        stats.record(statement, duration)
+    if has_app_context():
+        stats = g.get('_query_stats')
+        if stats is not None:
+            stats.record(statement, duration)
+
+
+def current_query_stats():
+    """QueryStats for the request being handled, or None outside a request."""
+    if not has_app_context():
+        return None
+    return g.get('_query_stats')
+
+
+@contextmanager
+def capture_queries():
+    """Record every statement issued inside the block, on any thread or request."""
+    stats = QueryStats()
+    _captures.append(stats)
+    try:
+        yield stats
+    finally:
+        _captures.remove(stats)
+
+
+@contextmanager
+def assert_max_queries(max_count):
+    """Fail with the captured statements if the block issues more than ``max_count``."""
+    with capture_queries() as stats:
+        yield stats
+    if stats.count > max_count:
+        lines = '\n'.join(f'  {n}x {sql}' for sql, (n, _) in stats.by_statement.items())
+        raise AssertionError(f'{stats.count} queries issued, expected at most {max_count}:\n{lines}')
+
+
+def _start_request():
+    g._query_stats = QueryStats()
+    g._request_start = time.perf_counter()
+
+
+def _finish_request(response):
+    stats = g.pop('_query_stats', None)
+    start = g.pop('_request_start', None)
+    if stats is None or start is None:
+        return response
+    total = time.perf_counter() - start
+    record_request(request.endpoint, request.method, response.status_code, total, stats)
+    threshold = current_app.config.get('SQL_N_PLUS_ONE_THRESHOLD', 5)
+    repeated = stats.repeated(threshold)
+    if current_app.config.get('SQL_SERVER_TIMING'):
+        response.headers.add(
+            'Server-Timing',
+            f'db;dur={stats.duration * 1000:.2f};desc="{stats.count} queries", '
+            f'app;dur={total * 1000:.2f}',
+        )
+    record = {
+        'method': request.method,
+        'path': request.path,
+        'endpoint': request.endpoint,
+        'status': response.status_code,
+        'duration_ms': round(total * 1000, 2),
+        'queries': stats.count,
+        'db_ms': round(stats.duration * 1000, 2),
+    }
+    if repeated:
+        record['n_plus_one'] = [{'sql': sql, 'count': n} for sql, n, _ in repeated]
+        current_app.logger.warning('request %s', json.dumps(record))
+    else:
+        current_app.logger.info('request %s', json.dumps(record))
+    return response
+
+
+def init_instrumentation(app):
+    """Attach the engine listeners and the per-request hooks to ``app``."""
+    from app import db
+    with app.app_context():
+        engine = db.engine
+        if not event.contains(engine, 'before_cursor_execute', _before_cursor_execute):
+            event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
@@ -0,0 +1,249 @@
+"""
+Background admin jobs.
+
+Slow admin actions (fetching odds, calculating a week, enrolling players,
+recomputing a season, importing users) are queued as rows in the ``jobs`` table and run on a
+per-process thread pool, so the request that queues one returns at once.
+The threads only wait on the odds providers and the database, and a
+season recompute can still fan its scoring out to processes of its own
+(RECOMPUTE_WORKERS).
+
+Each job has a de-duplication key, by default its kind and parameters. A
+partial unique index allows one queued or running job per key, so a
+double click, or two admins in two worker processes, gets the job that is
+already in flight instead of a second copy. Progress, timings, the result
+message, any per-item result and any error are written back to the row,
+which the admin status page polls. Jobs record the pid that runs them; at startup any job still
+marked active whose process is gone is marked failed, so a restart never
+leaves a key locked.
+
+With JOB_WORKERS = 0 jobs run inside the request that queues them, which
+keeps tests and single-threaded debugging deterministic.
+"""
+
+import json
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from flask import current_app
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.metrics import JOBS, JOB_DURATION
+from app.models import Job, Season, Week
+from app.odds import fetch_odds_for_week
+from app.scoring import calculate_week_results
+from app.entries import enroll_active_players
+from app.recompute import recompute_season
+from app.user_import import create_users, take_staged_import
+
+ACTIVE = ('queued', 'running')
+PROGRESS_INTERVAL = 0.5  # seconds between progress writes
+
+_handlers = {}
+
+
+def job(kind):
+    """Register ``fn(progress, **params)`` as the handler for ``kind``.
+
+    It returns the result message, or (message, result) where ``result`` is
+    JSON-serialisable detail stored on the job for its status page.
+    """
+    def register(fn):
+        _handlers[kind] = fn
+        return fn
+    return register
+
+
+def job_key(kind, params):
+    return kind + ':' + ','.join(f'{k}={params[k]}' for k in sorted(params))
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class JobRunner:
+    def __init__(self):
+        self.app = None
+        self.workers = 0
+        self._pool = None
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def configure(self, app, workers=0):
+        self.app = app
+        self.workers = workers
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job') if workers else None
+
+    def submit(self, kind, created_by=None, **params):
+        """(job, created): the in-flight job with the same key, or a new one queued to run."""
+        if kind not in _handlers:
+            raise ValueError(f'Unknown job kind {kind!r}')
+        key = job_key(kind, params)
+        existing = Job.query.filter(Job.key == key, Job.status.in_(ACTIVE)).first()
+        if existing is not None:
+            return existing, False
+        new = Job(kind=kind, key=key, params=json.dumps(params), status='queued', worker_pid=os.getpid(),
+                  created_by=created_by)
+        db.session.add(new)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return Job.query.filter(Job.key == key, Job.status.in_(ACTIVE)).first(), False
+        job_id = new.id
+        if self._pool is None:
+            self.run(job_id)
+            db.session.expire(new)
+        else:
+            with self._lock:
+                self._futures[job_id] = self._pool.submit(self.run, job_id)
+        return new, True
+
+    def run(self, job_id):
+        """Run one queued job to completion in a fresh app context, recording the outcome."""
+        with self.app.app_context():
+            row = db.session.get(Job, job_id)
+            row.status, row.started_at = 'running', _now()
+            db.session.commit()
+            kind, params = row.kind, json.loads(row.params)
+            last = [0.0]
+
+            def progress(done, total, message=None):
+                # its own short transaction, so the job's own work stays uncommitted
+                if done < total and time.monotonic() - last[0] < PROGRESS_INTERVAL:
+                    return
+                last[0] = time.monotonic()
+                values = {'progress_done': done, 'progress_total': total}
+                if message is not None:
+                    values['message'] = message
+                with db.engine.begin() as conn:
+                    conn.execute(update(Job).where(Job.id == job_id).values(**values))
+
+            start = time.perf_counter()
+            result = None
+            try:
+                message, status, error = _handlers[kind](progress, **params), 'done', None
+                if isinstance(message, tuple):
+                    message, result = message
+            except Exception:
+                db.session.rollback()
+                current_app.logger.exception('Job %s (%s) failed', job_id, kind)
+                message, status, error = None, 'failed', traceback.format_exc(limit=8)
+            elapsed = time.perf_counter() - start
+            row = db.session.get(Job, job_id)
+            row.status, row.finished_at, row.error = status, _now(), error
+            if message is not None:
+                row.message = message
+            if result is not None:
+                row.result = json.dumps(result)
+            db.session.commit()
+            JOBS.inc(kind=kind, status=status)
+            JOB_DURATION.observe(elapsed, kind=kind)
+        with self._lock:
+            self._futures.pop(job_id, None)
+
+    def wait(self, timeout=None):
+        """Block until every job this process has queued so far has finished."""
+        with self._lock:
+            pending = list(self._futures.values())
+        for future in pending:
+            future.result(timeout)
+
+    def recover(self):
+        """Fail active jobs whose worker process is gone (or is this process, restarted)."""
+        stale = [j for j in Job.query.filter(Job.status.in_(ACTIVE))
+                 if j.id not in self._futures
+                 and (j.worker_pid is None or j.worker_pid == os.getpid() or not _pid_alive(j.worker_pid))]
+        for j in stale:
+            j.status, j.finished_at, j.error = 'failed', _now(), 'Interrupted: the worker process exited.'
+        if stale:
+            db.session.commit()
+        return len(stale)
+
+
+job_runner = JobRunner()
+
+
+def recent_jobs(limit=50):
+    return Job.query.order_by(Job.id.desc()).limit(limit).all()
+
+
+def job_status(row):
+    """JSON-ready status of one job for the polling status page."""
+    return {
+        'id': row.id, 'kind': row.kind, 'status': row.status,
+        'progress_done': row.progress_done, 'progress_total': row.progress_total,
+        'message': row.message, 'error': row.error, 'finished': row.is_finished, 'has_result': row.result is not None,
+        'duration': None if row.duration is None else round(row.duration, 2),
+    }
+
+
+def _week(week_id):
+    week = db.session.get(Week, week_id)
+    if week is None:
+        raise LookupError(f'Week {week_id} not found.')
+    return week
+
+
+def _season(season_id):
+    season = db.session.get(Season, season_id)
+    if season is None:
+        raise LookupError(f'Season {season_id} not found.')
+    return season
+
+
+@job('fetch_odds')
+def _fetch_odds(progress, week_id):
+    week = _week(week_id)
+    return f'Fetched/updated {fetch_odds_for_week(week)} games for Week {week.week_number}.'
+
+
+@job('calculate_results')
+def _calculate_results(progress, week_id):
+    week = _week(week_id)
+    calculate_week_results(week)
+    return f'Results calculated for Week {week.week_number}.'
+
+
+@job('add_all_entries')
+def _add_all_entries(progress, season_id):
+    season = _season(season_id)
+    return f'Added {enroll_active_players(season)} players to season {season.year}.'
+
+
+@job('recompute_season')
+def _recompute_season(progress, season_id):
+    season = _season(season_id)
+    summary = recompute_season(season, workers=current_app.config.get('RECOMPUTE_WORKERS', 0),
+                               progress=lambda done, total, wn: progress(done, total, f'Week {wn} scored'))
+    return f'Recomputed {summary["weeks"]} weeks ({summary["picks"]} picks) for {season.year}.'
+
+
+@job('import_users')
+def _import_users(progress, batch, filename):
+    report, valid = take_staged_import(batch)
+    report = create_users(report, valid, workers=current_app.config.get('IMPORT_HASH_WORKERS', 0), threads=True,
+                          progress=lambda done, total: progress(done, total, f'{done} of {total} passwords hashed'))
+    created = sum(1 for entry in report if entry['status'] == 'created')
+    return f'Created {created} of {len(report)} users from {filename}.', {'filename': filename, 'rows': report}
+
+
+def init_jobs(app):
+    job_runner.configure(app, app.config.get('JOB_WORKERS', 0))
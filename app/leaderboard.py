@@ -0,0 +1,112 @@
+"""
+All-time leaderboard.
+
+``season_totals`` holds each player's sums over a season's completed weeks,
+plus whether they won the season once every week is complete. It is
+refreshed for one season whenever that season's week results are
+calculated or a week is completed, and ``all_time_standings`` is then
+rebuilt from it with a single INSERT ... SELECT, so its cost depends on the
+number of seasons, never on the number of weekly results. The all-time page
+reads ``all_time_standings`` in one query ordered by its indexed
+``total_points_x2``. A refresh that finds another scored season with no
+totals recomputes them all. ``flask rebuild-all-time`` recomputes every season from
+scratch.
+"""
+
+import click
+from sqlalchemy import Integer, cast, func, select
+from sqlalchemy.orm import joinedload
+from app import db
+from app.models import Season, Week, WeeklyResult, SeasonTotal, AllTimeStanding
+
+
+def _refresh_season_totals(season):
+    from app.scoring import get_yearly_winners
+    rows = (
+        db.session.query(
+            WeeklyResult.user_id, func.sum(WeeklyResult.total_points_x2), func.sum(WeeklyResult.weekly_win_share),
+            func.sum(WeeklyResult.winning_picks), func.sum(WeeklyResult.num_picks),
+        )
+        .join(Week, Week.id == WeeklyResult.week_id)
+        .filter(Week.season_id == season.id, Week.is_completed.is_(True))
+        .group_by(WeeklyResult.user_id)
+        .all()
+    )
+    winners = set()
+    if rows and Week.query.filter_by(season_id=season.id, is_completed=True).count() >= season.total_weeks:
+        winners = {w['user'].id for w in get_yearly_winners(season)}
+    SeasonTotal.query.filter_by(season_id=season.id).delete()
+    if rows:
+        db.session.execute(SeasonTotal.__table__.insert(), [
+            {'season_id': season.id, 'user_id': user_id, 'total_points_x2': points or 0, 'weekly_wins': wins or 0,
+             'winning_picks': winning or 0, 'num_picks': picks or 0, 'yearly_win': user_id in winners}
+            for user_id, points, wins, winning, picks in rows
+        ])
+
+
+def _rebuild_all_time():
+    AllTimeStanding.query.delete()
+    totals = select(
+        SeasonTotal.user_id, func.sum(SeasonTotal.total_points_x2), func.sum(SeasonTotal.weekly_wins),
+        func.sum(cast(SeasonTotal.yearly_win, Integer)), func.count(SeasonTotal.season_id),
+        func.sum(SeasonTotal.winning_picks), func.sum(SeasonTotal.num_picks),
+    ).group_by(SeasonTotal.user_id)
+    db.session.execute(AllTimeStanding.__table__.insert().from_select(
+        ['user_id', 'total_points_x2', 'weekly_wins', 'yearly_wins', 'seasons_played', 'winning_picks', 'num_picks'],
+        totals))
+
+
+def _seasons_missing_totals(season_id):
+    """Other seasons with completed, scored weeks but no ``season_totals`` rows yet."""
+    return (
+        db.session.query(Week.season_id)
+        .join(WeeklyResult, WeeklyResult.week_id == Week.id)
+        .filter(Week.season_id != season_id, Week.is_completed.is_(True),
+                ~select(SeasonTotal.season_id).where(SeasonTotal.season_id == Week.season_id).exists())
+        .first()
+    )
+
+
+def refresh_all_time(season_id):
+    """Call after a season's results or completed weeks change; the caller commits.
+
+    If an earlier season has never been totalled (a database upgraded from
+    before ``season_totals`` existed), every season is recomputed instead so
+    the all-time table never silently drops it.
+    """
+    season = db.session.get(Season, season_id)
+    if season is None:
+        return
+    if _seasons_missing_totals(season_id) is not None:
+        recompute_all_time()
+        return
+    _refresh_season_totals(season)
+    _rebuild_all_time()
+    db.session.flush()
+
+
+def recompute_all_time():
+    """Rebuild every season's totals and the all-time table in one batch; the caller commits."""
+    seasons = Season.query.order_by(Season.year).all()
+    for season in seasons:
+        _refresh_season_totals(season)
+    _rebuild_all_time()
+    db.session.flush()
+    return len(seasons)
+
+
+def all_time_leaderboard():
+    return (AllTimeStanding.query.options(joinedload(AllTimeStanding.user))
+            .order_by(AllTimeStanding.total_points_x2.desc(), AllTimeStanding.yearly_wins.desc()).all())
+
+
+@click.command('rebuild-all-time')
+def rebuild_all_time_command():
+    """Recompute season totals and the all-time leaderboard from weekly results."""
+    count = recompute_all_time()
+    db.session.commit()
+    click.echo(f'Rebuilt all-time standings from {count} season(s).')
+
+
+def init_leaderboard(app):
+    app.cli.add_command(rebuild_all_time_command)
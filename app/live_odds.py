@@ -0,0 +1,185 @@
+"""
+Live weekly-winner probabilities.
+
+Each unfinished game's final margin is a discretised normal distribution:
+centred on the current score margin with LIVE_STDDEV once a score has been
+posted, or on the spread with PREGAME_STDDEV before kickoff. Games are
+independent of each other, but players are not: everyone who picked a game
+is scored from the same final margin, so the chances are worked out over
+joint outcomes of the unfinished games rather than per player.
+
+A player's week is encoded as one integer key, doubled points * (games + 1)
++ winning picks, so adding keys adds both numbers and ordering keys orders
+players by points and then by the winning-picks tiebreak. Each game's
+margins collapse to the distinct (favorite key, other-side key) outcomes,
+and games every eligible player picked the same way are left out because
+they move every total alike. The chances are exact: a walk over the
+remaining games carries every distinct standing, each player's key relative
+to the leader, with its probability. After each game, players whose best
+remaining case cannot reach the leader's worst case drop out, as does any
+player behind someone with the same remaining picks, so outcomes that only
+reshuffle the field below the contenders merge into one standing. A week
+that would take more than MAX_WORK key updates is too open to call and gets
+no odds until more games finish.
+"""
+
+import json
+import math
+from operator import add
+from app import db
+from app.cache import page_cache
+from app.models import Game, Pick, User, spread_points_x2
+
+LIVE_STDDEV = 9.0
+PREGAME_STDDEV = 13.5
+TAIL_SDS = 8  # margins further than this many deviations from the centre are left out
+MIN_PICKS = 4
+MAX_WORK = 1_000_000  # player key updates before a week counts as too open to call
+OUT = -math.inf  # key of a player who can no longer win
+
+
+def margin_distribution(game):
+    """[(home margin, probability)] for ``game``'s final score."""
+    if game.home_score is not None and game.away_score is not None:
+        centre, sd = game.home_score - game.away_score, LIVE_STDDEV
+    else:
+        line = abs(game.spread or 0)
+        centre = line if game.favorite == 'home' else -line if game.favorite == 'away' else 0
+        sd = PREGAME_STDDEV
+    margins = range(math.ceil(centre - TAIL_SDS * sd), math.floor(centre + TAIL_SDS * sd) + 1)
+    weights = [math.exp(-((m - centre) ** 2) / (2 * sd * sd)) for m in margins]
+    total = sum(weights)
+    return [(m, w / total) for m, w in zip(margins, weights)]
+
+
+def pick_keys(game, stride):
+    """[(probability, key for a pick on the favorite, key for any other pick)] per final margin of ``game``."""
+    out = []
+    for margin, p in margin_distribution(game):
+        keys = []
+        for picked_favorite in (True, False):
+            pts2 = spread_points_x2(margin, 0, game.spread_x2, game.favorite, picked_favorite) or 0
+            keys.append(pts2 * stride + (pts2 > 0))
+        out.append((p, keys[0], keys[1]))
+    return out
+
+
+def _outcomes(margins):
+    """Merge margins that score every pick the same: [(probability, favorite key, other key)]."""
+    merged = {}
+    for p, fav, other in margins:
+        merged[fav, other] = merged.get((fav, other), 0.0) + p
+    return [(p, fav, other) for (fav, other), p in merged.items()]
+
+
+def _prune(keys, worst, best, groups):
+    """Drop players who can no longer reach the top, then every player beaten by one with the same remaining picks."""
+    floor = max(map(add, keys, worst))
+    keys = [k if reach >= floor else OUT for k, reach in zip(keys, map(add, keys, best))]
+    for group in groups:
+        top = max(keys[i] for i in group)
+        for i in group:
+            if keys[i] < top:
+                keys[i] = OUT
+    top = max(keys)
+    return tuple(k - top for k in keys)
+
+
+def _credit(odds, keys, weight):
+    """Split ``weight`` between the players sharing the top key."""
+    top = max(keys)
+    winners = [i for i, k in enumerate(keys) if k == top]
+    for i in winners:
+        odds[i] += weight / len(winners)
+
+
+def standings_odds(games, sides, start, stride):
+    """Exact {player index: chance of winning}, or None once the week is too open to walk.
+
+    ``sides[i]`` maps each game id to True for a pick on the favorite and
+    False for any other pick; ``start`` holds each player's key so far.
+    """
+    if not sides:
+        return {}
+    steps = []
+    for g in games:
+        picked = [side.get(g.id) for side in sides]
+        steps.append((picked, [(p, tuple(0 if side is None else fav if side else other for side in picked))
+                               for p, fav, other in _outcomes(pick_keys(g, stride))]))
+    # lowest and highest key each player can still add from step s on
+    worst, best = [[0] * len(sides)], [[0] * len(sides)]
+    for _, outcomes in reversed(steps):
+        worst.insert(0, [w + min(col) for w, col in zip(worst[0], zip(*(d for _, d in outcomes)))])
+        best.insert(0, [b + max(col) for b, col in zip(best[0], zip(*(d for _, d in outcomes)))])
+    groups = []
+    for s in range(len(steps) + 1):
+        remaining = {}
+        for i in range(len(sides)):
+            remaining.setdefault(tuple(picked[i] for picked, _ in steps[s:]), []).append(i)
+        groups.append([g for g in remaining.values() if len(g) > 1])
+    odds = dict.fromkeys(range(len(sides)), 0.0)
+    states = {_prune(start, worst[0], best[0], groups[0]): 1.0}
+    work = 0
+    for s, (_, outcomes) in enumerate(steps, 1):
+        merged = {}
+        for keys, weight in states.items():
+            for p, delta in outcomes:
+                nxt = list(map(add, keys, delta))
+                if s == len(steps):
+                    _credit(odds, nxt, weight * p)
+                    continue
+                nxt = _prune(nxt, worst[s], best[s], groups[s])
+                merged[nxt] = merged.get(nxt, 0.0) + weight * p
+            work += len(outcomes) * (len(keys) + 5)  # a standing costs about five players' updates to merge
+            if work > MAX_WORK:
+                return None
+        states = merged
+    for keys, weight in states.items():
+        _credit(odds, keys, weight)
+    return odds
+
+
+def week_outlook(games, picks):
+    """{user_id: win chance} for one week's ``games`` and (user_id, game_id, team) ``picks``.
+
+    Empty when the week is still too open to work out exactly.
+    """
+    stride = len(games) + 1
+    by_id = {g.id: g for g in games}
+    fixed, unfinished, counts = {}, {}, {}
+    for uid, gid, team in picks:
+        g = by_id[gid]
+        counts[uid] = counts.get(uid, 0) + 1
+        if g.is_final:
+            pts2 = g.calculate_points_x2(team) or 0
+            fixed[uid] = fixed.get(uid, 0) + pts2 * stride + (pts2 > 0)
+        else:
+            unfinished.setdefault(uid, {})[gid] = team == g.favored_team
+    eligible = [uid for uid, n in counts.items() if n >= MIN_PICKS]
+    sides = [unfinished.get(uid, {}) for uid in eligible]
+    # a game everyone picked the same way adds the same key to every total, so it never changes the winner
+    contested = sorted({gid for side in sides for gid in side
+                        if len({side.get(gid) for side in sides}) > 1})
+    odds = standings_odds([by_id[gid] for gid in contested], sides, [fixed.get(uid, 0) for uid in eligible], stride)
+    if odds is None:
+        return {}
+    chances = dict.fromkeys(counts, 0.0)
+    chances.update({eligible[i]: p for i, p in odds.items()})
+    return chances
+
+
+def week_win_odds(week_id):
+    """{user_id: win chance} for ``week_id``, cached until its picks or scores change."""
+    key = f'win_odds:{week_id}:g{page_cache.generation(f"picks:{week_id}")}'
+    cached = page_cache.get(key) if page_cache.enabled else None
+    if cached is not None:
+        return {int(uid): p for uid, p in json.loads(cached).items()}
+    games = Game.query.filter_by(week_id=week_id).all()
+    picks = (db.session.query(Pick.user_id, Pick.game_id, Pick.picked_team)
+             .join(User, User.id == Pick.user_id)
+             .filter(Pick.game_id.in_([g.id for g in games]), User.is_active_player.is_(True))
+             .all()) if games else []
+    odds = week_outlook(games, picks)
+    if page_cache.enabled:
+        page_cache.set(key, json.dumps(odds))
+    return odds
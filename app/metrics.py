@@ -0,0 +1,367 @@
+"""
+Prometheus-format metrics.
+
+Counters, gauges and histograms are sharded per thread: each thread only
+ever writes to its own dict, so recording a sample takes no lock. A scrape
+merges the shards. When a thread exits its shard is folded into a base dict,
+so short-lived threads don't pile up shards. When METRICS_DIR is set, every
+worker process periodically writes its merged snapshot to
+``<METRICS_DIR>/metrics-<pid>.json`` and the /metrics endpoint sums the
+snapshots of all live processes, so the numbers are correct behind a
+multi-process server. When a process exits, the next scrape folds its
+counters and histograms into ``metrics-retired.json`` and deletes its
+snapshot, so totals never go backwards when a worker is recycled; its
+gauges describe a process that is gone and are dropped.
+"""
+
+import atexit
+import fcntl
+import json
+import os
+import threading
+import time
+import weakref
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+
+RETIRED = 'metrics-retired.json'
+DEFAULT_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+_registry = []
+_flush_lock = threading.Lock()
+_last_flush = [0.0]
+_metrics_dir = [None]
+
+
+class _ThreadToken:
+    """Lives in a thread's local storage; dropped, and so finalized, when the thread exits."""
+    __slots__ = ('__weakref__',)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards = []
+        self._base = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _shard(self):
+        d = getattr(self._local, 'd', None)
+        if d is None:
+            d = {}
+            self._local.d = d
+            self._local.token = _ThreadToken()
+            weakref.finalize(self._local.token, self._retire, d)
+            with self._lock:
+                self._shards.append(d)
+        return d
+
+    def _retire(self, d):
+        """Fold an exited thread's shard into the base dict."""
+        with self._lock:
+            self._shards = [s for s in self._shards if s is not d]
+            for k, v in d.items():
+                self._base[k] = self._merge(self._base.get(k), v)
+
+    def _key(self, labels):
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def collect(self):
+        """Merge every thread's shard into {label values: value}."""
+        with self._lock:
+            shards = list(self._shards)
+            merged = {k: self._merge(None, v) for k, v in self._base.items()}
+        for d in shards:
+            for k, v in list(d.items()):
+                merged[k] = self._merge(merged.get(k), v)
+        return merged
+
+    @staticmethod
+    def _merge(a, b):
+        return b if a is None else a + b
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        d = self._shard()
+        k = self._key(labels)
+        d[k] = d.get(k, 0) + amount
+
+
+class Gauge(_Metric):
+    """Gauge that only moves by deltas, so per-thread shards sum correctly."""
+    kind = 'gauge'
+
+    def inc(self, amount=1, **labels):
+        d = self._shard()
+        k = self._key(labels)
+        d[k] = d.get(k, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        d = self._shard()
+        k = self._key(labels)
+        v = d.get(k)
+        if v is None:
+            # one slot per bucket, then +Inf, then sum
+            v = d[k] = [0] * (len(self.buckets) + 1) + [0.0]
+        v[bisect_left(self.buckets, value)] += 1
+        v[-1] += value
+
+    @staticmethod
+    def _merge(a, b):
+        if a is None:
+            return list(b)
+        return [x + y for x, y in zip(a, b)]
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+
+# ── Metric definitions ───────────────────────────────────────────
+
+REQUEST_DURATION = Histogram(
+    'pickem_http_request_duration_seconds', 'HTTP request latency by endpoint.',
+    ('endpoint', 'method'))
+REQUESTS = Counter(
+    'pickem_http_requests_total', 'HTTP responses by endpoint and status.',
+    ('endpoint', 'method', 'status'))
+DB_QUERIES = Counter(
+    'pickem_db_queries_total', 'SQL statements issued, by endpoint.', ('endpoint',))
+DB_DURATION = Histogram(
+    'pickem_db_request_duration_seconds', 'Total SQL time per request, by endpoint.', ('endpoint',))
+SCORING_DURATION = Histogram(
+    'pickem_operation_duration_seconds',
+    'Scoring, standings and odds-refresh timings.', ('operation',))
+ODDS_PROVIDER_DURATION = Histogram(
+    'pickem_odds_provider_request_duration_seconds', 'Odds provider call latency.', ('provider',))
+ODDS_PROVIDER_ERRORS = Counter(
+    'pickem_odds_provider_errors_total', 'Failed odds provider calls.', ('provider',))
+EMAIL_QUEUE_DEPTH = Gauge(
+    'pickem_email_queue_depth', 'Confirmation emails waiting on the SMTP server.')
+EMAILS = Counter('pickem_emails_total', 'Confirmation emails by result.', ('result',))
+JOBS = Counter('pickem_jobs_total', 'Background admin jobs finished, by kind and status.', ('kind', 'status'))
+JOB_DURATION = Histogram(
+    'pickem_job_duration_seconds', 'Background admin job run time.', ('kind',),
+    buckets=(.1, .5, 1, 2.5, 5, 10, 30, 60, 120, 300))
+
+
+def timed(operation):
+    """Decorator recording the wrapped call in SCORING_DURATION."""
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            with SCORING_DURATION.time(operation=operation):
+                return f(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def track_provider(provider):
+    """Time an odds provider call and count it as an error if it raises."""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        ODDS_PROVIDER_ERRORS.inc(provider=provider)
+        raise
+    finally:
+        ODDS_PROVIDER_DURATION.observe(time.perf_counter() - start, provider=provider)
+
+
+def record_request(endpoint, method, status, duration, query_stats=None):
+    endpoint = endpoint or 'unknown'
+    REQUEST_DURATION.observe(duration, endpoint=endpoint, method=method)
+    REQUESTS.inc(endpoint=endpoint, method=method, status=status)
+    if query_stats is not None:
+        DB_QUERIES.inc(query_stats.count, endpoint=endpoint)
+        DB_DURATION.observe(query_stats.duration, endpoint=endpoint)
+    maybe_flush()
+
+
+# ── Snapshots and multi-process aggregation ──────────────────────
+
+def snapshot():
+    """This process's metrics as a JSON-serializable dict."""
+    return {m.name: [[list(k), v] for k, v in m.collect().items()] for m in _registry}
+
+
+def _snapshot_path(pid):
+    return os.path.join(_metrics_dir[0], f'metrics-{pid}.json')
+
+
+def flush():
+    """Write this process's snapshot to METRICS_DIR (no-op when unset)."""
+    if not _metrics_dir[0]:
+        return
+    with _flush_lock:
+        path = _snapshot_path(os.getpid())
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w') as fh:
+            json.dump(snapshot(), fh)
+        os.replace(tmp, path)
+        _last_flush[0] = time.monotonic()
+
+
+def maybe_flush(interval=5.0):
+    if _metrics_dir[0] and time.monotonic() - _last_flush[0] >= interval:
+        flush()
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _read_snapshot(path):
+    try:
+        with open(path) as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return None
+
+
+def _add_snapshot(merged, data, by_name):
+    for name, samples in data.items():
+        m = by_name.get(name)
+        if m is None:
+            continue
+        for k, v in samples:
+            k = tuple(k)
+            merged[name][k] = m._merge(merged[name].get(k), v)
+
+
+@contextmanager
+def _retired_lock(exclusive):
+    """Hold the lock guarding ``metrics-retired.json`` across processes."""
+    with open(os.path.join(_metrics_dir[0], 'metrics-retired.lock'), 'a') as fh:
+        fcntl.flock(fh, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+def _retire_snapshot(path, by_name):
+    """Fold an exited process's counters and histograms into the retired totals and delete its snapshot."""
+    with _retired_lock(exclusive=True):
+        data = _read_snapshot(path)
+        if data is None:
+            return  # already retired by another process's scrape
+        retired_path = os.path.join(_metrics_dir[0], RETIRED)
+        totals = {name: {} for name in by_name}
+        _add_snapshot(totals, _read_snapshot(retired_path) or {}, by_name)
+        _add_snapshot(totals, {name: samples for name, samples in data.items()
+                               if name in by_name and by_name[name].kind != 'gauge'}, by_name)
+        tmp = f'{retired_path}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as fh:
+            json.dump({name: [[list(k), v] for k, v in values.items()] for name, values in totals.items() if values},
+                      fh)
+        os.replace(tmp, retired_path)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def aggregate():
+    """Sum this process's live metrics with every other live process's last snapshot and the retired totals.
+
+    Snapshots whose process has exited are folded into the retired totals
+    rather than summed forever.
+    """
+    merged = {m.name: m.collect() for m in _registry}
+    if not _metrics_dir[0]:
+        return merged
+    by_name = {m.name: m for m in _registry}
+    own = f'metrics-{os.getpid()}.json'
+    for fn in os.listdir(_metrics_dir[0]):
+        if not fn.startswith('metrics-') or not fn.endswith('.json') or fn in (own, RETIRED):
+            continue
+        path = os.path.join(_metrics_dir[0], fn)
+        try:
+            pid = int(fn[len('metrics-'):-len('.json')])
+        except ValueError:
+            continue
+        if not _pid_alive(pid):
+            _retire_snapshot(path, by_name)
+            continue
+        data = _read_snapshot(path)
+        if data is not None:
+            _add_snapshot(merged, data, by_name)
+    with _retired_lock(exclusive=False):
+        retired = _read_snapshot(os.path.join(_metrics_dir[0], RETIRED))
+    if retired is not None:
+        _add_snapshot(merged, retired, by_name)
+    return merged
+
+
+def _fmt_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    body = ','.join('{}="{}"'.format(n, str(v).replace('\\', '\\\\').replace('"', '\\"')) for n, v in pairs)
+    return '{' + body + '}'
+
+
+def render():
+    """Prometheus text exposition format for all registered metrics."""
+    merged = aggregate()
+    lines = []
+    for m in _registry:
+        lines.append(f'# HELP {m.name} {m.documentation}')
+        lines.append(f'# TYPE {m.name} {m.kind}')
+        for k, v in sorted(merged[m.name].items()):
+            if m.kind != 'histogram':
+                lines.append(f'{m.name}{_fmt_labels(m.labelnames, k)} {v}')
+                continue
+            cumulative = 0
+            for bound, n in zip(m.buckets + (float('inf'),), v[:-1]):
+                cumulative += n
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{m.name}_bucket{_fmt_labels(m.labelnames, k, ("le", le))} {cumulative}')
+            lines.append(f'{m.name}_sum{_fmt_labels(m.labelnames, k)} {v[-1]}')
+            lines.append(f'{m.name}_count{_fmt_labels(m.labelnames, k)} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+
+def init_metrics(app):
+    """Configure multi-process snapshots from METRICS_DIR."""
+    d = app.config.get('METRICS_DIR')
+    if d:
+        os.makedirs(d, exist_ok=True)
+        if _metrics_dir[0] is None:
+            atexit.register(flush)
+        _metrics_dir[0] = d
@@ -0,0 +1,125 @@
+"""
+In-place schema upgrades for existing databases.
+
+db.create_all() only creates missing tables, so column changes to tables
+that already exist are applied here at startup, before create_all runs.
+Every step checks the live schema first and is a no-op on a database that
+is already current.
+
+Half-point columns: points and spreads moved from Float columns to integer
+counts of half points (``spread`` -> ``spread_x2`` and so on). Source tables
+get the new column filled from the old one, which is then dropped. The
+read-model tables built from them are dropped instead and rebuilt once
+create_all has recreated them. A read model missing altogether, from a
+database older than the table, is rebuilt the same way when the table it
+is derived from has rows.
+
+The upgrade runs in one write transaction that starts by writing a lock row
+in ``schema_state``, and the live schema is inspected only after that, so a
+second process booting at the same time waits and then finds nothing left
+to do. Dropping read models also records a pending-rebuild marker in the
+same transaction; rebuild_read_models clears it in the commit that refills
+them, so a process that dies before the rebuild finishes leaves the marker
+for the next boot.
+
+create_all also skips indexes on tables that already exist, so
+create_missing_indexes adds any index the models declare that the live
+database lacks.
+"""
+
+import os
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateIndex
+
+HALF_POINT_COLUMNS = [
+    ('games', 'spread', 'spread_x2', 'INTEGER'),
+    ('picks', 'points', 'points_x2', 'INTEGER'),
+    ('weekly_results', 'total_points', 'total_points_x2', 'INTEGER DEFAULT 0'),
+]
+HALF_POINT_READ_MODELS = [
+    ('player_ats_summary', 'points'),
+    ('season_totals', 'total_points'),
+    ('all_time_standings', 'total_points'),
+    ('rank_history', 'total_points'),
+]
+# each read model and the table it is derived from
+READ_MODEL_SOURCES = {
+    'player_ats_summary': 'weekly_results',
+    'season_totals': 'weekly_results',
+    'all_time_standings': 'weekly_results',
+    'rank_history': 'weekly_results',
+    'game_consensus': 'picks',
+}
+STATE_TABLE = 'schema_state'
+REBUILD_MARKER = 'rebuild_read_models'
+
+
+def _lock(conn):
+    """Start the upgrade's write transaction; a second process booting at once blocks here until it ends."""
+    conn.execute(text(f'CREATE TABLE IF NOT EXISTS {STATE_TABLE} (name VARCHAR(64) PRIMARY KEY, value VARCHAR(64))'))
+    conn.execute(text(f"INSERT INTO {STATE_TABLE} (name, value) VALUES ('upgrade_lock', :pid) "
+                      'ON CONFLICT (name) DO UPDATE SET value = excluded.value'), {'pid': str(os.getpid())})
+
+
+def _mark_rebuild(conn):
+    conn.execute(text(f"INSERT INTO {STATE_TABLE} (name, value) VALUES (:name, '1') "
+                      'ON CONFLICT (name) DO NOTHING'), {'name': REBUILD_MARKER})
+
+
+def upgrade_schema(engine):
+    """Apply pending upgrades; returns True while read models are waiting to be rebuilt."""
+    with engine.begin() as conn:
+        _lock(conn)
+        inspector = inspect(conn)
+        tables = set(inspector.get_table_names())
+        for table, old, new, ddl in HALF_POINT_COLUMNS:
+            if table not in tables:
+                continue
+            columns = {c['name'] for c in inspector.get_columns(table)}
+            if old not in columns:
+                continue
+            if new not in columns:
+                conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {new} {ddl}'))
+            conn.execute(text(f'UPDATE {table} SET {new} = CAST(ROUND({old} * 2) AS INTEGER) '
+                              f'WHERE {old} IS NOT NULL'))
+            conn.execute(text(f'ALTER TABLE {table} DROP COLUMN {old}'))
+        for table, old in HALF_POINT_READ_MODELS:
+            if table in tables and old in {c['name'] for c in inspector.get_columns(table)}:
+                conn.execute(text(f'DROP TABLE {table}'))
+                _mark_rebuild(conn)
+        # a read model that doesn't exist yet is created empty by create_all; fill it if its source has data
+        for table, source in READ_MODEL_SOURCES.items():
+            if (table not in tables and source in tables
+                    and conn.execute(text(f'SELECT 1 FROM {source} LIMIT 1')).first() is not None):
+                _mark_rebuild(conn)
+        pending = conn.execute(text(f'SELECT 1 FROM {STATE_TABLE} WHERE name = :name'),
+                               {'name': REBUILD_MARKER}).first()
+    return pending is not None
+
+
+def rebuild_read_models():
+    """Refill every table derived from weekly results, for all seasons, and clear the pending marker in one commit."""
+    from app import db
+    from app.models import Season
+    from app.analytics import refresh_player_analytics
+    from app.leaderboard import recompute_all_time
+    from app.rank_history import update_rank_history
+    from app.consensus import recount_consensus
+    season_ids = [sid for (sid,) in db.session.query(Season.id).order_by(Season.year)]
+    for season_id in season_ids:
+        refresh_player_analytics(season_id)
+        update_rank_history(season_id)
+    recompute_all_time()
+    recount_consensus()
+    db.session.execute(text(f'DELETE FROM {STATE_TABLE} WHERE name = :name'), {'name': REBUILD_MARKER})
+    db.session.commit()
+
+
+def create_missing_indexes(engine, metadata):
+    """Create every index in ``metadata`` that is missing from an existing table."""
+    tables = set(inspect(engine).get_table_names())
+    with engine.begin() as conn:
+        for table in metadata.sorted_tables:
+            if table.name in tables:
+                for index in table.indexes:
+                    conn.execute(CreateIndex(index, if_not_exists=True))
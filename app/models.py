@@ -1,9 +1,27 @@
 from datetime import datetime, timezone
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin
+from sqlalchemy.ext.hybrid import hybrid_property
 from app import db
 
 
+def to_halves(value):
+    """A point value as an integer count of half points; None stays None."""
+    return None if value is None else int(round(value * 2))
+
+
+def half_points(column):
+    """Float view of an integer half-point column, readable and writable in points and usable in queries."""
+    def fget(self):
+        halves = getattr(self, column)
+        return None if halves is None else halves / 2
+
+    def fset(self, value):
+        setattr(self, column, to_halves(value))
+
+    return hybrid_property(fget, fset, expr=lambda cls: getattr(cls, column) / 2.0)
+
+
 class User(UserMixin, db.Model):
     __tablename__ = "users"
     id = db.Column(db.Integer, primary_key=True)
@@ -14,7 +32,15 @@ class User(UserMixin, db.Model):
     is_admin = db.Column(db.Boolean, default=False)
     is_active_player = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
-    picks = db.relationship("Pick", backref="user", lazy="dynamic")
+    picks = db.relationship("Pick", backref="user")
+    # admin user list: prefix search on lower(...) and filtered keyset pages in username order
+    __table_args__ = (
+        db.Index("ix_users_username_lower", db.func.lower(username)),
+        db.Index("ix_users_display_name_lower", db.func.lower(display_name)),
+        db.Index("ix_users_email_lower", db.func.lower(email)),
+        db.Index("ix_users_active_username", is_active_player, username),
+        db.Index("ix_users_admin_username", is_admin, username),
+    )
 
     def set_password(self, password):
         self.password_hash = generate_password_hash(password, method="pbkdf2:sha256")
@@ -34,7 +60,7 @@ class Season(db.Model):
     total_weeks = db.Column(db.Integer, default=18)
     entry_fee = db.Column(db.Integer, default=30)
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
-    weeks = db.relationship("Week", backref="season", lazy="dynamic", order_by="Week.week_number")
+    weeks = db.relationship("Week", backref="season", order_by="Week.week_number")
     entries = db.relationship("SeasonEntry", backref="season", lazy="dynamic")
 
 
@@ -47,7 +73,7 @@ class Week(db.Model):
     is_completed = db.Column(db.Boolean, default=False)
     picks_deadline = db.Column(db.DateTime, nullable=True)
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
-    games = db.relationship("Game", backref="week", lazy="dynamic", order_by="Game.game_time")
+    games = db.relationship("Game", backref="week", order_by="Game.game_time")
     __table_args__ = (db.UniqueConstraint("season_id", "week_number", name="uq_season_week"),)
 
     @property
@@ -55,13 +81,36 @@ class Week(db.Model):
         return self.week_number >= self.season.total_weeks - 1
 
 
+def spread_points_x2(home_score, away_score, spread_x2, favorite, picked_favorite):
+    """Half points for a pick on the favorite (or not), clamped to +/-30; None until scored."""
+    if home_score is None or away_score is None or spread_x2 is None:
+        return None
+    if favorite == "home":
+        margin = home_score - away_score
+    else:
+        margin = away_score - home_score
+    fp = 2 * margin - abs(spread_x2)
+    if picked_favorite:
+        rp = fp
+    else:
+        rp = -fp
+    return max(-30, min(30, rp))
+
+
+def spread_points(home_score, away_score, spread, favorite, picked_favorite):
+    """Points for a pick on the favorite (or not), clamped to +/-15; None until scored."""
+    pts2 = spread_points_x2(home_score, away_score, to_halves(spread), favorite, picked_favorite)
+    return None if pts2 is None else pts2 / 2
+
+
 class Game(db.Model):
     __tablename__ = "games"
     id = db.Column(db.Integer, primary_key=True)
     week_id = db.Column(db.Integer, db.ForeignKey("weeks.id"), nullable=False)
     home_team = db.Column(db.String(64), nullable=False)
     away_team = db.Column(db.String(64), nullable=False)
-    spread = db.Column(db.Float, nullable=True)
+    spread_x2 = db.Column(db.Integer, nullable=True)
+    spread = half_points("spread_x2")
     favorite = db.Column(db.String(10), nullable=True)
     home_score = db.Column(db.Integer, nullable=True)
     away_score = db.Column(db.Integer, nullable=True)
@@ -69,7 +118,7 @@ class Game(db.Model):
     is_final = db.Column(db.Boolean, default=False)
     espn_id = db.Column(db.String(64), nullable=True)
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
-    picks = db.relationship("Pick", backref="game", lazy="dynamic")
+    picks = db.relationship("Pick", backref="game")
 
     @property
     def has_started(self):
@@ -108,20 +157,13 @@ class Game(db.Model):
             return self.away_team
         return None
 
+    def calculate_points_x2(self, picked_team):
+        return spread_points_x2(self.home_score, self.away_score, self.spread_x2, self.favorite,
+                                picked_team == self.favored_team)
+
     def calculate_points(self, picked_team):
-        if self.home_score is None or self.away_score is None or self.spread is None:
-            return None
-        sv = abs(self.spread)
-        if self.favorite == "home":
-            margin = self.home_score - self.away_score
-        else:
-            margin = self.away_score - self.home_score
-        fp = margin - sv
-        if picked_team == self.favored_team:
-            rp = fp
-        else:
-            rp = -fp
-        return max(-15, min(15, rp))
+        pts2 = self.calculate_points_x2(picked_team)
+        return None if pts2 is None else pts2 / 2
 
 
 class Pick(db.Model):
@@ -130,13 +172,22 @@ class Pick(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
     game_id = db.Column(db.Integer, db.ForeignKey("games.id"), nullable=False)
     picked_team = db.Column(db.String(64), nullable=False)
-    points = db.Column(db.Float, nullable=True)
+    points_x2 = db.Column(db.Integer, nullable=True)
+    points = half_points("points_x2")
     submitted_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
     __table_args__ = (db.UniqueConstraint("user_id", "game_id", name="uq_user_game"),)
 
     @property
     def is_winning_pick(self):
-        return self.points is not None and self.points > 0
+        return self.points_x2 is not None and self.points_x2 > 0
+
+
+class GameConsensus(db.Model):
+    """Running count of picks on each side of a game, kept in step with picks."""
+    __tablename__ = "game_consensus"
+    game_id = db.Column(db.Integer, db.ForeignKey("games.id"), primary_key=True)
+    home_count = db.Column(db.Integer, nullable=False, default=0)
+    away_count = db.Column(db.Integer, nullable=False, default=0)
 
 
 class PickViewLog(db.Model):
@@ -153,7 +204,8 @@ class WeeklyResult(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
     week_id = db.Column(db.Integer, db.ForeignKey("weeks.id"), nullable=False)
-    total_points = db.Column(db.Float, default=0)
+    total_points_x2 = db.Column(db.Integer, default=0)
+    total_points = half_points("total_points_x2")
     num_picks = db.Column(db.Integer, default=0)
     winning_picks = db.Column(db.Integer, default=0)
     weekly_win_share = db.Column(db.Float, default=0)
@@ -163,6 +215,75 @@ class WeeklyResult(db.Model):
     __table_args__ = (db.UniqueConstraint("user_id", "week_id", name="uq_user_week_result"),)
 
 
+class PlayerAtsSummary(db.Model):
+    """One player's against-the-spread record for a season, per breakdown bucket."""
+    __tablename__ = "player_ats_summary"
+    id = db.Column(db.Integer, primary_key=True)
+    season_id = db.Column(db.Integer, db.ForeignKey("seasons.id"), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
+    category = db.Column(db.String(10), nullable=False)  # all, team, side, venue
+    key = db.Column(db.String(64), nullable=False)
+    picks = db.Column(db.Integer, nullable=False, default=0)
+    wins = db.Column(db.Integer, nullable=False, default=0)
+    losses = db.Column(db.Integer, nullable=False, default=0)
+    pushes = db.Column(db.Integer, nullable=False, default=0)
+    points_x2 = db.Column(db.Integer, nullable=False, default=0)
+    points = half_points("points_x2")
+    __table_args__ = (
+        db.UniqueConstraint("season_id", "user_id", "category", "key", name="uq_ats_bucket"),
+    )
+
+    @property
+    def average(self):
+        return self.points / self.picks if self.picks else 0
+
+
+class SeasonTotal(db.Model):
+    """A player's totals over a season's completed weeks, feeding AllTimeStanding."""
+    __tablename__ = "season_totals"
+    id = db.Column(db.Integer, primary_key=True)
+    season_id = db.Column(db.Integer, db.ForeignKey("seasons.id"), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
+    total_points_x2 = db.Column(db.Integer, nullable=False, default=0)
+    total_points = half_points("total_points_x2")
+    weekly_wins = db.Column(db.Float, nullable=False, default=0)
+    winning_picks = db.Column(db.Integer, nullable=False, default=0)
+    num_picks = db.Column(db.Integer, nullable=False, default=0)
+    yearly_win = db.Column(db.Boolean, nullable=False, default=False)
+    __table_args__ = (db.UniqueConstraint("season_id", "user_id", name="uq_season_total"),)
+
+
+class AllTimeStanding(db.Model):
+    """Cross-season totals per player, rebuilt from season_totals."""
+    __tablename__ = "all_time_standings"
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), primary_key=True)
+    total_points_x2 = db.Column(db.Integer, nullable=False, default=0, index=True)
+    total_points = half_points("total_points_x2")
+    weekly_wins = db.Column(db.Float, nullable=False, default=0)
+    yearly_wins = db.Column(db.Integer, nullable=False, default=0)
+    seasons_played = db.Column(db.Integer, nullable=False, default=0)
+    winning_picks = db.Column(db.Integer, nullable=False, default=0)
+    num_picks = db.Column(db.Integer, nullable=False, default=0)
+    user = db.relationship("User")
+
+
+class RankHistory(db.Model):
+    """Yearly-standings position and running totals after each completed week."""
+    __tablename__ = "rank_history"
+    id = db.Column(db.Integer, primary_key=True)
+    season_id = db.Column(db.Integer, db.ForeignKey("seasons.id"), nullable=False)
+    week_number = db.Column(db.Integer, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
+    rank = db.Column(db.Integer, nullable=False)
+    total_points_x2 = db.Column(db.Integer, nullable=False, default=0)
+    total_points = half_points("total_points_x2")
+    weekly_wins = db.Column(db.Float, nullable=False, default=0)
+    winning_picks_in_win_weeks = db.Column(db.Integer, nullable=False, default=0)
+    total_picks = db.Column(db.Integer, nullable=False, default=0)
+    is_qualified = db.Column(db.Boolean, nullable=False, default=True)
+    __table_args__ = (db.UniqueConstraint("season_id", "week_number", "user_id", name="uq_rank_week_user"),)
+
+
 class SeasonEntry(db.Model):
     __tablename__ = "season_entries"
     id = db.Column(db.Integer, primary_key=True)
@@ -173,3 +294,39 @@ class SeasonEntry(db.Model):
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
     user = db.relationship("User", backref="season_entries")
     __table_args__ = (db.UniqueConstraint("season_id", "user_id", name="uq_season_user"),)
+
+
+class Job(db.Model):
+    """A background admin operation run by app.jobs, with its progress and outcome."""
+    __tablename__ = "jobs"
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(40), nullable=False)
+    key = db.Column(db.String(200), nullable=False)
+    params = db.Column(db.Text, nullable=False, default="{}")
+    status = db.Column(db.String(10), nullable=False, default="queued", index=True)
+    progress_done = db.Column(db.Integer, nullable=False, default=0)
+    progress_total = db.Column(db.Integer, nullable=True)
+    message = db.Column(db.Text, nullable=True)
+    result = db.Column(db.Text, nullable=True)  # JSON detail some jobs leave for their status page
+    error = db.Column(db.Text, nullable=True)
+    worker_pid = db.Column(db.Integer, nullable=True)
+    created_by = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    # at most one queued or running job per key, so a double submit can't start a second copy
+    __table_args__ = (db.Index("uq_jobs_active_key", "key", unique=True,
+                               sqlite_where=db.text("status IN ('queued', 'running')"),
+                               postgresql_where=db.text("status IN ('queued', 'running')")),)
+
+    @property
+    def is_finished(self):
+        return self.status in ("done", "failed")
+
+    @property
+    def duration(self):
+        """Seconds from start to finish, or to now while running; None until started."""
+        if self.started_at is None:
+            return None
+        end = self.finished_at or datetime.now(timezone.utc)
+        return (end.replace(tzinfo=None) - self.started_at.replace(tzinfo=None)).total_seconds()
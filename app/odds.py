@@ -2,7 +2,10 @@ import requests
 from datetime import datetime, timezone
 from flask import current_app
 from app import db
+from app.cache import page_cache
 from app.models import Game
+from app.metrics import timed, track_provider
+from app.picks_grid import invalidate_picks_grid
 
 TEAM_ABBREVIATIONS = {
     'Arizona Cardinals': 'ARI', 'Atlanta Falcons': 'ATL', 'Baltimore Ravens': 'BAL',
@@ -36,18 +39,20 @@ def fetch_odds_from_odds_api():
     key = current_app.config.get('ODDS_API_KEY', '')
     if not key:
         raise ValueError("No ODDS_API_KEY. Get one at https://the-odds-api.com")
-    r = requests.get(current_app.config['ODDS_API_URL'],
-                     params={'apiKey': key, 'regions': 'us', 'markets': 'spreads', 'oddsFormat': 'american'},
-                     timeout=15)
-    r.raise_for_status()
-    return r.json()
+    with track_provider('odds_api'):
+        r = requests.get(current_app.config['ODDS_API_URL'],
+                         params={'apiKey': key, 'regions': 'us', 'markets': 'spreads', 'oddsFormat': 'american'},
+                         timeout=15)
+        r.raise_for_status()
+        return r.json()
 
 
 def fetch_games_from_espn(week_number, season_year):
-    r = requests.get(current_app.config['ESPN_ODDS_URL'],
-                     params={'week': week_number, 'seasontype': 2, 'dates': season_year}, timeout=15)
-    r.raise_for_status()
-    data = r.json()
+    with track_provider('espn'):
+        r = requests.get(current_app.config['ESPN_ODDS_URL'],
+                         params={'week': week_number, 'seasontype': 2, 'dates': season_year}, timeout=15)
+        r.raise_for_status()
+        data = r.json()
     games = []
     for ev in data.get('events', []):
         comp = ev.get('competitions', [{}])[0]
@@ -85,6 +90,7 @@ def fetch_games_from_espn(week_number, season_year):
     return games
 
 
+@timed('fetch_odds_for_week')
 def fetch_odds_for_week(week):
     espn_games = fetch_games_from_espn(week.week_number, week.season.year)
     odds_map = {}
@@ -126,4 +132,6 @@ def fetch_odds_for_week(week):
             db.session.add(g)
         count += 1
     db.session.commit()
+    page_cache.bump(week.season_id)
+    invalidate_picks_grid(week.id)
     return count
@@ -0,0 +1,133 @@
+"""
+Compact per-week pick matrix.
+
+A week's picks as one row per user and one column per game, without ORM
+objects: each cell is two bits (no pick, home, away) packed four to a byte,
+with each user's row starting on a byte boundary, and a parallel array of
+16-bit integers holds the half points for final games (NO_POINTS where
+there are none), halved only when read for display. The
+matrix is filled from a single raw SELECT and round-trips through bytes, so
+it can be stored in the shared cache file. Consensus counts slice one column
+out of the packed rows and count it with ``bytes.translate``, keeping the
+per-cell work in C.
+"""
+
+import struct
+from array import array
+from sqlalchemy import text
+from app.models import spread_points_x2
+
+NO_PICK, HOME, AWAY = 0, 1, 2
+NO_POINTS = -0x8000  # outside the +/-30 half points a pick can score
+
+_HEADER = struct.Struct('<4sII')
+_MAGIC = b'PMX2'
+# _SLOT[s] maps a packed byte to the value of its cell in slot s (0-3)
+_SLOT = [bytes((b >> (2 * s)) & 3 for b in range(256)) for s in range(4)]
+
+_WEEK_SQL = text(
+    'SELECT g.id, g.home_team, g.away_team, g.spread_x2, g.favorite, g.home_score, g.away_score, '
+    'g.is_final, p.user_id, p.picked_team '
+    'FROM games g LEFT JOIN picks p ON p.game_id = g.id '
+    'WHERE g.week_id = :week_id ORDER BY g.id'
+)
+
+
+class WeekPickMatrix:
+    def __init__(self, user_ids, game_ids, cells=None, points_x2=None):
+        self.user_ids = array('q', user_ids)
+        self.game_ids = array('q', game_ids)
+        self.row_bytes = (len(self.game_ids) + 3) // 4
+        size = len(self.user_ids) * len(self.game_ids)
+        self.cells = bytearray(len(self.user_ids) * self.row_bytes) if cells is None else bytearray(cells)
+        self.points_x2 = array('h', [NO_POINTS]) * size if points_x2 is None else array('h', points_x2)
+        self._user_index = {uid: i for i, uid in enumerate(self.user_ids)}
+        self._game_index = {gid: j for j, gid in enumerate(self.game_ids)}
+
+    @classmethod
+    def for_week(cls, session, week_id):
+        """Build the matrix for ``week_id`` from one SELECT over games and picks."""
+        rows = session.execute(_WEEK_SQL, {'week_id': week_id}).all()
+        game_ids = sorted({r[0] for r in rows})
+        user_ids = sorted({r[8] for r in rows if r[8] is not None})
+        matrix = cls(user_ids, game_ids)
+        for gid, home, away, spread_x2, favorite, hs, aws, is_final, uid, team in rows:
+            if uid is None:
+                continue
+            side = HOME if team == home else AWAY if team == away else NO_PICK
+            if side == NO_PICK:
+                continue
+            i, j = matrix._user_index[uid], matrix._game_index[gid]
+            matrix._set(i, j, side)
+            if is_final:
+                pts2 = spread_points_x2(hs, aws, spread_x2, favorite,
+                                        (favorite == 'home' and side == HOME) or (favorite == 'away' and side == AWAY))
+                if pts2 is not None:
+                    matrix.points_x2[i * len(matrix.game_ids) + j] = pts2
+        return matrix
+
+    def _set(self, i, j, side):
+        pos = i * self.row_bytes + (j >> 2)
+        shift = 2 * (j & 3)
+        self.cells[pos] = (self.cells[pos] & ~(3 << shift) & 0xFF) | (side << shift)
+
+    def pick(self, user_id, game_id):
+        """NO_PICK, HOME or AWAY."""
+        i, j = self._user_index.get(user_id), self._game_index.get(game_id)
+        if i is None or j is None:
+            return NO_PICK
+        return (self.cells[i * self.row_bytes + (j >> 2)] >> (2 * (j & 3))) & 3
+
+    def points_x2_for(self, user_id, game_id):
+        """Half points for a final game's pick, or None."""
+        i, j = self._user_index.get(user_id), self._game_index.get(game_id)
+        if i is None or j is None:
+            return None
+        pts2 = self.points_x2[i * len(self.game_ids) + j]
+        return None if pts2 == NO_POINTS else pts2
+
+    def points_for(self, user_id, game_id):
+        pts2 = self.points_x2_for(user_id, game_id)
+        return None if pts2 is None else pts2 / 2
+
+    def consensus(self):
+        """{game_id: (home count, away count)}."""
+        out = {}
+        for j, gid in enumerate(self.game_ids):
+            column = bytes(self.cells[j >> 2::self.row_bytes]).translate(_SLOT[j & 3])
+            out[gid] = (column.count(HOME), column.count(AWAY))
+        return out
+
+    def user_totals(self):
+        """{user_id: total points over final games}."""
+        n = len(self.game_ids)
+        out = {}
+        for i, uid in enumerate(self.user_ids):
+            out[uid] = sum(p for p in self.points_x2[i * n:(i + 1) * n] if p != NO_POINTS) / 2
+        return out
+
+    @property
+    def nbytes(self):
+        return (len(self.user_ids) * self.user_ids.itemsize + len(self.game_ids) * self.game_ids.itemsize
+                + len(self.cells) + len(self.points_x2) * self.points_x2.itemsize)
+
+    def to_bytes(self):
+        return b''.join((_HEADER.pack(_MAGIC, len(self.user_ids), len(self.game_ids)),
+                         self.user_ids.tobytes(), self.game_ids.tobytes(),
+                         bytes(self.cells), self.points_x2.tobytes()))
+
+    @classmethod
+    def from_bytes(cls, data):
+        magic, n_users, n_games = _HEADER.unpack_from(data)
+        if magic != _MAGIC:
+            raise ValueError('not a pick matrix')
+        pos = _HEADER.size
+        users, games, points_x2 = array('q'), array('q'), array('h')
+        users.frombytes(data[pos:pos + n_users * users.itemsize])
+        pos += n_users * users.itemsize
+        games.frombytes(data[pos:pos + n_games * games.itemsize])
+        pos += n_games * games.itemsize
+        n_cells = n_users * ((n_games + 3) // 4)
+        cells = data[pos:pos + n_cells]
+        points_x2.frombytes(data[pos + n_cells:])
+        return cls(users, games, cells, points_x2)
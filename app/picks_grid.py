@@ -0,0 +1,84 @@
+"""
+Shared per-week picks grid.
+
+Every player viewing a week's picks sees the same users x games table of
+picked sides and points, so it is built once per week and stored as JSON in
+the shared cache file. The entry is keyed by a ``picks:<week_id>``
+generation that is bumped whenever that week's picks, games or scores
+change; each request then projects its own view out of the grid without
+touching the picks or users tables.
+"""
+
+import json
+from collections import namedtuple
+from app.cache import page_cache
+
+GridUser = namedtuple('GridUser', 'id display_name')
+GridPick = namedtuple('GridPick', 'picked_team points')
+
+
+class PicksGrid:
+    """Users who picked this week (by id) and their picks keyed by game id."""
+
+    def __init__(self, users, picks):
+        self.users = users
+        self.picks = picks
+
+    def row(self, user_id):
+        return self.picks.get(user_id, {})
+
+    def others(self, user_id):
+        """(users, picks) with ``user_id``'s column left out."""
+        users = [u for u in self.users if u.id != user_id]
+        return users, {u.id: self.picks[u.id] for u in users}
+
+    def to_json(self):
+        return json.dumps({
+            'users': [list(u) for u in self.users],
+            'picks': {uid: {gid: list(p) for gid, p in row.items()} for uid, row in self.picks.items()},
+        })
+
+    @classmethod
+    def from_json(cls, value):
+        data = json.loads(value)
+        users = [GridUser(*u) for u in data['users']]
+        picks = {int(uid): {int(gid): GridPick(*p) for gid, p in row.items()}
+                 for uid, row in data['picks'].items()}
+        return cls(users, picks)
+
+
+def build_picks_grid(games):
+    """Load every pick on ``games`` and score the ones whose game is final."""
+    from app import db
+    from app.models import User, Pick
+    games_by_id = {g.id: g for g in games}
+    users, picks = {}, {}
+    if games_by_id:
+        rows = (db.session.query(Pick.user_id, Pick.game_id, Pick.picked_team, User.display_name)
+                .join(User, User.id == Pick.user_id)
+                .filter(Pick.game_id.in_(list(games_by_id)))
+                .all())
+        for user_id, game_id, team, display_name in rows:
+            game = games_by_id[game_id]
+            points = game.calculate_points(team) if game.is_final else None
+            users[user_id] = GridUser(user_id, display_name)
+            picks.setdefault(user_id, {})[game_id] = GridPick(team, points)
+    return PicksGrid([users[uid] for uid in sorted(users)], picks)
+
+
+def get_picks_grid(week_id, games):
+    """The cached grid for ``week_id``; ``games`` are that week's Game rows."""
+    if not page_cache.enabled:
+        return build_picks_grid(games)
+    key = f'picks_grid:{week_id}:g{page_cache.generation(f"picks:{week_id}")}'
+    cached = page_cache.get(key)
+    if cached is not None:
+        return PicksGrid.from_json(cached)
+    grid = build_picks_grid(games)
+    page_cache.set(key, grid.to_json())
+    return grid
+
+
+def invalidate_picks_grid(week_id):
+    """Call after committing a change to ``week_id``'s picks, games or scores."""
+    page_cache.bump_generation(f'picks:{week_id}')
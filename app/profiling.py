@@ -0,0 +1,122 @@
+"""
+Opt-in per-request profiler for administrators.
+
+An admin adds ``?_profile=1`` to a URL (or sends ``X-Profile: 1``) and the
+request runs under cProfile. The pstats dump and a JSON summary holding the
+top functions by cumulative time and the SQL statements issued are written
+to PROFILE_DIR, which keeps only the newest PROFILE_KEEP captures. Requests
+without the flag never touch the profiler.
+"""
+
+import cProfile
+import io
+import json
+import os
+import pstats
+import re
+import time
+from datetime import datetime, timezone
+from flask import g, request, current_app
+from flask_login import current_user
+from app.instrumentation import current_query_stats
+
+_NAME_RE = re.compile(r'^[\w.-]+$')
+
+
+def _wants_profile():
+    if request.args.get('_profile') != '1' and request.headers.get('X-Profile') != '1':
+        return False
+    return current_user.is_authenticated and current_user.is_admin
+
+
+def _start_profile():
+    if not _wants_profile():
+        return
+    g._profiler = cProfile.Profile()
+    g._profile_start = time.perf_counter()
+    g._profiler.enable()
+
+
+def _finish_profile(response):
+    profiler = g.pop('_profiler', None)
+    if profiler is None:
+        return response
+    profiler.disable()
+    duration = time.perf_counter() - g.pop('_profile_start')
+    try:
+        save_profile(profiler, duration, response.status_code)
+    except OSError as e:
+        current_app.logger.error(f"Failed to save profile: {e}")
+    return response
+
+
+def top_functions(stats, limit=25):
+    """[(function, calls, tottime, cumtime)] sorted by cumulative time."""
+    rows = []
+    for (filename, line, name), (cc, nc, tt, ct, _) in stats.stats.items():
+        rows.append((f'{os.path.basename(filename)}:{line}({name})', nc, tt, ct))
+    rows.sort(key=lambda r: -r[3])
+    return rows[:limit]
+
+
+def save_profile(profiler, duration, status):
+    profile_dir = current_app.config['PROFILE_DIR']
+    os.makedirs(profile_dir, exist_ok=True)
+    now = datetime.now(timezone.utc)
+    name = f"{now.strftime('%Y%m%d-%H%M%S-%f')}-{request.endpoint or 'unknown'}-{os.getpid()}"
+    stats = pstats.Stats(profiler, stream=io.StringIO())
+    stats.dump_stats(os.path.join(profile_dir, f'{name}.prof'))
+    qs = current_query_stats()
+    summary = {
+        'name': name,
+        'captured_at': now.isoformat(),
+        'method': request.method,
+        'path': request.full_path.rstrip('?'),
+        'endpoint': request.endpoint,
+        'status': status,
+        'duration_ms': round(duration * 1000, 2),
+        'queries': [{'sql': sql, 'ms': round(d * 1000, 3)} for sql, d in (qs.queries if qs else [])],
+        'top': top_functions(stats),
+    }
+    with open(os.path.join(profile_dir, f'{name}.json'), 'w') as fh:
+        json.dump(summary, fh)
+    _rotate(profile_dir, current_app.config.get('PROFILE_KEEP', 50))
+    return name
+
+
+def _rotate(profile_dir, keep):
+    names = sorted(fn[:-5] for fn in os.listdir(profile_dir) if fn.endswith('.json'))
+    for name in names[:-keep] if keep > 0 else names:
+        for ext in ('.json', '.prof'):
+            try:
+                os.remove(os.path.join(profile_dir, name + ext))
+            except FileNotFoundError:
+                pass
+
+
+def list_profiles(profile_dir):
+    """Newest-first list of saved profile summaries."""
+    if not os.path.isdir(profile_dir):
+        return []
+    out = []
+    for fn in sorted(os.listdir(profile_dir), reverse=True):
+        if fn.endswith('.json'):
+            summary = load_profile(profile_dir, fn[:-5])
+            if summary:
+                out.append(summary)
+    return out
+
+
+def load_profile(profile_dir, name):
+    if not _NAME_RE.match(name):
+        return None
+    try:
+        with open(os.path.join(profile_dir, f'{name}.json')) as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return None
+
+
+def init_profiling(app):
+    app.before_request(_start_profile)
+    app.after_request(_finish_profile)
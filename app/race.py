@@ -0,0 +1,204 @@
+"""
+Prize-race elimination and clinch calculator.
+
+For every player in the yearly standings this decides whether they have
+clinched, are still alive for, or are eliminated from the yearly and weekly
+prizes, using bounds instead of enumerating outcomes.
+
+Yearly prize: a player's final total lies within their fixed points (completed
+weeks plus final games of unfinished weeks) +/-15 for every pick still
+unresolved and every game they can still pick. Two players who already hold
+the same side of an in-progress game cannot separate on it, which tightens
+the bound between them by 30. Players are sorted by their bounds and only
+the rivals the coarse bounds cannot decide are compared pairwise. A player
+who can still make 4+ picks in each unfinished qualifying week can still
+qualify; only a rival who is already certain to qualify (4+ picks locked in
+each of the last two weeks) can eliminate anyone, and only such a player
+can clinch. Active players with no completed-week results yet start from
+zero points.
+
+Weekly prize: a player can add at most one weekly win per unfinished week,
+with the winning-picks-in-win-weeks tiebreak bounded by the games in those
+weeks. Clinching also has to beat a player with no wins yet taking every
+remaining week. Exact ties are left alive, since the later tiebreaks can go
+either way.
+
+Results are cached per season data version and the picks generations of the
+unfinished weeks.
+"""
+
+import json
+from sqlalchemy import func
+from app import db
+from app.cache import page_cache
+from app.models import Game, Pick, User, Week
+
+CLINCHED, ALIVE, ELIMINATED = 'clinched', 'alive', 'eliminated'
+DEFAULT_GAMES_PER_WEEK = 16
+
+
+class Contender:
+    __slots__ = ('user_id', 'name', 'points', 'fixed', 'locked', 'can_qualify', 'is_qualified', 'weekly_wins',
+                 'wpww')
+
+    def __init__(self, user_id, name, points, weekly_wins=0, wpww=0, can_qualify=True, fixed=None, locked=None,
+                 is_qualified=None):
+        self.user_id = user_id
+        self.name = name
+        self.points = points
+        self.fixed = points if fixed is None else fixed
+        self.locked = locked or {}  # game_id -> picked team, for started games not yet final
+        self.can_qualify = can_qualify
+        self.is_qualified = can_qualify if is_qualified is None else is_qualified  # certain to qualify
+        self.weekly_wins = weekly_wins
+        self.wpww = wpww
+
+
+def _swing(a, b, free_games):
+    """Largest possible change in (a - b) from unresolved and open games."""
+    shared = sum(1 for gid, team in a.locked.items() if b.locked.get(gid) == team)
+    return 15 * (len(a.locked) + len(b.locked)) + 30 * free_games - 30 * shared
+
+
+def yearly_statuses(contenders, free_games):
+    """{user_id: status} for the yearly prize."""
+    pool = [c for c in contenders if c.can_qualify]
+    spread = {c.user_id: 15 * (len(c.locked) + free_games) for c in pool}
+    lo = {c.user_id: c.fixed - spread[c.user_id] for c in pool}
+    hi = {c.user_id: c.fixed + spread[c.user_id] for c in pool}
+    by_lo = sorted(pool, key=lambda c: -lo[c.user_id])
+    by_hi = sorted(pool, key=lambda c: -hi[c.user_id])
+    out = {c.user_id: ELIMINATED for c in contenders}
+    for a in pool:
+        # eliminated if some rival finishes ahead in every outcome
+        eliminated = False
+        for b in by_lo:
+            if lo[b.user_id] <= hi[a.user_id] - 30 * len(a.locked):
+                break
+            # a rival who may still miss qualifying is not sure to finish ahead of anyone
+            if b is not a and b.is_qualified and a.fixed - b.fixed + _swing(a, b, free_games) < 0:
+                eliminated = True
+                break
+        if eliminated:
+            continue
+        # clinched if a is sure to qualify and finishes ahead of every rival in every outcome
+        clinched = a.is_qualified
+        for b in by_hi if clinched else ():
+            if hi[b.user_id] < lo[a.user_id]:
+                break
+            if b is not a and a.fixed - b.fixed - _swing(a, b, free_games) <= 0:
+                clinched = False
+                break
+        out[a.user_id] = CLINCHED if clinched else ALIVE
+    return out
+
+
+def weekly_statuses(contenders, remaining_weeks, remaining_games):
+    """{user_id: status} for the weekly-wins prize."""
+    ranked = sorted(contenders, key=lambda c: (-c.weekly_wins, -c.wpww))
+    # a player with no wins yet, in the standings or not, can still take every remaining week
+    newcomer = Contender(None, None, 0) if remaining_weeks > 0 else None
+    out = {}
+    for a in contenders:
+        # the best-placed rival decides elimination; clinching must also beat the newcomer
+        b = next((c for c in ranked if c is not a), None)
+        if b is not None and (b.weekly_wins, b.wpww) > (a.weekly_wins + remaining_weeks, a.wpww + remaining_games):
+            out[a.user_id] = ELIMINATED
+        elif all((a.weekly_wins, a.wpww) > (r.weekly_wins + remaining_weeks, r.wpww + remaining_games)
+                 for r in (b, newcomer) if r is not None):
+            out[a.user_id] = CLINCHED
+        else:
+            out[a.user_id] = ALIVE
+    return out
+
+
+def load_contenders(season):
+    """(contenders, free games, unfinished weeks, games left in them) for ``season``."""
+    from app.scoring import calculate_yearly_standings, calculate_weekly_prize_winner
+    standings = calculate_yearly_standings(season)
+    weekly = {s['user'].id: s for s in calculate_weekly_prize_winner(season)['standings'] if s.get('user')}
+    open_weeks = Week.query.filter_by(season_id=season.id, is_completed=False).order_by(Week.week_number).all()
+    open_ids = [w.id for w in open_weeks]
+    games = Game.query.filter(Game.week_id.in_(open_ids)).all() if open_ids else []
+    picks = (db.session.query(Pick.user_id, Pick.game_id, Pick.picked_team)
+             .filter(Pick.game_id.in_([g.id for g in games])).all()) if games else []
+    per_week = [n for (n,) in db.session.query(func.count(Game.id)).join(Week)
+                .filter(Week.season_id == season.id).group_by(Game.week_id)]
+    default_games = max(per_week, default=0) or DEFAULT_GAMES_PER_WEEK
+
+    games_by_week = {}
+    for g in games:
+        games_by_week.setdefault(g.week_id, []).append(g)
+    by_id = {g.id: g for g in games}
+    free = 0
+    for w in open_weeks:
+        wg = games_by_week.get(w.id)
+        free += sum(1 for g in wg if not g.is_final and not g.has_started) if wg else default_games
+    remaining_games = sum(len(games_by_week.get(w.id)) if games_by_week.get(w.id) else default_games
+                          for w in open_weeks)
+
+    fixed, locked, started_picks = {}, {}, {}
+    for uid, gid, team in picks:
+        g = by_id[gid]
+        if g.is_final:
+            fixed[uid] = fixed.get(uid, 0) + (g.calculate_points(team) or 0)
+        elif g.has_started:
+            locked.setdefault(uid, {})[gid] = team
+        if g.is_final or g.has_started:
+            started_picks[(uid, g.week_id)] = started_picks.get((uid, g.week_id), 0) + 1
+
+    crit = {n for n in (season.total_weeks, season.total_weeks - 1) if n >= 1}
+    crit_done = {n for (n,) in db.session.query(Week.week_number).filter(
+        Week.season_id == season.id, Week.is_completed.is_(True), Week.week_number.in_(crit))}
+    crit_open = [w for w in open_weeks if w.week_number in crit]
+
+    def contender(user, points, is_qualified, ws):
+        uid = user.id
+        can_qualify, certain = is_qualified, is_qualified
+        for w in crit_open:
+            started = started_picks.get((uid, w.id), 0)
+            if w.id in games_by_week:
+                unstarted = sum(1 for g in games_by_week[w.id] if not g.is_final and not g.has_started)
+                if started + unstarted < 4:
+                    can_qualify = False
+            if started < 4:
+                certain = False
+        # a qualifying week not created yet is still to be played
+        if len(crit_done) + len(crit_open) < len(crit):
+            certain = False
+        return Contender(uid, user.display_name, points, ws.get('total_wins', 0),
+                         ws.get('winning_picks_in_win_weeks', 0), can_qualify,
+                         fixed=points + fixed.get(uid, 0), locked=locked.get(uid), is_qualified=certain and can_qualify)
+
+    contenders = [contender(s['user'], s['total_points'], s['is_qualified'], weekly.get(s['user'].id, {}))
+                  for s in standings]
+    # active players without completed-week results yet start from nothing
+    ranked = {c.user_id for c in contenders}
+    for user in User.query.filter_by(is_active_player=True).order_by(User.display_name).all():
+        if user.id not in ranked:
+            contenders.append(contender(user, 0, not crit_done, weekly.get(user.id, {})))
+    return contenders, free, len(open_weeks), remaining_games
+
+
+def season_race(season):
+    """[{user_id, name, points, yearly, weekly_wins, weekly}] in standings order, then players without results, cached."""
+    open_ids = [wid for (wid,) in db.session.query(Week.id).filter_by(season_id=season.id, is_completed=False)]
+    key = ':'.join([page_cache.key('race', season.id)] +
+                   [f'{wid}g{page_cache.generation(f"picks:{wid}")}' for wid in sorted(open_ids)])
+    cached = page_cache.get(key)
+    if cached is not None:
+        return json.loads(cached)
+    contenders, free, weeks_left, games_left = load_contenders(season)
+    if weeks_left == 0:
+        from app.scoring import get_yearly_winners, calculate_weekly_prize_winner
+        yearly_ids = {w['user'].id for w in get_yearly_winners(season)}
+        weekly_ids = {w['user'].id for w in calculate_weekly_prize_winner(season)['winners'] if w.get('user')}
+        yearly = {c.user_id: CLINCHED if c.user_id in yearly_ids else ELIMINATED for c in contenders}
+        weekly = {c.user_id: CLINCHED if c.user_id in weekly_ids else ELIMINATED for c in contenders}
+    else:
+        yearly = yearly_statuses(contenders, free)
+        weekly = weekly_statuses(contenders, weeks_left, games_left)
+    rows = [{'user_id': c.user_id, 'name': c.name, 'points': c.points, 'yearly': yearly[c.user_id],
+             'weekly_wins': c.weekly_wins, 'weekly': weekly[c.user_id]} for c in contenders]
+    page_cache.set(key, json.dumps(rows))
+    return rows
@@ -0,0 +1,118 @@
+"""
+Yearly-standings rank after every completed week.
+
+Ranks are rolled forward from running totals with the same ordering and
+qualification rules as calculate_yearly_standings, so recalculating week N
+only rewrites the rows for weeks N and later, starting from the totals
+stored with week N-1's rows. A full backfill is the same roll starting from
+week 1: one pass over the season's WeeklyResult rows sorted by week.
+"""
+
+import click
+from app import db
+from app.models import User, Season, Week, WeeklyResult, RankHistory
+
+
+def _sort_key(uid, st):
+    tp, ww, wpww, tpk, qual = st
+    return (-int(qual), -tp, -ww, -wpww, uid)
+
+
+def update_rank_history(season_id, from_week=1):
+    """Rewrite ``season_id``'s rank rows for completed weeks numbered ``from_week`` and later; the caller commits.
+
+    Running totals are seeded from the stored rows of the last completed
+    week before ``from_week``; if any earlier completed week has no rows
+    (an upgraded database, say) the whole season is rolled from week 1.
+    """
+    season = db.session.get(Season, season_id)
+    if season is None:
+        return
+    crit = {season.total_weeks, season.total_weeks - 1}
+    completed = [n for (n,) in db.session.query(Week.week_number)
+                 .filter_by(season_id=season_id, is_completed=True).order_by(Week.week_number)]
+    active = {uid for (uid,) in db.session.query(User.id).filter_by(is_active_player=True)}
+    before = [n for n in completed if n < from_week]
+    if before:
+        stored = {n for (n,) in db.session.query(RankHistory.week_number).filter(
+            RankHistory.season_id == season_id, RankHistory.week_number < from_week).distinct()}
+        if not stored.issuperset(before):
+            from_week, before = 1, []
+    passed_crit = any(n in crit for n in before)
+    state = {}
+    if before:
+        for r in RankHistory.query.filter_by(season_id=season_id, week_number=before[-1]):
+            if r.user_id in active:
+                state[r.user_id] = [r.total_points_x2, r.weekly_wins, r.winning_picks_in_win_weeks,
+                                    r.total_picks, r.is_qualified]
+    results = (
+        db.session.query(Week.week_number, WeeklyResult.user_id, WeeklyResult.total_points_x2,
+                         WeeklyResult.num_picks, WeeklyResult.winning_picks, WeeklyResult.weekly_win_share)
+        .join(Week, Week.id == WeeklyResult.week_id)
+        .filter(Week.season_id == season_id, Week.is_completed.is_(True), Week.week_number >= from_week)
+        .order_by(Week.week_number)
+        .all()
+    )
+    by_week = {}
+    for wn, uid, points, picks, winning, share in results:
+        if uid in active:
+            by_week.setdefault(wn, {})[uid] = (points, picks, winning, share)
+    RankHistory.query.filter(RankHistory.season_id == season_id, RankHistory.week_number >= from_week).delete()
+    rows = []
+    for wn in completed:
+        if wn < from_week:
+            continue
+        week_results = by_week.get(wn, {})
+        for uid in set(state) | set(week_results):
+            st = state.setdefault(uid, [0, 0, 0, 0, not passed_crit])
+            wr = week_results.get(uid)
+            if wr:
+                points, picks, winning, share = wr
+                st[0] += points or 0
+                st[3] += picks or 0
+                if share and share > 0:
+                    st[1] += share
+                    st[2] += winning or 0
+            if wn in crit and (wr is None or (wr[1] or 0) < 4):
+                st[4] = False
+        if wn in crit:
+            passed_crit = True
+        ranked = sorted((uid for uid, st in state.items() if st[3] > 0), key=lambda u: _sort_key(u, state[u]))
+        for rank, uid in enumerate(ranked, 1):
+            tp, ww, wpww, tpk, qual = state[uid]
+            rows.append({'season_id': season_id, 'week_number': wn, 'user_id': uid, 'rank': rank,
+                         'total_points_x2': tp, 'weekly_wins': ww, 'winning_picks_in_win_weeks': wpww,
+                         'total_picks': tpk, 'is_qualified': qual})
+    if rows:
+        db.session.execute(RankHistory.__table__.insert(), rows)
+    db.session.flush()
+
+
+def rank_history_chart(season_id):
+    """{'weeks': [n, ...], 'players': [[user_id, name, [rank or None per week]], ...]} ordered by latest rank."""
+    rows = (db.session.query(RankHistory.week_number, RankHistory.user_id, RankHistory.rank, User.display_name)
+            .join(User, User.id == RankHistory.user_id)
+            .filter(RankHistory.season_id == season_id)
+            .order_by(RankHistory.week_number, RankHistory.rank)
+            .all())
+    weeks = sorted({r[0] for r in rows})
+    col = {wn: i for i, wn in enumerate(weeks)}
+    players = {}
+    for wn, uid, rank, name in rows:
+        players.setdefault(uid, [uid, name, [None] * len(weeks)])[2][col[wn]] = rank
+    ordered = sorted(players.values(), key=lambda p: (p[2][-1] is None, p[2][-1] or 0, p[1]))
+    return {'weeks': weeks, 'players': ordered}
+
+
+@click.command('backfill-rank-history')
+def backfill_rank_history_command():
+    """Rebuild every season's rank history from its weekly results."""
+    season_ids = [sid for (sid,) in db.session.query(Season.id).order_by(Season.year)]
+    for season_id in season_ids:
+        update_rank_history(season_id)
+    db.session.commit()
+    click.echo(f'Backfilled rank history for {len(season_ids)} season(s).')
+
+
+def init_rank_history(app):
+    app.cli.add_command(backfill_rank_history_command)
@@ -0,0 +1,117 @@
+"""
+Season-wide recompute.
+
+Rescores every pick and rebuilds every week's WeeklyResult rows for a
+season in one transaction, for use after a rule fix or a corrected score.
+The season is read with the engine's single snapshot SELECT and each week
+is scored in memory, optionally across a process pool (the scoring is pure
+Python, so threads would not run it in parallel). Pick points depend only
+on the game and the side picked, so they are written with one UPDATE per
+final game rather than one per pick; results go in as a single bulk
+INSERT. The read models are refreshed once at the end instead of once per
+week, inside the same transaction.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import click
+from sqlalchemy import insert, text
+from app import db, engine
+from app.cache import page_cache
+from app.metrics import timed
+from app.models import Season, WeeklyResult
+from app.analytics import refresh_player_analytics
+from app.leaderboard import refresh_all_time
+from app.rank_history import update_rank_history
+from app.picks_grid import invalidate_picks_grid
+
+_PICK_POINTS_SQL = text(
+    'UPDATE picks SET points_x2 = CASE picked_team WHEN :home THEN :home_pts WHEN :away THEN :away_pts '
+    'ELSE :other_pts END WHERE game_id = :game_id'
+)
+
+
+def _score(args):
+    week_id, games, picks, user_ids = args
+    return week_id, engine.score_week(week_id, games, picks, user_ids, record=False)
+
+
+def _pick_points(games):
+    # '' never matches a team, so it scores like any unrecognised pick does in the engine
+    return [{'game_id': g.id, 'home': g.home_team, 'away': g.away_team,
+             'home_pts': engine.pick_points_x2(g, g.home_team), 'away_pts': engine.pick_points_x2(g, g.away_team),
+             'other_pts': engine.pick_points_x2(g, '')}
+            for g in games if g.is_final]
+
+
+@timed('recompute_season')
+def recompute_season(season, workers=0, progress=None):
+    """Rescore ``season``'s picks and rebuild its weekly results in one commit.
+
+    ``workers`` > 1 scores weeks in that many processes. ``progress`` is
+    called as progress(done, total, week_number) as each week is scored.
+    Weeks without games are left alone, as calculate_week_results does.
+    Returns {'weeks', 'picks', 'results'} counts.
+    """
+    snap = engine.SeasonSnapshot.load(db.session, season)
+    weeks = [w for w in snap.weeks if snap.games.get(w.id)]
+    numbers = {w.id: w.week_number for w in weeks}
+    user_ids = sorted(snap.users)
+    jobs = [(w.id, snap.games[w.id], snap.picks.get(w.id, []), user_ids) for w in weeks]
+    scored = {}
+
+    def collect(results):
+        for week_id, rs in results:
+            scored[week_id] = rs
+            if progress:
+                progress(len(scored), len(jobs), numbers[week_id])
+
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as pool:
+            collect(pool.map(_score, jobs))
+    else:
+        collect(map(_score, jobs))
+
+    updates = [row for w in weeks for row in _pick_points(snap.games[w.id])]
+    rows = [{'user_id': r.user_id, 'week_id': r.week_id, 'total_points_x2': r.total_points_x2,
+             'num_picks': r.num_picks, 'winning_picks': r.winning_picks,
+             'weekly_win_share': r.weekly_win_share, 'is_eligible': r.is_eligible}
+            for w in weeks for r in scored[w.id]]
+    try:
+        if updates:
+            db.session.execute(_PICK_POINTS_SQL, updates)
+        if weeks:
+            db.session.execute(WeeklyResult.__table__.delete().where(WeeklyResult.week_id.in_(list(numbers))))
+        if rows:
+            db.session.execute(insert(WeeklyResult), rows)
+        if weeks:
+            refresh_player_analytics(season.id)
+            refresh_all_time(season.id)
+            update_rank_history(season.id)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    if weeks:
+        page_cache.bump(season.id)
+        for week_id in numbers:
+            invalidate_picks_grid(week_id)
+    return {'weeks': len(weeks), 'picks': sum(len(j[2]) for j in jobs), 'results': len(rows)}
+
+
+@click.command('recompute-season')
+@click.argument('year', type=int)
+@click.option('--workers', default=0, help='Score weeks in this many processes.')
+def recompute_season_command(year, workers):
+    """Rescore every pick and rebuild all weekly results for the YEAR season."""
+    season = Season.query.filter_by(year=year).first()
+    if season is None:
+        raise click.ClickException(f'No {year} season.')
+    summary = recompute_season(season, workers=workers,
+                               progress=lambda done, total, wn: click.echo(f'  week {wn} scored ({done}/{total})'))
+    click.echo(f'Recomputed {summary["weeks"]} week(s), {summary["picks"]} pick(s), '
+               f'{summary["results"]} result(s) for {year}.')
+
+
+def init_recompute(app):
+    app.cli.add_command(recompute_season_command)
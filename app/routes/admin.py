@@ -1,15 +1,55 @@
 from functools import wraps
 from datetime import datetime, timezone
-from flask import Blueprint, render_template, redirect, url_for, flash, request
+import json
+from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app, jsonify, abort
 from flask_login import login_required, current_user
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload, selectinload
 from app import db
-from app.models import User, Season, Week, Game, Pick, WeeklyResult, SeasonEntry
-from app.scoring import calculate_week_results, calculate_prize_pool
-from app.odds import fetch_odds_for_week
+from app.cache import page_cache, invalidate_active_season, get_active_season
+from app.models import User, Season, Week, Game, Pick, WeeklyResult, SeasonEntry, GameConsensus, Job
+from app.scoring import calculate_prize_pool, _results_changed
+from app.leaderboard import refresh_all_time
+from app.rank_history import update_rank_history
+from app.profiling import list_profiles, load_profile
+from app.user_cache import user_cache
+from app.picks_grid import invalidate_picks_grid
+from app.slow_queries import worst_offenders
+from app.jobs import job_runner, recent_jobs, job_status
+from app.entries import mark_paid
+from app.user_import import validate_rows, stage_import, parse_rows, ImportFormatError
+from app.user_search import search_users
 
 admin_bp = Blueprint('admin', __name__)
 
 
+# query-string values of the user list's filter chips -> search_users arguments
+USER_FILTERS = {
+    'status': {'active': True, 'inactive': False},
+    'role': {'admin': True, 'player': False},
+    'paid': {'paid': True, 'unpaid': False},
+}
+
+
+def _enqueue(kind, **params):
+    """Queue a background job and send the admin to its status page."""
+    job, created = job_runner.submit(kind, created_by=current_user.id, **params)
+    if not created:
+        flash('That job is already queued or running.', 'info')
+    return redirect(url_for('admin.job_detail', job_id=job.id))
+
+
+def _job_return_url(job):
+    params = json.loads(job.params)
+    if 'week_id' in params:
+        return url_for('admin.manage_week', week_id=params['week_id'])
+    if job.kind == 'import_users':
+        return url_for('admin.users')
+    if job.kind == 'add_all_entries':
+        return url_for('admin.prize_pool', season_id=params['season_id'])
+    return url_for('admin.seasons')
+
+
 def admin_required(f):
     @wraps(f)
     @login_required
@@ -24,8 +64,40 @@ def admin_required(f):
 @admin_bp.route('/users')
 @admin_required
 def users():
-    all_users = User.query.order_by(User.username).all()
-    return render_template('admin/users.html', users=all_users)
+    args = request.args
+    season = get_active_season()
+    season_id = args.get('season', type=int) or (season.id if season else None)
+    filters = {
+        'q': args.get('q', ''),
+        'active': USER_FILTERS['status'].get(args.get('status')),
+        'admin': USER_FILTERS['role'].get(args.get('role')),
+        'paid': USER_FILTERS['paid'].get(args.get('paid')),
+    }
+    page = search_users(season_id=season_id, after=args.get('after'), before=args.get('before'), **filters)
+    paid_ids = set()
+    if season_id and page.users:
+        paid_ids = {uid for (uid,) in db.session.query(SeasonEntry.user_id).filter(
+            SeasonEntry.season_id == season_id, SeasonEntry.has_paid.is_(True),
+            SeasonEntry.user_id.in_([u.id for u in page.users]))}
+    kept = {k: v for k, v in args.items() if k not in ('after', 'before') and v}
+
+    def users_url(**changes):
+        params = {**kept, **changes}
+        return url_for('admin.users', **{k: v for k, v in params.items() if v})
+
+    return render_template('admin/users.html', page=page, users=page.users, paid_ids=paid_ids, args=kept,
+                           season_id=season_id, season_year=_season_year(season, season_id), users_url=users_url)
+
+
+def _season_year(active, season_id):
+    if active and active.id == season_id:
+        return active.year
+    return db.session.query(Season.year).filter_by(id=season_id).scalar() if season_id else None
+
+
+def _back_to_users():
+    target = request.form.get('next', '')
+    return redirect(target if target.startswith('/admin/users') else url_for('admin.users'))
 
 
 @admin_bp.route('/users/add', methods=['POST'])
@@ -53,16 +125,42 @@ def add_user():
     return redirect(url_for('admin.users'))
 
 
+@admin_bp.route('/users/import', methods=['POST'])
+@admin_required
+def import_users_upload():
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        flash('Choose a CSV or NDJSON file to import.', 'danger')
+        return redirect(url_for('admin.users'))
+    fmt = 'ndjson' if upload.filename.lower().endswith(('.ndjson', '.jsonl')) else 'csv'
+    try:
+        rows = parse_rows(upload.read().decode('utf-8-sig'), fmt)
+    except (ImportFormatError, UnicodeDecodeError) as e:
+        flash(f'Could not read {upload.filename}: {e}', 'danger')
+        return redirect(url_for('admin.users'))
+    report, valid = validate_rows(rows)
+    if not valid:
+        return render_template('admin/import_report.html', report=report, created=0, filename=upload.filename)
+    # hashing is slow, so it runs as a job; the validated rows are handed over in memory, not in job params
+    return _enqueue('import_users', batch=stage_import(report, valid), filename=upload.filename)
+
+
 @admin_bp.route('/users/<int:user_id>/toggle', methods=['POST'])
 @admin_required
 def toggle_user_active(user_id):
     user = db.session.get(User, user_id)
     if user:
         user.is_active_player = not user.is_active_player
+        season = get_active_season()
+        if season:
+            # the standings only rank active players, so every week of the season reranks
+            _results_changed(season.id, 1)
         db.session.commit()
+        user_cache.invalidate(user.id)
+        page_cache.bump_all()
         status = 'activated' if user.is_active_player else 'deactivated'
         flash(f'{user.display_name} has been {status}.', 'info')
-    return redirect(url_for('admin.users'))
+    return _back_to_users()
 
 
 @admin_bp.route('/users/<int:user_id>/reset-password', methods=['POST'])
@@ -76,15 +174,17 @@ def reset_password(user_id):
         else:
             user.set_password(new_pw)
             db.session.commit()
+            user_cache.invalidate(user.id)
             flash(f'Password reset for {user.display_name}.', 'success')
-    return redirect(url_for('admin.users'))
+    return _back_to_users()
 
 
 @admin_bp.route('/seasons')
 @admin_required
 def seasons():
-    all_seasons = Season.query.order_by(Season.year.desc()).all()
-    return render_template('admin/seasons.html', seasons=all_seasons)
+    all_seasons = Season.query.options(selectinload(Season.weeks)).order_by(Season.year.desc()).all()
+    game_counts = dict(db.session.query(Game.week_id, func.count(Game.id)).group_by(Game.week_id).all())
+    return render_template('admin/seasons.html', seasons=all_seasons, game_counts=game_counts)
 
 
 @admin_bp.route('/seasons/create', methods=['POST'])
@@ -105,6 +205,7 @@ def create_season():
     for wn in range(1, 19):
         db.session.add(Week(season_id=season.id, week_number=wn))
     db.session.commit()
+    invalidate_active_season()
     flash(f'Season {year} created with 18 weeks and ${entry_fee} entry fee.', 'success')
     return redirect(url_for('admin.seasons'))
 
@@ -117,6 +218,7 @@ def activate_season(season_id):
     if season:
         season.is_active = True
         db.session.commit()
+        invalidate_active_season()
         flash(f'Season {season.year} activated.', 'success')
     return redirect(url_for('admin.seasons'))
 
@@ -124,7 +226,7 @@ def activate_season(season_id):
 @admin_bp.route('/weeks/<int:week_id>')
 @admin_required
 def manage_week(week_id):
-    week = db.session.get(Week, week_id)
+    week = db.session.get(Week, week_id, options=[joinedload(Week.season)])
     if not week:
         flash('Week not found.', 'danger')
         return redirect(url_for('admin.seasons'))
@@ -139,6 +241,8 @@ def toggle_picks(week_id):
     if week:
         week.is_open_for_picks = not week.is_open_for_picks
         db.session.commit()
+        page_cache.bump(week.season_id)
+        invalidate_active_season()
         status = 'opened' if week.is_open_for_picks else 'closed'
         flash(f'Picks {status} for Week {week.week_number}.', 'info')
     return redirect(url_for('admin.manage_week', week_id=week_id))
@@ -151,12 +255,7 @@ def fetch_odds(week_id):
     if not week:
         flash('Week not found.', 'danger')
         return redirect(url_for('admin.seasons'))
-    try:
-        count = fetch_odds_for_week(week)
-        flash(f'Fetched/updated {count} games for Week {week.week_number}.', 'success')
-    except Exception as e:
-        flash(f'Error fetching odds: {e}', 'danger')
-    return redirect(url_for('admin.manage_week', week_id=week_id))
+    return _enqueue('fetch_odds', week_id=week.id)
 
 
 @admin_bp.route('/weeks/<int:week_id>/calculate', methods=['POST'])
@@ -166,9 +265,17 @@ def calculate_results(week_id):
     if not week:
         flash('Week not found.', 'danger')
         return redirect(url_for('admin.seasons'))
-    calculate_week_results(week)
-    flash(f'Results calculated for Week {week.week_number}.', 'success')
-    return redirect(url_for('admin.manage_week', week_id=week_id))
+    return _enqueue('calculate_results', week_id=week.id)
+
+
+@admin_bp.route('/seasons/<int:season_id>/recompute', methods=['POST'])
+@admin_required
+def recompute(season_id):
+    season = db.session.get(Season, season_id)
+    if not season:
+        flash('Season not found.', 'danger')
+        return redirect(url_for('admin.seasons'))
+    return _enqueue('recompute_season', season_id=season.id)
 
 
 @admin_bp.route('/weeks/<int:week_id>/complete', methods=['POST'])
@@ -178,7 +285,11 @@ def complete_week(week_id):
     if week:
         week.is_completed = True
         week.is_open_for_picks = False
+        refresh_all_time(week.season_id)
+        update_rank_history(week.season_id, week.week_number)
         db.session.commit()
+        page_cache.bump(week.season_id)
+        invalidate_active_season()
         flash(f'Week {week.week_number} marked as completed.', 'success')
     return redirect(url_for('admin.manage_week', week_id=week_id))
 
@@ -199,6 +310,8 @@ def save_scores(week_id):
             game.away_score = int(aws)
             game.is_final = True
     db.session.commit()
+    page_cache.bump(week.season_id)
+    invalidate_picks_grid(week.id)
     flash(f'Scores saved for Week {week.week_number}.', 'success')
     return redirect(url_for('admin.manage_week', week_id=week_id))
 
@@ -209,9 +322,13 @@ def delete_game(game_id):
     game = db.session.get(Game, game_id)
     if game:
         week_id = game.week_id
+        season_id = game.week.season_id
         Pick.query.filter_by(game_id=game.id).delete()
+        GameConsensus.query.filter_by(game_id=game.id).delete()
         db.session.delete(game)
         db.session.commit()
+        page_cache.bump(season_id)
+        invalidate_picks_grid(week_id)
         flash('Game deleted.', 'info')
         return redirect(url_for('admin.manage_week', week_id=week_id))
     return redirect(url_for('admin.seasons'))
@@ -248,19 +365,7 @@ def add_all_entries(season_id):
     if not season:
         flash('Season not found.', 'danger')
         return redirect(url_for('admin.seasons'))
-    
-    users = User.query.filter_by(is_active_player=True).all()
-    count = 0
-    for user in users:
-        existing = SeasonEntry.query.filter_by(season_id=season.id, user_id=user.id).first()
-        if not existing:
-            entry = SeasonEntry(season_id=season.id, user_id=user.id, has_paid=False)
-            db.session.add(entry)
-            count += 1
-    
-    db.session.commit()
-    flash(f'Added {count} players to season {season.year}.', 'success')
-    return redirect(url_for('admin.prize_pool', season_id=season_id))
+    return _enqueue('add_all_entries', season_id=season.id)
 
 
 @admin_bp.route('/seasons/<int:season_id>/entries/<int:user_id>/toggle-paid', methods=['POST'])
@@ -281,6 +386,24 @@ def toggle_entry_paid(season_id, user_id):
             entry.amount_paid = season.entry_fee if season else 30
     
     db.session.commit()
+    page_cache.bump(season_id)
+    return redirect(url_for('admin.prize_pool', season_id=season_id))
+
+
+@admin_bp.route('/seasons/<int:season_id>/entries/mark-paid', methods=['POST'])
+@admin_required
+def bulk_mark_paid(season_id):
+    season = db.session.get(Season, season_id)
+    if not season:
+        flash('Season not found.', 'danger')
+        return redirect(url_for('admin.seasons'))
+    paid = request.form.get('paid', '1') == '1'
+    counts = mark_paid(season, request.form.getlist('user_id', type=int), paid=paid)
+    if paid:
+        flash(f'Marked {counts["updated"] + counts["entered"]} players paid '
+              f'({counts["entered"]} newly entered).', 'success')
+    else:
+        flash(f'Marked {counts["updated"]} players unpaid.', 'success')
     return redirect(url_for('admin.prize_pool', season_id=season_id))
 
 
@@ -296,8 +419,60 @@ def update_entry_fee(season_id):
     if new_fee and new_fee > 0:
         season.entry_fee = new_fee
         db.session.commit()
+        page_cache.bump(season.id)
         flash(f'Entry fee updated to ${new_fee}.', 'success')
     else:
         flash('Invalid entry fee.', 'danger')
     
     return redirect(url_for('admin.prize_pool', season_id=season_id))
+
+
+@admin_bp.route('/profiles')
+@admin_required
+def profiles():
+    captured = list_profiles(current_app.config['PROFILE_DIR'])
+    return render_template('admin/profiles.html', profiles=captured)
+
+
+@admin_bp.route('/profiles/<name>')
+@admin_required
+def profile_detail(name):
+    profile = load_profile(current_app.config['PROFILE_DIR'], name)
+    if not profile:
+        flash('Profile not found.', 'danger')
+        return redirect(url_for('admin.profiles'))
+    return render_template('admin/profile_detail.html', profile=profile)
+
+
+@admin_bp.route('/slow-queries')
+@admin_required
+def slow_queries():
+    return render_template('admin/slow_queries.html', groups=worst_offenders(),
+                           threshold=current_app.config.get('SLOW_QUERY_THRESHOLD_MS'))
+
+
+@admin_bp.route('/jobs')
+@admin_required
+def jobs():
+    return render_template('admin/jobs.html', jobs=recent_jobs())
+
+
+@admin_bp.route('/jobs/<int:job_id>')
+@admin_required
+def job_detail(job_id):
+    job = db.session.get(Job, job_id)
+    if not job:
+        flash('Job not found.', 'danger')
+        return redirect(url_for('admin.jobs'))
+    result = json.loads(job.result) if job.result else None
+    return render_template('admin/job.html', job=job, status=job_status(job), result=result,
+                           return_url=_job_return_url(job))
+
+
+@admin_bp.route('/jobs/<int:job_id>.json')
+@admin_required
+def job_json(job_id):
+    job = db.session.get(Job, job_id)
+    if not job:
+        abort(404)
+    return jsonify(job_status(job))
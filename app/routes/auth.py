@@ -2,6 +2,7 @@ from flask import Blueprint, render_template, redirect, url_for, flash, request
 from flask_login import login_user, logout_user, login_required, current_user
 from app.models import User
 from app import db
+from app.user_cache import user_cache
 
 auth_bp = Blueprint('auth', __name__)
 
@@ -41,14 +42,16 @@ def change_password():
     if request.method == 'POST':
         current_pw = request.form.get('current_password', '')
         new_pw = request.form.get('new_password', '')
-        if not current_user.check_password(current_pw):
+        user = db.session.get(User, current_user.id)
+        if not user.check_password(current_pw):
             flash('Current password is incorrect.', 'danger')
             return redirect(url_for('auth.change_password'))
         if len(new_pw) < 4:
             flash('New password must be at least 4 characters.', 'danger')
             return redirect(url_for('auth.change_password'))
-        current_user.set_password(new_pw)
+        user.set_password(new_pw)
         db.session.commit()
+        user_cache.invalidate(user.id)
         flash('Password changed successfully.', 'success')
         return redirect(url_for('main.index'))
     return render_template('auth/change_password.html')
@@ -0,0 +1,13 @@
+from flask import Blueprint, Response, current_app, request, abort
+from app.metrics import render, flush
+
+metrics_bp = Blueprint('metrics', __name__)
+
+
+@metrics_bp.route('/metrics')
+def metrics():
+    token = current_app.config.get('METRICS_TOKEN')
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        abort(401)
+    flush()
+    return Response(render(), mimetype='text/plain; version=0.0.4')
@@ -1,16 +1,17 @@
 from datetime import datetime, timezone
-from flask import Blueprint, render_template, redirect, url_for, flash, request
+from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, abort
 from flask_login import login_required, current_user
+from sqlalchemy.orm import joinedload
 from app import db
-from app.models import User, Season, Week, Game, Pick, PickViewLog
+from app.cache import page_validators, not_modified, with_validators, get_active_season
+from app.models import User, Week, Game, Pick, PickViewLog
+from app.picks_grid import get_picks_grid, invalidate_picks_grid
+from app.consensus import record_pick_changes, consensus_for_games
+from app.live_odds import week_win_odds
 
 picks_bp = Blueprint('picks', __name__)
 
 
-def _get_active_season():
-    return Season.query.filter_by(is_active=True).first()
-
-
 def _has_viewed_others(user_id, week_id):
     return PickViewLog.query.filter_by(user_id=user_id, week_id=week_id).first() is not None
 
@@ -24,16 +25,11 @@ def _record_view(user_id, week_id):
 @picks_bp.route('/')
 @login_required
 def picks_index():
-    season = _get_active_season()
+    season = get_active_season()
     if not season:
         flash('No active season. Contact the administrator.', 'warning')
         return redirect(url_for('main.index'))
-    week = (
-        Week.query.filter_by(season_id=season.id, is_open_for_picks=True)
-        .order_by(Week.week_number).first()
-    )
-    if not week:
-        week = Week.query.filter_by(season_id=season.id).order_by(Week.week_number.desc()).first()
+    week = season.open_week
     if not week:
         flash('No weeks available.', 'warning')
         return redirect(url_for('main.index'))
@@ -43,54 +39,58 @@ def picks_index():
 @picks_bp.route('/week/<int:week_id>', methods=['GET'])
 @login_required
 def make_picks(week_id):
-    week = db.session.get(Week, week_id)
+    week = db.session.get(Week, week_id, options=[joinedload(Week.season)])
     if not week:
         flash('Week not found.', 'danger')
         return redirect(url_for('picks.picks_index'))
+    validators = None
+    if week.is_completed and not week.is_open_for_picks:
+        validators = page_validators('picks.make_picks', week.season_id, week.id)
+        unchanged = not_modified(validators)
+        if unchanged:
+            return unchanged
     games = Game.query.filter_by(week_id=week.id).order_by(Game.game_time).all()
-    game_ids = [g.id for g in games]
-    user_picks = {}
-    if game_ids:
-        picks = Pick.query.filter(Pick.user_id == current_user.id, Pick.game_id.in_(game_ids)).all()
-        user_picks = {p.game_id: p for p in picks}
+    grid = get_picks_grid(week.id, games)
+    user_picks = grid.row(current_user.id)
     has_submitted = len(user_picks) > 0
     has_viewed = _has_viewed_others(current_user.id, week.id)
     view_others = request.args.get('view_others') == '1'
     show_others = False
     others_picks = {}
     other_users = []
+    consensus = {}
+    win_odds = {}
     if has_submitted and (view_others or has_viewed or week.is_completed):
         if not week.is_completed:
             _record_view(current_user.id, week.id)
             has_viewed = True
         show_others = True
-        if game_ids:
-            other_picks_list = Pick.query.filter(
-                Pick.game_id.in_(game_ids), Pick.user_id != current_user.id
-            ).all()
-            for p in other_picks_list:
-                others_picks.setdefault(p.user_id, {})[p.game_id] = p
-            if others_picks:
-                other_users = User.query.filter(User.id.in_(list(others_picks.keys()))).all()
+        other_users, others_picks = grid.others(current_user.id)
+        consensus = consensus_for_games([g.id for g in games])
+        if not week.is_completed:
+            win_odds = week_win_odds(week.id)
     can_pick = week.is_open_for_picks and not has_viewed
     can_resubmit = has_submitted and can_pick
-    game_points = {}
-    for game in games:
-        if game.is_final:
-            for pick in game.picks:
-                pts = game.calculate_points(pick.picked_team)
-                if pts is not None:
-                    game_points[(pick.user_id, game.id)] = pts
     all_weeks = Week.query.filter_by(season_id=week.season_id).order_by(Week.week_number).all()
-    return render_template(
+    return with_validators(render_template(
         'picks/weekly.html',
         week=week, games=games, user_picks=user_picks,
         has_submitted=has_submitted, has_viewed=has_viewed,
         show_others=show_others, can_pick=can_pick, can_resubmit=can_resubmit,
-        others_picks=others_picks, other_users=other_users,
-        game_points=game_points, all_weeks=all_weeks,
-        current_user_id=current_user.id,
-    )
+        others_picks=others_picks, other_users=other_users, consensus=consensus, win_odds=win_odds,
+        all_weeks=all_weeks,
+    ), validators)
+
+
+@picks_bp.route('/week/<int:week_id>/win-odds.json')
+@login_required
+def win_odds(week_id):
+    week = db.session.get(Week, week_id)
+    if not week:
+        abort(404)
+    if not (week.is_completed or _has_viewed_others(current_user.id, week.id)):
+        abort(403)
+    return jsonify({str(uid): p for uid, p in week_win_odds(week.id).items()})
 
 
 @picks_bp.route('/week/<int:week_id>/submit', methods=['POST'])
@@ -123,13 +123,18 @@ def submit_picks(week_id):
         flash('No valid picks submitted.', 'warning')
         return redirect(url_for('picks.make_picks', week_id=week_id))
     not_started_ids = [g.id for g in games if not g.has_started]
+    replaced = []
     if not_started_ids:
+        replaced = (db.session.query(Pick.game_id, Pick.picked_team)
+                    .filter(Pick.user_id == current_user.id, Pick.game_id.in_(not_started_ids)).all())
         Pick.query.filter(
             Pick.user_id == current_user.id, Pick.game_id.in_(not_started_ids)
         ).delete(synchronize_session=False)
     for game_id, team in new_picks.items():
         db.session.add(Pick(user_id=current_user.id, game_id=game_id, picked_team=team))
+    record_pick_changes(games_by_id, removed=replaced, added=new_picks.items())
     db.session.commit()
+    invalidate_picks_grid(week.id)
     
     # Send confirmation email
     try:
@@ -144,7 +149,7 @@ def submit_picks(week_id):
                     'home_team': game.home_team,
                     'spread_display': game.spread_display,
                 })
-        send_picks_confirmation(current_user, week, picks_data)
+        send_picks_confirmation(db.session.get(User, current_user.id), week, picks_data)
     except Exception as e:
         # Email is optional, don't fail if it doesn't work
         pass
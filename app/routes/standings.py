@@ -1,8 +1,18 @@
-from flask import Blueprint, render_template, redirect, url_for, flash
-from flask_login import login_required
+from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify
+from markupsafe import Markup
+from flask_login import login_required, current_user
+from sqlalchemy.orm import joinedload
 from app import db
-from app.models import Season, Week, WeeklyResult
-from app.scoring import calculate_weekly_prize_winner, calculate_yearly_standings, calculate_prize_pool
+from app.cache import page_cache, page_validators, not_modified, with_validators, get_active_season
+from app.models import User, Season, Week, WeeklyResult
+from app.head_to_head import HeadToHead
+from app.analytics import player_analytics
+from app.leaderboard import all_time_leaderboard
+from app.rank_history import rank_history_chart
+from app.race import season_race
+from app.scoring import (
+    calculate_weekly_prize_winner, calculate_yearly_standings, calculate_prize_pool, results_by_week,
+)
 
 standings_bp = Blueprint('standings', __name__)
 
@@ -10,30 +20,50 @@ standings_bp = Blueprint('standings', __name__)
 @standings_bp.route('/')
 @login_required
 def index():
-    season = Season.query.filter_by(is_active=True).first()
+    season = get_active_season()
     if not season:
         flash('No active season.', 'warning')
         return redirect(url_for('main.index'))
     return redirect(url_for('standings.yearly', season_id=season.id))
 
 
+@standings_bp.route('/all-time')
+@login_required
+def all_time():
+    return render_template('standings/all_time.html', standings=all_time_leaderboard())
+
+
 @standings_bp.route('/yearly/<int:season_id>')
 @login_required
 def yearly(season_id):
-    season = db.session.get(Season, season_id)
-    if not season:
-        flash('Season not found.', 'danger')
-        return redirect(url_for('standings.index'))
+    validators = page_validators('standings.yearly', season_id)
+    unchanged = not_modified(validators)
+    if unchanged:
+        return unchanged
+    key = page_cache.key('standings.yearly', season_id)
+    content = page_cache.get(key)
+    if content is None:
+        season = db.session.get(Season, season_id)
+        if not season:
+            flash('Season not found.', 'danger')
+            return redirect(url_for('standings.index'))
+        content = _render_yearly(season)
+        page_cache.set(key, content)
+    return with_validators(render_template('standings/yearly.html', content=Markup(content)), validators)
+
+
+def _render_yearly(season):
     standings = calculate_yearly_standings(season)
     weekly_prize_info = calculate_weekly_prize_winner(season)
     prize_pool = calculate_prize_pool(season)
     weeks = Week.query.filter_by(season_id=season.id, is_completed=True).order_by(Week.week_number).all()
+    week_numbers = {w.id: w.week_number for w in weeks}
     weekly_data = {}
-    for w in weeks:
-        for wr in WeeklyResult.query.filter_by(week_id=w.id).all():
-            weekly_data.setdefault(wr.user_id, {})[w.week_number] = wr
+    for rs in results_by_week(weeks).values():
+        for wr in rs:
+            weekly_data.setdefault(wr.user_id, {})[week_numbers[wr.week_id]] = wr
     return render_template(
-        'standings/yearly.html',
+        'standings/_yearly.html',
         season=season, standings=standings, weekly_prize_info=weekly_prize_info,
         weeks=weeks, weekly_data=weekly_data, prize_pool=prize_pool,
     )
@@ -42,20 +72,99 @@ def yearly(season_id):
 @standings_bp.route('/weekly/<int:season_id>')
 @login_required
 def weekly(season_id):
-    season = db.session.get(Season, season_id)
-    if not season:
-        flash('Season not found.', 'danger')
-        return redirect(url_for('standings.index'))
+    validators = page_validators('standings.weekly', season_id)
+    unchanged = not_modified(validators)
+    if unchanged:
+        return unchanged
+    key = page_cache.key('standings.weekly', season_id)
+    content = page_cache.get(key)
+    if content is None:
+        season = db.session.get(Season, season_id)
+        if not season:
+            flash('Season not found.', 'danger')
+            return redirect(url_for('standings.index'))
+        content = _render_weekly(season)
+        page_cache.set(key, content)
+    return with_validators(render_template('standings/weekly.html', content=Markup(content)), validators)
+
+
+def _render_weekly(season):
     weeks = Week.query.filter_by(season_id=season.id, is_completed=True).order_by(Week.week_number).all()
-    weekly_winners = {}
-    for w in weeks:
+    weekly_winners = {w.id: {'results': [], 'winners': []} for w in weeks}
+    if weeks:
         results = (
-            WeeklyResult.query.filter_by(week_id=w.id)
-            .order_by(WeeklyResult.total_points.desc()).all()
+            WeeklyResult.query.filter(WeeklyResult.week_id.in_(list(weekly_winners)))
+            .options(joinedload(WeeklyResult.user))
+            .order_by(WeeklyResult.total_points_x2.desc()).all()
         )
-        winners = [r for r in results if r.weekly_win_share > 0]
-        weekly_winners[w.id] = {'results': results, 'winners': winners}
+        for r in results:
+            weekly_winners[r.week_id]['results'].append(r)
+            if r.weekly_win_share > 0:
+                weekly_winners[r.week_id]['winners'].append(r)
     return render_template(
-        'standings/weekly.html',
+        'standings/_weekly.html',
         season=season, weeks=weeks, weekly_winners=weekly_winners,
     )
+
+
+@standings_bp.route('/head-to-head/<int:season_id>')
+@login_required
+def head_to_head(season_id):
+    season = db.session.get(Season, season_id)
+    if not season:
+        flash('Season not found.', 'danger')
+        return redirect(url_for('standings.index'))
+    week_ids = [wid for (wid,) in db.session.query(Week.id).filter_by(season_id=season.id, is_completed=True)
+                .order_by(Week.week_number)]
+    h2h = HeadToHead.for_weeks(week_ids)
+    players = User.query.filter(User.id.in_(list(h2h.masks))).order_by(User.display_name).all() if h2h.masks else []
+    player_id = request.args.get('player', type=int) or current_user.id
+    rows = []
+    if player_id in h2h.masks:
+        row = h2h.row(player_id)
+        rows = [(u, *row[u.id]) for u in players if u.id != player_id]
+    # every pair, read both ways: (games both picked, same side, row player's points minus column player's)
+    grid = {}
+    for (a, b), (games, agreed, pts_a, pts_b) in h2h.matrix().items():
+        grid[a, b] = (games, agreed, pts_a - pts_b)
+        grid[b, a] = (games, agreed, pts_b - pts_a)
+    return render_template('standings/head_to_head.html', season=season, players=players,
+                           player_id=player_id, rows=rows, grid=grid)
+
+
+@standings_bp.route('/player/<int:season_id>/<int:user_id>')
+@login_required
+def player(season_id, user_id):
+    season = db.session.get(Season, season_id)
+    user = db.session.get(User, user_id)
+    if not season or not user:
+        flash('Player not found.', 'danger')
+        return redirect(url_for('standings.index'))
+    return render_template('standings/player.html', season=season, player=user,
+                           analytics=player_analytics(season.id, user.id))
+
+
+@standings_bp.route('/rank-history/<int:season_id>')
+@login_required
+def rank_history(season_id):
+    season = db.session.get(Season, season_id)
+    if not season:
+        flash('Season not found.', 'danger')
+        return redirect(url_for('standings.index'))
+    return render_template('standings/rank_history.html', season=season)
+
+
+@standings_bp.route('/rank-history/<int:season_id>.json')
+@login_required
+def rank_history_data(season_id):
+    return jsonify(rank_history_chart(season_id))
+
+
+@standings_bp.route('/race/<int:season_id>')
+@login_required
+def race(season_id):
+    season = db.session.get(Season, season_id)
+    if not season:
+        flash('Season not found.', 'danger')
+        return redirect(url_for('standings.index'))
+    return render_template('standings/race.html', season=season, rows=season_race(season))
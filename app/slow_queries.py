@@ -0,0 +1,107 @@
+"""
+Slow-query log.
+
+Every statement slower than SLOW_QUERY_THRESHOLD_MS is recorded with its
+normalized SQL, parameters, duration, the route that issued it and the
+database's query plan. Entries go to an in-memory ring buffer of
+SLOW_QUERY_BUFFER entries and, when SLOW_QUERY_LOG is set, are appended to
+that file as JSON lines.
+"""
+
+import json
+import threading
+from collections import deque
+from collections.abc import Mapping
+from datetime import datetime, timezone
+from flask import has_request_context, request
+
+_lock = threading.Lock()
+_settings = {'threshold': None, 'path': ''}
+_entries = deque(maxlen=500)
+
+
+def _explain(conn, cursor, statement, parameters):
+    """Query plan rows for ``statement``.
+
+    The EXPLAIN shares the caller's connection and transaction (a second
+    connection could wait on the caller's own locks), so it runs inside a
+    SAVEPOINT on a fresh cursor: a failing EXPLAIN is rolled back to the
+    savepoint and never aborts or otherwise touches the caller's transaction.
+    """
+    prefix = 'EXPLAIN QUERY PLAN ' if conn.dialect.name == 'sqlite' else 'EXPLAIN '
+    try:
+        cur = cursor.connection.cursor()
+    except Exception as e:
+        return [f'EXPLAIN failed: {e}']
+    try:
+        cur.execute('SAVEPOINT slow_query_explain')
+        try:
+            cur.execute(prefix + statement, parameters or ())
+            plan = [' '.join(str(c) for c in row) for row in cur.fetchall()]
+        except Exception as e:
+            cur.execute('ROLLBACK TO SAVEPOINT slow_query_explain')
+            plan = [f'EXPLAIN failed: {e}']
+        cur.execute('RELEASE SAVEPOINT slow_query_explain')
+        return plan
+    except Exception as e:
+        return [f'EXPLAIN failed: {e}']
+    finally:
+        cur.close()
+
+
+def record_if_slow(conn, cursor, statement, parameters, executemany, duration):
+    threshold = _settings['threshold']
+    if threshold is None or duration * 1000 < threshold:
+        return
+    from app.instrumentation import normalize_sql
+    entry = {
+        'at': datetime.now(timezone.utc).isoformat(),
+        'sql': statement,
+        'normalized': normalize_sql(statement),
+        'params': [] if executemany else dict(parameters) if isinstance(parameters, Mapping) else list(parameters or ()),
+        'duration_ms': round(duration * 1000, 3),
+        'route': request.endpoint if has_request_context() else None,
+        'plan': [] if executemany else _explain(conn, cursor, statement, parameters),
+    }
+    with _lock:
+        _entries.append(entry)
+        if _settings['path']:
+            with open(_settings['path'], 'a') as fh:
+                fh.write(json.dumps(entry, default=str) + '\n')
+
+
+def recent_slow_queries():
+    with _lock:
+        return list(_entries)
+
+
+def worst_offenders(entries=None):
+    """Group entries by normalized SQL, sorted by total time spent."""
+    groups = {}
+    for e in recent_slow_queries() if entries is None else entries:
+        grp = groups.get(e['normalized'])
+        if grp is None:
+            grp = groups[e['normalized']] = {
+                'normalized': e['normalized'], 'count': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                'routes': set(), 'example': e,
+            }
+        grp['count'] += 1
+        grp['total_ms'] += e['duration_ms']
+        if e['duration_ms'] >= grp['max_ms']:
+            grp['max_ms'] = e['duration_ms']
+            grp['example'] = e
+        if e['route']:
+            grp['routes'].add(e['route'])
+    for grp in groups.values():
+        grp['avg_ms'] = grp['total_ms'] / grp['count']
+        grp['routes'] = sorted(grp['routes'])
+    return sorted(groups.values(), key=lambda g: -g['total_ms'])
+
+
+def init_slow_queries(app):
+    global _entries
+    _settings['threshold'] = app.config.get('SLOW_QUERY_THRESHOLD_MS')
+    _settings['path'] = app.config.get('SLOW_QUERY_LOG', '')
+    size = app.config.get('SLOW_QUERY_BUFFER', 500)
+    if _entries.maxlen != size:
+        _entries = deque(_entries, maxlen=size)
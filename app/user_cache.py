@@ -0,0 +1,88 @@
+"""
+Cached user loader.
+
+``current_user`` only needs a handful of columns, so the Flask-Login loader
+returns a lightweight SessionUser from a bounded TTL cache instead of
+querying the users table on every request. Entries are dropped when an
+admin toggles or resets a user or a user changes their password; the
+``users`` generation in the shared cache file carries that invalidation to
+the other worker processes. Code that needs the full row (password checks,
+email) loads it with ``db.session.get(User, current_user.id)``.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from flask_login import UserMixin
+from app.cache import page_cache
+
+
+class SessionUser(UserMixin):
+    """Detached stand-in for User carrying just what requests read."""
+
+    def __init__(self, id, display_name, is_admin, is_active_player):
+        self.id = id
+        self.display_name = display_name
+        self.is_admin = bool(is_admin)
+        self.is_active_player = bool(is_active_player)
+
+    def __repr__(self):
+        return f"<SessionUser {self.id}>"
+
+
+class UserCache:
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._generation = None
+        self._lock = threading.Lock()
+
+    def configure(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.invalidate()
+
+    def get(self, user_id):
+        gen = page_cache.generation('users')
+        now = time.monotonic()
+        with self._lock:
+            if gen is None or gen != self._generation:
+                self._entries.clear()
+                self._generation = gen
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(user_id)
+                return entry[1]
+        user = self._load(user_id)
+        if user is not None and self.ttl > 0:
+            with self._lock:
+                self._entries[user_id] = (now + self.ttl, user)
+                self._entries.move_to_end(user_id)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return user
+
+    @staticmethod
+    def _load(user_id):
+        from app import db
+        from app.models import User
+        row = (db.session.query(User.id, User.display_name, User.is_admin, User.is_active_player)
+               .filter(User.id == user_id).first())
+        return SessionUser(*row) if row else None
+
+    def invalidate(self, user_id=None):
+        """Drop one user (or everyone) here and in every other worker."""
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
+        page_cache.bump_generation('users')
+
+
+user_cache = UserCache()
+
+
+def init_user_cache(app):
+    user_cache.configure(app.config.get('USER_CACHE_SIZE', 1024), app.config.get('USER_CACHE_TTL', 300))
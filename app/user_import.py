@@ -0,0 +1,241 @@
+"""
+Bulk user import from CSV or NDJSON.
+
+Rows need ``username``, ``email`` and ``password``; ``display_name``
+defaults to the username and ``is_admin`` / ``is_active_player`` accept
+1/0, true/false or yes/no. Every row is validated first: required fields,
+password length, duplicates within the file, and clashes with existing
+users, which are found with one case-insensitive query over all the
+file's usernames and emails. Only then are passwords hashed in parallel,
+since each pbkdf2:sha256 hash is deliberately CPU-bound, and the new users
+inserted in executemany batches under a single commit. The
+result is a per-row report, so one bad line never stops the rest of the
+file.
+
+The admin upload validates in the request and leaves the hashing and
+inserts to an ``import_users`` background job. Validated rows still carry
+plain-text passwords, so they are handed to the job in process memory
+(stage_import / take_staged_import) rather than through the jobs table;
+jobs run in the process that queued them. The job hashes on threads,
+which pbkdf2 runs on without holding the GIL, because forking a process
+pool from a threaded web worker can copy its locks mid-use; the
+``import-users`` command uses processes.
+"""
+
+import csv
+import io
+import json
+import secrets
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import click
+from flask import current_app
+from sqlalchemy import func, insert, or_, select
+from sqlalchemy.exc import IntegrityError
+from werkzeug.security import generate_password_hash
+from app import db
+from app.models import User
+
+MIN_PASSWORD = 4
+BATCH_SIZE = 500
+_TRUE = {'1', 'true', 'yes', 'y', 't'}
+_FALSE = {'0', 'false', 'no', 'n', 'f'}
+
+_staged = {}
+_staged_lock = threading.Lock()
+
+
+class ImportFormatError(ValueError):
+    """The file could not be read as CSV or NDJSON at all."""
+
+
+def parse_rows(text, fmt=None):
+    """[{field: value}] from CSV (with a header row) or NDJSON ``text``; ``fmt`` is 'csv' or 'ndjson'."""
+    if fmt is None:
+        fmt = 'ndjson' if text.lstrip().startswith('{') else 'csv'
+    if fmt == 'csv':
+        return [{(k or '').strip().lower(): v for k, v in row.items()} for row in csv.DictReader(io.StringIO(text))]
+    if fmt == 'ndjson':
+        rows = []
+        for n, line in enumerate(text.splitlines(), 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                raise ImportFormatError(f'Line {n} is not valid JSON: {e}') from None
+            if not isinstance(row, dict):
+                raise ImportFormatError(f'Line {n} is not a JSON object.')
+            rows.append({str(k).lower(): v for k, v in row.items()})
+        return rows
+    raise ImportFormatError(f'Unknown format {fmt!r}; use csv or ndjson.')
+
+
+def _flag(value, default):
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text == '':
+        return default
+    if text in _TRUE:
+        return True
+    if text in _FALSE:
+        return False
+    raise ValueError(f'not a yes/no value: {value!r}')
+
+
+def _clean(row):
+    """(user dict without the hash, password) or raise ValueError naming the problem."""
+    get = lambda f: str(row.get(f) or '').strip()
+    username, email, password = get('username'), get('email'), str(row.get('password') or '')
+    missing = [f for f, v in (('username', username), ('email', email), ('password', password)) if not v]
+    if missing:
+        raise ValueError('missing ' + ', '.join(missing))
+    if len(username) > 64:
+        raise ValueError('username is longer than 64 characters')
+    if len(email) > 120 or '@' not in email:
+        raise ValueError('email is not valid')
+    if len(password) < MIN_PASSWORD:
+        raise ValueError(f'password must be at least {MIN_PASSWORD} characters')
+    user = {'username': username, 'email': email, 'display_name': (get('display_name') or username)[:100],
+            'is_admin': _flag(row.get('is_admin'), False),
+            'is_active_player': _flag(row.get('is_active_player'), True)}
+    return user, password
+
+
+def hash_password(password):
+    return generate_password_hash(password, method='pbkdf2:sha256')
+
+
+def _hashes(passwords, workers, threads=False):
+    """Yield the hash of each password in order."""
+    if workers > 1 and len(passwords) > 1:
+        executor = ThreadPoolExecutor if threads else ProcessPoolExecutor
+        with executor(max_workers=min(workers, len(passwords))) as pool:
+            yield from pool.map(hash_password, passwords, chunksize=max(1, len(passwords) // (workers * 4)))
+    else:
+        yield from map(hash_password, passwords)
+
+
+def validate_rows(rows):
+    """(report, valid) for parsed ``rows``: the per-row report so far and [(entry, user, password)] to create.
+
+    Rows are numbered from 1; every entry starts as an 'error' and rows
+    that fail validation already carry their message.
+    """
+    report = [{'row': n, 'username': str(row.get('username') or '').strip(), 'status': 'error', 'error': None}
+              for n, row in enumerate(rows, 1)]
+    valid = []
+    seen_names, seen_emails = {}, {}
+    for entry, row in zip(report, rows):
+        try:
+            user, password = _clean(row)
+        except ValueError as e:
+            entry['error'] = str(e)
+            continue
+        name_key, email_key = user['username'].lower(), user['email'].lower()
+        if name_key in seen_names:
+            entry['error'] = f'username repeats row {seen_names[name_key]}'
+        elif email_key in seen_emails:
+            entry['error'] = f'email repeats row {seen_emails[email_key]}'
+        else:
+            seen_names[name_key], seen_emails[email_key] = entry['row'], entry['row']
+            valid.append((entry, user, password))
+
+    if valid:
+        lower_name, lower_email = func.lower(User.username), func.lower(User.email)
+        taken = db.session.execute(select(lower_name, lower_email).where(or_(
+            lower_name.in_(list(seen_names)), lower_email.in_(list(seen_emails))))).all()
+        taken_names = {name for name, _ in taken}
+        taken_emails = {email for _, email in taken}
+        kept = []
+        for entry, user, password in valid:
+            if user['username'].lower() in taken_names:
+                entry['error'] = 'username already exists'
+            elif user['email'].lower() in taken_emails:
+                entry['error'] = 'email already in use'
+            else:
+                kept.append((entry, user, password))
+        valid = kept
+    return report, valid
+
+
+def create_users(report, valid, workers=0, batch_size=BATCH_SIZE, progress=None, threads=False):
+    """Hash and insert the ``valid`` rows from validate_rows, completing and returning ``report``.
+
+    ``workers`` > 1 hashes passwords in that many processes, or threads
+    with ``threads``. ``progress`` is called as progress(hashed, total)
+    after each password.
+    """
+    if valid:
+        hashes = _hashes([p for _, _, p in valid], workers, threads)
+        for n, ((_, user, _), pw_hash) in enumerate(zip(valid, hashes), 1):
+            user['password_hash'] = pw_hash
+            if progress:
+                progress(n, len(valid))
+        users = [user for _, user, _ in valid]
+        try:
+            for start in range(0, len(users), batch_size):
+                db.session.execute(insert(User), users[start:start + batch_size])
+            db.session.commit()
+        except IntegrityError:
+            # someone added a clashing user after the check; nothing from this file was kept
+            db.session.rollback()
+            for entry, _, _ in valid:
+                entry['error'] = 'not imported: another user was added with the same username or email'
+            return report
+        for entry, _, _ in valid:
+            entry['status'] = 'created'
+    return report
+
+
+def import_users(rows, workers=0, batch_size=BATCH_SIZE):
+    """Create users from parsed ``rows``; returns [{'row', 'username', 'status', 'error'}] in file order.
+
+    Status is 'created' or 'error'; see validate_rows and create_users.
+    """
+    report, valid = validate_rows(rows)
+    return create_users(report, valid, workers, batch_size)
+
+
+def stage_import(report, valid):
+    """Hold a validated import in this process for an import_users job; returns the job's ``batch`` token."""
+    token = secrets.token_hex(8)
+    with _staged_lock:
+        _staged[token] = (report, valid)
+    return token
+
+
+def take_staged_import(token):
+    """(report, valid) staged under ``token``, removed from the process."""
+    with _staged_lock:
+        staged = _staged.pop(token, None)
+    if staged is None:
+        raise LookupError('The uploaded rows are no longer available; upload the file again.')
+    return staged
+
+
+@click.command('import-users')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'ndjson']), default=None,
+              help='Input format (guessed from the content by default).')
+@click.option('--workers', default=0, help='Hash passwords in this many processes (default: IMPORT_HASH_WORKERS).')
+def import_users_command(path, fmt, workers):
+    """Create users from a CSV or NDJSON file."""
+    with open(path, encoding='utf-8-sig') as f:
+        try:
+            rows = parse_rows(f.read(), fmt)
+        except ImportFormatError as e:
+            raise click.ClickException(str(e))
+    report = import_users(rows, workers=workers or current_app.config.get('IMPORT_HASH_WORKERS', 0))
+    for entry in report:
+        if entry['status'] == 'error':
+            click.echo(f'  row {entry["row"]} ({entry["username"] or "?"}): {entry["error"]}')
+    created = sum(1 for e in report if e['status'] == 'created')
+    click.echo(f'Created {created} of {len(report)} user(s).')
+
+
+def init_user_import(app):
+    app.cli.add_command(import_users_command)
@@ -0,0 +1,62 @@
+"""
+Admin user list: keyset pagination, prefix search and filters.
+
+Pages are ordered by username and continue from the last username shown
+(``after``) or back from the first (``before``), so every page is an index
+range scan of PAGE_SIZE + 1 rows however many users exist. There is no
+OFFSET and no total count. The search is a case-insensitive prefix match
+on username, display name or email, written as a range on lower(column)
+so each branch of the OR can use its own expression index. The active and
+admin filters have composite indexes that keep username order. The paid
+filter is an EXISTS probe on the (season_id, user_id) unique index of
+season_entries.
+"""
+
+from collections import namedtuple
+from sqlalchemy import and_, exists, func, or_
+from app.models import User, SeasonEntry
+
+PAGE_SIZE = 50
+
+UserPage = namedtuple('UserPage', 'users has_prev has_next first last')
+
+
+def _prefix(column, q):
+    lowered = func.lower(column)
+    return and_(lowered >= q, lowered < q + '\uffff')
+
+
+def search_users(q='', active=None, admin=None, paid=None, season_id=None, after=None, before=None,
+                 limit=PAGE_SIZE):
+    """One UserPage of users matching the filters, in username order.
+
+    ``active`` / ``admin`` / ``paid`` are True, False or None (no filter);
+    ``paid`` applies to ``season_id``. Pass the previous page's ``last``
+    as ``after`` for the next page, or its ``first`` as ``before`` for the
+    one before it.
+    """
+    query = User.query
+    q = (q or '').strip().lower()
+    if q:
+        query = query.filter(or_(_prefix(User.username, q), _prefix(User.display_name, q), _prefix(User.email, q)))
+    if active is not None:
+        query = query.filter(User.is_active_player == active)
+    if admin is not None:
+        query = query.filter(User.is_admin == admin)
+    if paid is not None and season_id is not None:
+        has_paid = exists().where(SeasonEntry.season_id == season_id, SeasonEntry.user_id == User.id,
+                                  SeasonEntry.has_paid.is_(True))
+        query = query.filter(has_paid if paid else ~has_paid)
+    if before is not None:
+        rows = query.filter(User.username < before).order_by(User.username.desc()).limit(limit + 1).all()
+        more = len(rows) > limit
+        users = rows[:limit][::-1]
+        has_prev, has_next = more, True
+    else:
+        if after is not None:
+            query = query.filter(User.username > after)
+        rows = query.order_by(User.username).limit(limit + 1).all()
+        users = rows[:limit]
+        has_prev, has_next = after is not None, len(rows) > limit
+    return UserPage(users, has_prev, has_next,
+                    users[0].username if users else None, users[-1].username if users else None)
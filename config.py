@@ -24,3 +24,28 @@ class Config:
     MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD', '')
     MAIL_DEFAULT_SENDER = os.environ.get('MAIL_DEFAULT_SENDER', 'noreply@pickem.local')
     MAIL_ENABLED = bool(os.environ.get('MAIL_SERVER', ''))
+    # Query instrumentation: Server-Timing header and N+1 warning threshold
+    SQL_SERVER_TIMING = os.environ.get('SQL_SERVER_TIMING', 'false').lower() == 'true'
+    SQL_N_PLUS_ONE_THRESHOLD = int(os.environ.get('SQL_N_PLUS_ONE_THRESHOLD', 5))
+    # Prometheus /metrics: shared snapshot directory for multi-worker servers, optional bearer token
+    METRICS_DIR = os.environ.get('METRICS_DIR', '')
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+    # Admin request profiler (?_profile=1): dump directory and how many captures to keep
+    PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(basedir, 'profiles'))
+    PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', 50))
+    # Slow-query log: threshold, in-memory ring buffer size, append-only JSON-lines file
+    SLOW_QUERY_THRESHOLD_MS = float(os.environ.get('SLOW_QUERY_THRESHOLD_MS', 100))
+    SLOW_QUERY_BUFFER = int(os.environ.get('SLOW_QUERY_BUFFER', 500))
+    SLOW_QUERY_LOG = os.environ.get('SLOW_QUERY_LOG', os.path.join(basedir, 'slow_queries.log'))
+    # Standings fragment cache shared by all worker processes (empty path disables it)
+    PAGE_CACHE_PATH = os.environ.get('PAGE_CACHE_PATH', os.path.join(basedir, 'page_cache.db'))
+    PAGE_CACHE_MAX_ENTRIES = int(os.environ.get('PAGE_CACHE_MAX_ENTRIES', 200))
+    # current_user cache: max entries and seconds before a cached user is reloaded
+    USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 1024))
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 300))
+    # Processes the admin season recompute scores weeks in (0 scores them in the request)
+    RECOMPUTE_WORKERS = int(os.environ.get('RECOMPUTE_WORKERS', 0))
+    # Background admin jobs: worker threads per process (0 runs each job inside the request that queues it)
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+    # Bulk user import: processes that hash passwords in parallel
+    IMPORT_HASH_WORKERS = int(os.environ.get('IMPORT_HASH_WORKERS', os.cpu_count() or 1))
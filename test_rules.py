@@ -1,8 +1,11 @@
 #!/usr/bin/env python3
 """Comprehensive test of all NFL Pick'em scoring rules against the specification."""
-import os, sys
+import os, sys, tempfile
 os.environ['DATABASE_URL'] = 'sqlite://'  # in-memory DB for tests
 os.environ['SECRET_KEY'] = 'test'
+_cache_dir = tempfile.TemporaryDirectory()
+os.environ['PAGE_CACHE_PATH'] = os.path.join(_cache_dir.name, 'page_cache.db')
+os.environ['JOB_WORKERS'] = '0'  # run background jobs inline unless a test starts the pool
 
 from app import create_app, db
 from app.models import User, Season, Week, Game, Pick, WeeklyResult, SeasonEntry
@@ -13,6 +16,9 @@ from app.scoring import (
     get_yearly_winners,
     calculate_prize_pool,
 )
+from app.cache import page_cache, get_active_season, invalidate_active_season
+from app.user_cache import user_cache
+from app.instrumentation import QueryStats, capture_queries, assert_max_queries, normalize_sql
 
 app = create_app()
 passed = 0
@@ -37,6 +43,9 @@ def check(cond, label, detail=""):
 def reset_db():
     db.drop_all()
     db.create_all()
+    page_cache.clear()
+    invalidate_active_season()
+    user_cache.invalidate()
 
 def make_user(name, email=None):
     u = User(username=name, email=email or f"{name}@test.com",
@@ -72,6 +81,17 @@ def add_pick(user, game, team):
     db.session.flush()
     return p
 
+def http(fn):
+    """Run fn() outside the test's app context so requests get a fresh session and g."""
+    import contextvars
+    return contextvars.Context().run(fn)
+
+def count_queries(fn):
+    """Run fn() via http() and return the number of SQL statements it issued."""
+    with capture_queries() as stats:
+        http(fn)
+    return stats.count
+
 def add_entry(season, user, paid=True):
     e = SeasonEntry(season_id=season.id, user_id=user.id,
                     has_paid=paid, amount_paid=season.entry_fee if paid else None)
@@ -566,6 +586,1299 @@ with app.app_context():
     p2 = Pick(user_id=1, game_id=g4.id, picked_team="H4", points=0.5)
     check(p2.is_winning_pick == True, "Edge: 0.5 pts IS a winning pick")
 
+    # ================================================================
+    print("\n=== QUERY COUNTS (hot paths) ===")
+    # ================================================================
+    # Page query counts must not grow with the number of games or players.
+    def page_queries(n_users, n_games):
+        reset_db()
+        s = make_season()
+        viewer = make_user("viewer")
+        admin = make_user("boss")
+        admin.is_admin = True
+        others = [make_user(f"p{i}") for i in range(n_users)]
+        w1 = get_week(s, 1)
+        w1.is_completed = True
+        games = [add_game(w1, f"H{i}", f"A{i}", spread=3, fav="home",
+                          home_score=20, away_score=7, final=True) for i in range(n_games)]
+        for u in [viewer] + others:
+            for g in games:
+                add_pick(u, g, g.home_team)
+        db.session.commit()
+        calculate_week_results(w1)
+        wid, sid = w1.id, s.id
+        counts = {}
+        client = app.test_client()
+        http(lambda: client.post('/login', data={'username': 'viewer', 'password': 'pw'}))
+        counts['make_picks'] = count_queries(lambda: client.get(f'/picks/week/{wid}'))
+        counts['yearly'] = count_queries(lambda: client.get(f'/standings/yearly/{sid}'))
+        counts['weekly'] = count_queries(lambda: client.get(f'/standings/weekly/{sid}'))
+        admin_client = app.test_client()
+        http(lambda: admin_client.post('/login', data={'username': 'boss', 'password': 'pw'}))
+        counts['seasons'] = count_queries(lambda: admin_client.get('/admin/seasons'))
+        counts['manage_week'] = count_queries(lambda: admin_client.get(f'/admin/weeks/{wid}'))
+        return counts
+
+    small = page_queries(2, 4)
+    large = page_queries(8, 12)
+    for page in small:
+        check(small[page] == large[page], f"Queries: {page} is constant in games/players",
+              f"{small[page]} vs {large[page]}")
+
+    # Hard ceilings per route, independent of league size
+    ceilings = {'make_picks': 8, 'yearly': 12}
+    for page, limit in ceilings.items():
+        check(large[page] <= limit, f"Queries: {page} issues at most {limit}", f"got {large[page]}")
+    try:
+        with assert_max_queries(0):
+            User.query.count()
+        fail("assert_max_queries raises when the limit is exceeded")
+    except AssertionError:
+        ok("assert_max_queries raises when the limit is exceeded")
+
+    # ================================================================
+    print("\n=== QUERY INSTRUMENTATION ===")
+    # ================================================================
+    check(normalize_sql("SELECT * FROM picks WHERE game_id IN (?, ?, ?)") ==
+          normalize_sql("SELECT * FROM picks WHERE game_id IN (?)"),
+          "N+1: expanded IN lists normalize together")
+    qs = QueryStats()
+    for _ in range(6):
+        qs.record("SELECT * FROM users WHERE users.id = ?", 0.001)
+    qs.record("SELECT * FROM weeks", 0.001)
+    rep = qs.repeated(5)
+    check(len(rep) == 1 and rep[0][1] == 6, "N+1: repeated statement flagged", f"got {rep}")
+
+    app.config['SQL_SERVER_TIMING'] = True
+    client = app.test_client()
+    http(lambda: client.post('/login', data={'username': 'viewer', 'password': 'pw'}))
+    resp = http(lambda: client.get('/'))
+    app.config['SQL_SERVER_TIMING'] = False
+    check('db;dur=' in resp.headers.get('Server-Timing', ''), "Server-Timing header when enabled",
+          f"got {resp.headers.get('Server-Timing')}")
+    resp = http(lambda: client.get('/'))
+    check('Server-Timing' not in resp.headers, "No Server-Timing header by default")
+
+    # ================================================================
+    print("\n=== METRICS ===")
+    # ================================================================
+    import json, tempfile, threading
+    from app import metrics
+    resp = http(lambda: client.get('/metrics'))
+    body = resp.get_data(as_text=True)
+    check(resp.status_code == 200, "Metrics: /metrics responds", f"status={resp.status_code}")
+    check('pickem_http_request_duration_seconds_bucket{endpoint="main.index",method="GET",le="+Inf"}' in body,
+          "Metrics: request latency histogram per endpoint")
+    check('pickem_operation_duration_seconds_count{operation="calculate_week_results"}' in body,
+          "Metrics: calculate_week_results timing")
+    check('pickem_db_queries_total{endpoint="standings.yearly"}' in body, "Metrics: DB queries per endpoint")
+
+    c = metrics.Counter('pickem_test_total', 'test', ('kind',))
+    ts = [threading.Thread(target=lambda: [c.inc(kind='x') for _ in range(1000)]) for _ in range(4)]
+    for t in ts: t.start()
+    for t in ts: t.join()
+    check(c.collect() == {('x',): 4000}, "Metrics: per-thread shards merge", f"got {c.collect()}")
+    check(c._shards == [] and c._base == {('x',): 4000}, "Metrics: exited threads fold into the base shard",
+          f"{len(c._shards)} shards left")
+
+    import subprocess, sys
+    g = metrics.Gauge('pickem_test_depth', 'test')
+    exited = subprocess.Popen([sys.executable, '-c', 'pass'])
+    exited.wait()
+    worker = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(60)'])
+    with tempfile.TemporaryDirectory() as d:
+        metrics._metrics_dir[0] = d
+        with open(os.path.join(d, f'metrics-{os.getppid()}.json'), 'w') as fh:
+            json.dump({'pickem_test_total': [[['x'], 500]]}, fh)
+        with open(os.path.join(d, f'metrics-{exited.pid}.json'), 'w') as fh:
+            json.dump({'pickem_test_total': [[['x'], 70]], 'pickem_test_depth': [[[], 3]]}, fh)
+        with open(os.path.join(d, f'metrics-{worker.pid}.json'), 'w') as fh:
+            json.dump({'pickem_test_total': [[['x'], 200]], 'pickem_test_depth': [[[], 5]]}, fh)
+        metrics.flush()
+        merged = metrics.aggregate()
+        left = sorted(os.listdir(d))
+        worker.kill()
+        worker.wait()
+        after_exit = metrics.aggregate()
+        again = metrics.aggregate()
+        metrics._metrics_dir[0] = None
+    check(merged['pickem_test_total'] == {('x',): 4770}, "Metrics: live and exited workers' snapshots are summed",
+          f"got {merged['pickem_test_total']}")
+    check(f'metrics-{exited.pid}.json' not in left and metrics.RETIRED in left,
+          "Metrics: exited workers' snapshots fold into the retired totals", str(left))
+    check(merged['pickem_test_depth'] == {(): 5}, "Metrics: exited workers' gauges are dropped",
+          f"got {merged['pickem_test_depth']}")
+    check(after_exit['pickem_test_total'] == again['pickem_test_total'] == {('x',): 4770}
+          and after_exit['pickem_test_depth'] == {}, "Metrics: a counter never decreases after a worker exits",
+          f"{after_exit['pickem_test_total']} then {again['pickem_test_total']}")
+    metrics._registry.remove(g)
+    metrics._registry.remove(c)
+
+    # ================================================================
+    print("\n=== REQUEST PROFILER ===")
+    # ================================================================
+    from app.profiling import list_profiles
+    sid = Season.query.first().id
+    wid = Week.query.filter_by(season_id=sid, week_number=1).one().id
+    with tempfile.TemporaryDirectory() as d:
+        app.config['PROFILE_DIR'] = d
+        app.config['PROFILE_KEEP'] = 2
+        http(lambda: client.get(f'/picks/week/{wid}?_profile=1'))
+        check(list_profiles(d) == [], "Profiler: ignored for non-admins")
+        admin_client = app.test_client()
+        http(lambda: admin_client.post('/login', data={'username': 'boss', 'password': 'pw'}))
+        http(lambda: admin_client.get(f'/picks/week/{wid}'))
+        check(list_profiles(d) == [], "Profiler: off without the flag")
+        for _ in range(3):
+            http(lambda: admin_client.get(f'/picks/week/{wid}', headers={'X-Profile': '1'}))
+        captured = list_profiles(d)
+        check(len(captured) == 2, "Profiler: keeps only PROFILE_KEEP captures", f"got {len(captured)}")
+        check(captured and captured[0]['endpoint'] == 'picks.make_picks' and captured[0]['queries']
+              and captured[0]['top'], "Profiler: summary has SQL and top functions")
+        check(len([f for f in os.listdir(d) if f.endswith('.prof')]) == 2, "Profiler: pstats dumps written")
+        resp = http(lambda: admin_client.get('/admin/profiles'))
+        check(resp.status_code == 200 and b'picks.make_picks' in resp.data, "Profiler: admin page lists captures")
+        resp = http(lambda: admin_client.get(f"/admin/profiles/{captured[0]['name']}"))
+        check(resp.status_code == 200, "Profiler: detail page renders")
+
+    # ================================================================
+    print("\n=== SLOW-QUERY LOG ===")
+    # ================================================================
+    from app import slow_queries
+    with tempfile.TemporaryDirectory() as d:
+        log_path = os.path.join(d, 'slow.log')
+        slow_queries._settings.update(threshold=0, path=log_path)
+        slow_queries._entries.clear()
+        wid = Week.query.filter_by(season_id=sid, week_number=1).one().id
+        http(lambda: client.get(f'/picks/week/{wid}'))
+        slow_queries._settings.update(threshold=None, path='')
+        entries = slow_queries.recent_slow_queries()
+        game_q = [e for e in entries if 'FROM games' in e['sql'] and e['route'] == 'picks.make_picks']
+        check(game_q and game_q[0]['plan'] and game_q[0]['params'], "Slow log: entry has route, params and plan",
+              f"got {game_q[:1]}")
+        with open(log_path) as fh:
+            check(len(fh.readlines()) == len(entries), "Slow log: entries appended to file")
+        groups = slow_queries.worst_offenders()
+        check(sum(g['count'] for g in groups) == len(entries) and len(groups) < len(entries) + 1,
+              "Slow log: grouped by normalized statement")
+        resp = http(lambda: admin_client.get('/admin/slow-queries'))
+        check(resp.status_code == 200 and b'FROM games' in resp.data, "Slow log: admin page lists offenders")
+        slow_queries._settings.update(threshold=0)
+        slow_queries._entries.clear()
+        sa_conn = db.session.connection()
+        slow_queries.record_if_slow(sa_conn, sa_conn.connection.cursor(), 'SELECT :week_id', {'week_id': wid},
+                                    False, 1.0)
+        slow_queries._settings.update(threshold=None)
+        check([e['params'] for e in slow_queries.recent_slow_queries()] == [{'week_id': wid}],
+              "Slow log: named parameters keep their values", str(slow_queries.recent_slow_queries()[:1]))
+        slow_queries._entries.clear()
+    renamed = User.query.filter_by(username='boss').one()
+    old_name, renamed.display_name = renamed.display_name, 'Explained Boss'
+    db.session.flush()
+    sa_conn = db.session.connection()
+    plan = slow_queries._explain(sa_conn, sa_conn.connection.cursor(), 'SELECT * FROM no_such_table', ())
+    still = db.session.execute(db.text("SELECT display_name FROM users WHERE username = 'boss'")).scalar()
+    check(plan[0].startswith('EXPLAIN failed') and still == 'Explained Boss',
+          "Slow log: a failing EXPLAIN leaves the caller's transaction intact", f"{plan} {still}")
+    db.session.rollback()
+    check(User.query.filter_by(username='boss').one().display_name == old_name,
+          "Slow log: the caller's transaction still rolls back as a whole")
+
+    # ================================================================
+    print("\n=== STANDINGS PAGE CACHE ===")
+    # ================================================================
+    yearly_url = f'/standings/yearly/{sid}'
+    page_cache.bump(sid)
+    first = http(lambda: client.get(yearly_url)).data
+    hits = page_cache.hits
+    n = count_queries(lambda: client.get(yearly_url))
+    check(page_cache.hits == hits + 1, "Cache: second view is a hit")
+    check(n <= 1, "Cache: hit skips the standings queries", f"{n} queries")
+    check(http(lambda: client.get(yearly_url)).data == first, "Cache: hit serves identical HTML")
+    w1 = Week.query.filter_by(season_id=sid, week_number=1).one()
+    v = page_cache.version(sid)
+    calculate_week_results(w1)
+    check(page_cache.version(sid) == v + 1, "Cache: calculate_week_results bumps the season version")
+    misses = page_cache.misses
+    http(lambda: client.get(yearly_url))
+    check(page_cache.misses == misses + 1, "Cache: bumped version misses")
+    v = page_cache.version(sid)
+    http(lambda: admin_client.post(f'/admin/seasons/{sid}/update-entry-fee', data={'entry_fee': 40}))
+    boss_id = User.query.filter_by(username='boss').one().id
+    http(lambda: admin_client.post(f'/admin/seasons/{sid}/entries/{boss_id}/toggle-paid'))
+    w1_id = w1.id
+    http(lambda: admin_client.post(f'/admin/weeks/{w1_id}/complete'))
+    check(page_cache.version(sid) == v + 3, "Cache: fee, paid status and complete_week bump the version",
+          f"{v} -> {page_cache.version(sid)}")
+    import app.odds as odds_module
+    g1 = Game.query.filter_by(week_id=w1_id).first()
+    fetched = [{'home_team': g1.home_team, 'away_team': g1.away_team, 'spread': g1.spread, 'favorite': g1.favorite,
+                'game_time': None, 'espn_id': g1.espn_id, 'home_score': None, 'away_score': None, 'status': ''}]
+    real_espn, real_odds_api = odds_module.fetch_games_from_espn, odds_module.fetch_odds_from_odds_api
+    odds_module.fetch_games_from_espn = lambda week_number, year: [dict(fetched[0])]
+    odds_module.fetch_odds_from_odds_api = lambda: []
+    try:
+        v = page_cache.version(sid)
+        odds_module.fetch_odds_for_week(db.session.get(Week, w1_id))
+        check(page_cache.version(sid) == v + 1, "Cache: fetching odds bumps the season version")
+    finally:
+        odds_module.fetch_games_from_espn, odds_module.fetch_odds_from_odds_api = real_espn, real_odds_api
+    page_cache.max_entries = 3
+    for i in range(5):
+        page_cache.set(f'lru-test:{i}', 'x')
+    check(page_cache.stats()['entries'] == 3, "Cache: LRU bound enforced", f"got {page_cache.stats()}")
+    page_cache.max_entries = 200
+
+    # ================================================================
+    print("\n=== CONDITIONAL RESPONSES ===")
+    # ================================================================
+    for url in (yearly_url, f'/standings/weekly/{sid}', f'/picks/week/{w1.id}'):
+        resp = http(lambda: client.get(url))
+        etag, modified = resp.headers.get('ETag'), resp.headers.get('Last-Modified')
+        check(resp.status_code == 200 and etag and modified,
+              f"ETag: {url} sends validators", f"headers={dict(resp.headers)}")
+        n = count_queries(lambda: client.get(url, headers={'If-None-Match': etag}))
+        resp = http(lambda: client.get(url, headers={'If-None-Match': etag}))
+        check(resp.status_code == 304 and not resp.data, f"ETag: {url} answers 304")
+        check(n <= 2, f"ETag: {url} 304 skips rendering queries", f"{n} queries")
+        resp = http(lambda: client.get(url, headers={'If-Modified-Since': modified}))
+        check(resp.status_code == 304, f"ETag: {url} honors If-Modified-Since")
+    page_cache.bump(sid)
+    resp = http(lambda: client.get(yearly_url, headers={'If-None-Match': etag}))
+    check(resp.status_code == 200, "ETag: data version bump invalidates the tag")
+    resp = http(lambda: admin_client.get(yearly_url, headers={'If-None-Match': resp.headers['ETag']}))
+    check(resp.status_code == 200, "ETag: tags are per user")
+
+    # ================================================================
+    print("\n=== ACTIVE SEASON CACHE ===")
+    # ================================================================
+    http(lambda: client.get('/'))
+    for url in ('/', '/picks/', '/standings/'):
+        n = count_queries(lambda: client.get(url))
+        check(n <= 1, f"Active season: {url} costs no season/week queries", f"{n} queries")
+    w2 = Week.query.filter_by(season_id=sid, week_number=2).one()
+    http(lambda: admin_client.post(f'/admin/weeks/{w2.id}/toggle-picks'))
+    resp = http(lambda: client.get('/picks/'))
+    check(resp.headers['Location'].endswith(f'/picks/week/{w2.id}'), "Active season: toggle_picks invalidates",
+          resp.headers.get('Location'))
+    # Another worker changes the flags and bumps the shared generation
+    Week.query.filter_by(id=w2.id).update({Week.is_open_for_picks: False})
+    db.session.commit()
+    check(get_active_season().open_week.id == w2.id, "Active season: served from process cache")
+    page_cache.bump_generation('active_season')
+    check(get_active_season().open_week.id != w2.id, "Active season: other process's bump is seen")
+
+    # ================================================================
+    print("\n=== USER LOADER CACHE ===")
+    # ================================================================
+    http(lambda: client.get('/'))
+    n = count_queries(lambda: client.get('/'))
+    check(n == 0, "User cache: warm authenticated request issues no queries", f"{n} queries")
+    viewer_id = User.query.filter_by(username='viewer').one().id
+    http(lambda: admin_client.post(f'/admin/users/{viewer_id}/reset-password', data={'new_password': 'newpass'}))
+    n = count_queries(lambda: client.get('/'))
+    check(n == 1, "User cache: reset_password reloads the user", f"{n} queries")
+    resp = http(lambda: client.post('/change-password', data={'current_password': 'newpass', 'new_password': 'viewpass'}))
+    check(resp.status_code == 302 and resp.headers['Location'] == '/', "User cache: change_password uses the full row")
+    n = count_queries(lambda: client.get('/'))
+    check(n == 1, "User cache: change_password reloads the user", f"{n} queries")
+    http(lambda: admin_client.post(f'/admin/users/{viewer_id}/toggle'))
+    check(user_cache.get(viewer_id).is_active_player is False, "User cache: toggle_user_active is visible")
+    http(lambda: admin_client.post(f'/admin/users/{viewer_id}/toggle'))
+    small_cache = type(user_cache)(maxsize=1, ttl=60)
+    small_cache.get(viewer_id)
+    small_cache.get(User.query.filter_by(username='boss').one().id)
+    check(len(small_cache._entries) == 1, "User cache: size bound enforced")
+
+    # ================================================================
+    print("\n=== PICKS GRID CACHE ===")
+    # ================================================================
+    from app.picks_grid import get_picks_grid
+    picks_url = f'/picks/week/{wid}'
+    http(lambda: client.get(picks_url))
+    with capture_queries() as stats:
+        resp = http(lambda: client.get(picks_url))
+    check(resp.status_code == 200 and not any('FROM picks' in q for q, _ in stats.queries),
+          "Picks grid: warm page skips the picks query")
+    check(b'P0' in resp.data and b'Viewer</th>' not in resp.data, "Picks grid: own column left out")
+    grid = get_picks_grid(wid, Game.query.filter_by(week_id=wid).all())
+    check(grid.row(viewer_id) and all(p.points == 10 for p in grid.row(viewer_id).values()),
+          "Picks grid: points precomputed", f"got {grid.row(viewer_id)}")
+    game = Game.query.filter_by(week_id=wid).first()
+    http(lambda: admin_client.post(f'/admin/weeks/{wid}/save-scores',
+                                   data={f'home_score_{game.id}': '7', f'away_score_{game.id}': '20'}))
+    with capture_queries() as stats:
+        resp = http(lambda: client.get(picks_url))
+    check(any('FROM picks' in q for q, _ in stats.queries), "Picks grid: score change rebuilds the grid")
+    grid = get_picks_grid(wid, Game.query.filter_by(week_id=wid).all())
+    check(grid.row(viewer_id)[game.id].points == -15, "Picks grid: rebuilt with new points",
+          f"got {grid.row(viewer_id)[game.id]}")
+
+    # ================================================================
+    print("\n=== PICK MATRIX ===")
+    # ================================================================
+    import tracemalloc
+    from app.pick_matrix import WeekPickMatrix, HOME, AWAY, NO_PICK
+    w2 = Week.query.filter_by(season_id=sid, week_number=2).one()
+    players = User.query.filter(User.username.like('p%')).order_by(User.id).all()
+    mgames = [add_game(w2, f"MH{i}", f"MA{i}", spread=2.5, fav="away" if i % 2 else "home",
+                       home_score=21, away_score=14, final=i < 5) for i in range(7)]
+    for ui, u in enumerate(players):
+        for gi, g in enumerate(mgames):
+            if (ui + gi) % 3:
+                add_pick(u, g, g.home_team if (ui * gi) % 2 else g.away_team)
+    db.session.commit()
+    w2_id = w2.id
+    with capture_queries() as stats:
+        m = WeekPickMatrix.for_week(db.session, w2_id)
+    check(stats.count == 1, "Matrix: built from one SELECT", f"{stats.count} queries")
+    orm_picks = Pick.query.filter(Pick.game_id.in_([g.id for g in mgames])).all()
+    by_game = {g.id: g for g in mgames}
+    cells_ok = all(m.pick(p.user_id, p.game_id) == (HOME if p.picked_team == by_game[p.game_id].home_team else AWAY)
+                   and m.points_for(p.user_id, p.game_id) == (by_game[p.game_id].calculate_points(p.picked_team)
+                                                             if by_game[p.game_id].is_final else None)
+                   for p in orm_picks)
+    check(cells_ok and m.pick(players[0].id, mgames[0].id) == NO_PICK, "Matrix: cells and points match the ORM")
+    halves_ok = all(m.points_x2_for(p.user_id, p.game_id) == by_game[p.game_id].calculate_points_x2(p.picked_team)
+                    for p in orm_picks if by_game[p.game_id].is_final)
+    check(m.points_x2.typecode == 'h' and halves_ok, "Matrix: points stored as integer half points")
+    expected = {g.id: (sum(1 for p in orm_picks if p.game_id == g.id and p.picked_team == g.home_team),
+                       sum(1 for p in orm_picks if p.game_id == g.id and p.picked_team == g.away_team))
+                for g in mgames}
+    check(m.consensus() == expected, "Matrix: consensus counts", f"got {m.consensus()}")
+    totals = {}
+    for p in orm_picks:
+        if by_game[p.game_id].is_final:
+            totals[p.user_id] = totals.get(p.user_id, 0) + by_game[p.game_id].calculate_points(p.picked_team)
+    check(all(m.user_totals()[uid] == t for uid, t in totals.items()), "Matrix: per-user totals")
+    m2 = WeekPickMatrix.from_bytes(m.to_bytes())
+    check(m2.consensus() == m.consensus() and m2.user_totals() == m.user_totals()
+          and list(m2.user_ids) == list(m.user_ids), "Matrix: bytes round-trip")
+    db.session.expunge_all()
+    tracemalloc.start()
+    orm_picks = Pick.query.filter(Pick.game_id.in_(list(by_game))).all()
+    orm_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del orm_picks
+    check(m.nbytes * 10 < orm_bytes, "Matrix: far smaller than the ORM picks",
+          f"{m.nbytes} vs {orm_bytes} bytes")
+
+    # ================================================================
+    print("\n=== PICK CONSENSUS ===")
+    # ================================================================
+    from app.consensus import consensus_for_games, rebuild_consensus
+    from app.models import GameConsensus
+    w3 = Week.query.filter_by(season_id=sid, week_number=3).one()
+    w3.is_open_for_picks = True
+    cgames = [add_game(w3, f"CH{i}", f"CA{i}", spread=3, fav="home") for i in range(4)]
+    db.session.commit()
+    w3_id, cg = w3.id, [(g.id, g.home_team, g.away_team) for g in cgames]
+    http(lambda: client.post(f'/picks/week/{w3_id}/submit', data={f'pick_{gid}': home for gid, home, _ in cg}))
+    http(lambda: admin_client.post(f'/picks/week/{w3_id}/submit',
+                                   data={f'pick_{gid}': away for gid, _, away in cg[:3]}))
+    http(lambda: client.post(f'/picks/week/{w3_id}/submit',
+                             data={**{f'pick_{gid}': home for gid, home, _ in cg[:3]}, f'pick_{cg[0][0]}': cg[0][2]}))
+    counts = consensus_for_games([gid for gid, _, _ in cg])
+    check(counts == {cg[0][0]: (0, 2), cg[1][0]: (1, 1), cg[2][0]: (1, 1), cg[3][0]: (0, 0)},
+          "Consensus: counters follow submits and resubmits", f"got {counts}")
+    with capture_queries() as stats:
+        consensus_for_games([gid for gid, _, _ in cg])
+    check(stats.count == 1, "Consensus: read is one query")
+    resp = http(lambda: client.get(f'/picks/week/{w3_id}?view_others=1'))
+    check(b'CA0 100%' in resp.data and b'CH1 50%' in resp.data, "Consensus: shown once others are visible")
+    GameConsensus.query.filter_by(game_id=cg[1][0]).update({'home_count': 9})
+    db.session.commit()
+    fixed = rebuild_consensus([w3_id])
+    check(fixed == [(cg[1][0], (9, 1), (1, 1))] and rebuild_consensus([w3_id]) == [],
+          "Consensus: rebuild corrects drift", f"got {fixed}")
+    result = app.test_cli_runner().invoke(args=['rebuild-consensus'])
+    check(result.exit_code == 0 and 'corrected' in result.output, "Consensus: rebuild-consensus command",
+          result.output)
+    check(rebuild_consensus() == [], "Consensus: consistent after the command")
+    from app.consensus import record_pick_changes
+    import logging
+    g3 = db.session.get(Game, cg[3][0])
+    GameConsensus.query.filter_by(game_id=g3.id).delete()
+    db.session.flush()
+    # two first picks on a game in one transaction both upsert the same new row
+    record_pick_changes({g3.id: g3}, added=[(g3.id, g3.home_team)])
+    record_pick_changes({g3.id: g3}, added=[(g3.id, g3.home_team), (g3.id, g3.away_team)])
+    check(consensus_for_games([g3.id]) == {g3.id: (2, 1)}, "Consensus: first picks upsert one row")
+    warnings_seen = []
+    class _Collect(logging.Handler):
+        def emit(self, record):
+            warnings_seen.append(record.getMessage())
+    handler = _Collect(logging.WARNING)
+    app.logger.addHandler(handler)
+    record_pick_changes({g3.id: g3}, removed=[(g3.id, g3.away_team), (g3.id, g3.away_team)])
+    app.logger.removeHandler(handler)
+    check(consensus_for_games([g3.id]) == {g3.id: (2, -1)} and any('went negative' in m for m in warnings_seen),
+          "Consensus: negative drift is kept and logged", str(warnings_seen))
+    db.session.rollback()
+    check(rebuild_consensus([w3_id]) == [], "Consensus: rolled back with the transaction")
+    http(lambda: admin_client.post(f'/admin/games/{cg[0][0]}/delete'))
+    check(db.session.get(GameConsensus, cg[0][0]) is None, "Consensus: deleting a game drops its counter")
+
+    # ================================================================
+    print("\n=== HEAD TO HEAD ===")
+    # ================================================================
+    import random, time
+    from app.head_to_head import HeadToHead
+    Week.query.filter_by(id=w2_id).update({'is_completed': True})
+    db.session.commit()
+    h2h_weeks = [wid, w2_id]
+    h2h = HeadToHead.for_weeks(h2h_weeks)
+    picks_by_user = {}
+    for p in Pick.query.join(Game).filter(Game.week_id.in_(h2h_weeks)).all():
+        g = db.session.get(Game, p.game_id)
+        picks_by_user.setdefault(p.user_id, {})[p.game_id] = (
+            p.picked_team, g.calculate_points(p.picked_team) if g.is_final else None)
+    def naive(a, b):
+        pa, pb = picks_by_user[a], picks_by_user[b]
+        both = [gid for gid in pa if gid in pb]
+        scored = [gid for gid in both if pa[gid][1] is not None and pb[gid][1] is not None]
+        return (len(both), sum(1 for gid in both if pa[gid][0] == pb[gid][0]),
+                sum(pa[gid][1] for gid in scored), sum(pb[gid][1] for gid in scored))
+    mismatched = [(a, b) for (a, b), v in h2h.matrix().items() if v != naive(a, b)]
+    check(len(h2h.masks) == 9 and not mismatched, "Head to head: bitmask pass matches naive comparison",
+          f"mismatched {mismatched[:3]}")
+    with capture_queries() as stats:
+        HeadToHead.for_weeks(h2h_weeks)
+    check(not any('FROM picks' in q for q, _ in stats.queries), "Head to head: week masks served from cache")
+    rng = random.Random(7)
+    big = HeadToHead({uid: [rng.getrandbits(272) for _ in range(9)] for uid in range(500)})
+    start = time.perf_counter()
+    row = big.row(0)
+    elapsed = time.perf_counter() - start
+    check(len(row) == 499 and elapsed < 0.25, "Head to head: one player's row over 500 players is fast",
+          f"{elapsed:.3f}s")
+    resp = http(lambda: client.get(f'/standings/head-to-head/{sid}'))
+    check(resp.status_code == 200 and b'P0' in resp.data and b'Opponent Points' in resp.data,
+          "Head to head: page renders the viewer's row")
+    n_players = len(h2h.masks)
+    page = resp.get_data(as_text=True)
+    check('Every Pair' in page and page.count('picks the same"') == n_players * (n_players - 1),
+          "Head to head: page renders every pair", f"{page.count('picks the same')} cells for {n_players} players")
+
+    # ================================================================
+    print("\n=== PLAYER ATS ANALYTICS ===")
+    # ================================================================
+    from app.analytics import refresh_player_analytics, player_analytics
+    calculate_week_results(db.session.get(Week, w2_id))
+    p1 = User.query.filter_by(username='p1').one()
+    scored = [p for p in Pick.query.filter_by(user_id=p1.id).all() if p.points is not None]
+    stats_all = player_analytics(sid, p1.id)
+    overall = stats_all['all'][0]
+    check((overall.picks, overall.wins, overall.losses, overall.points) ==
+          (len(scored), sum(1 for p in scored if p.points > 0), sum(1 for p in scored if p.points < 0),
+           sum(p.points for p in scored)), "ATS: overall record matches the picks",
+          f"got {(overall.picks, overall.wins, overall.losses, overall.points)}")
+    fav = sum(1 for p in scored if p.picked_team == db.session.get(Game, p.game_id).favored_team)
+    sides = {r.key: r.picks for r in stats_all['side']}
+    check(sides.get('favorite', 0) == fav and sides.get('favorite', 0) + sides.get('underdog', 0) == len(scored),
+          "ATS: favorite/underdog split", f"got {sides}")
+    home = sum(1 for p in scored if p.picked_team == db.session.get(Game, p.game_id).home_team)
+    venues = {r.key: r.picks for r in stats_all['venue']}
+    check(venues.get('home', 0) == home and sum(r.picks for r in stats_all['team']) == len(scored),
+          "ATS: home/away and per-team buckets", f"got {venues}")
+    with capture_queries() as stats:
+        refresh_player_analytics(sid)
+    db.session.commit()
+    selects = [q for q, _ in stats.queries if q.lstrip().upper().startswith('SELECT')]
+    check(len(selects) == 1 and 'GROUP BY' in selects[0], "ATS: season computed in one grouped query",
+          f"{len(selects)} selects")
+    player_url = f'/standings/player/{sid}/{p1.id}'
+    n = count_queries(lambda: client.get(player_url))
+    resp = http(lambda: client.get(player_url))
+    check(resp.status_code == 200 and b'ATS Record' in resp.data and b'By Team' in resp.data and n <= 3,
+          "ATS: profile page served from the summary table", f"{n} queries")
+
+    # ================================================================
+    print("\n=== ALL-TIME LEADERBOARD ===")
+    # ================================================================
+    from app.models import AllTimeStanding
+    old = Season(year=2024, is_active=False, entry_fee=30, total_weeks=2)
+    db.session.add(old)
+    db.session.flush()
+    p0, p1 = User.query.filter_by(username='p0').one(), User.query.filter_by(username='p1').one()
+    for wn in (1, 2):
+        ow = Week(season_id=old.id, week_number=wn, is_completed=True)
+        db.session.add(ow)
+        db.session.flush()
+        for i in range(4):
+            og = add_game(ow, f"OH{wn}{i}", f"OA{wn}{i}", spread=3, fav="home", home_score=24, away_score=14, final=True)
+            add_pick(p0, og, og.home_team)
+            add_pick(p1, og, og.away_team)
+        db.session.commit()
+        calculate_week_results(ow)
+    def expected_totals():
+        rows = (db.session.query(WeeklyResult.user_id, db.func.sum(WeeklyResult.total_points))
+                .join(Week).filter(Week.is_completed.is_(True)).group_by(WeeklyResult.user_id).all())
+        return {uid: pts for uid, pts in rows}
+    standings = {r.user_id: r for r in AllTimeStanding.query.all()}
+    check({uid: r.total_points for uid, r in standings.items()} == expected_totals(),
+          "All-time: totals span every season's completed weeks")
+    check(standings[p0.id].yearly_wins == 1 and standings[p1.id].yearly_wins == 0,
+          "All-time: completed season's winner counted")
+    check(standings[p0.id].seasons_played == 2 and standings[p0.id].weekly_wins >= 2,
+          "All-time: seasons played and weekly wins", f"{standings[p0.id].seasons_played}")
+    before = sorted((r.user_id, r.total_points, r.weekly_wins, r.yearly_wins, r.seasons_played)
+                    for r in AllTimeStanding.query.all())
+    AllTimeStanding.query.delete()
+    db.session.commit()
+    result = app.test_cli_runner().invoke(args=['rebuild-all-time'])
+    after = sorted((r.user_id, r.total_points, r.weekly_wins, r.yearly_wins, r.seasons_played)
+                   for r in AllTimeStanding.query.all())
+    check(result.exit_code == 0 and after == before, "All-time: batch rebuild reproduces the table", result.output)
+    from app.leaderboard import refresh_all_time
+    from app.models import SeasonTotal
+    SeasonTotal.query.filter_by(season_id=old.id).delete()
+    db.session.commit()
+    refresh_all_time(Season.query.filter_by(is_active=True).first().id)
+    db.session.commit()
+    backfilled = sorted((r.user_id, r.total_points, r.weekly_wins, r.yearly_wins, r.seasons_played)
+                        for r in AllTimeStanding.query.all())
+    check(SeasonTotal.query.filter_by(season_id=old.id).count() == 2 and backfilled == before,
+          "All-time: refreshing one season backfills a season missing its totals", f"{backfilled}")
+    n = count_queries(lambda: client.get('/standings/all-time'))
+    resp = http(lambda: client.get('/standings/all-time'))
+    check(resp.status_code == 200 and b'P0' in resp.data and n == 1, "All-time: page is a single query",
+          f"{n} queries")
+
+    # ================================================================
+    print("\n=== RANK HISTORY ===")
+    # ================================================================
+    from app.rank_history import update_rank_history
+    from app.models import RankHistory
+    def ranks_at(season_id, week_number):
+        return [r.user_id for r in RankHistory.query.filter_by(season_id=season_id, week_number=week_number)
+                .order_by(RankHistory.rank)]
+    for season in (db.session.get(Season, sid), old):
+        last = max(w.week_number for w in Week.query.filter_by(season_id=season.id, is_completed=True))
+        check(ranks_at(season.id, last) == [e['user'].id for e in calculate_yearly_standings(season)],
+              f"Rank history: latest week matches yearly standings ({season.year})")
+    incremental = sorted((r.season_id, r.week_number, r.user_id, r.rank, r.total_points)
+                         for r in RankHistory.query.all())
+    with capture_queries() as stats:
+        update_rank_history(sid)
+    db.session.commit()
+    backfilled = sorted((r.season_id, r.week_number, r.user_id, r.rank, r.total_points)
+                        for r in RankHistory.query.all())
+    check(incremental == backfilled, "Rank history: incremental rows equal a full backfill")
+    last_week = max(n for (n,) in db.session.query(Week.week_number).filter_by(season_id=sid, is_completed=True))
+    RankHistory.query.filter_by(season_id=sid).delete()
+    update_rank_history(sid, last_week)
+    db.session.commit()
+    check(sorted((r.season_id, r.week_number, r.user_id, r.rank, r.total_points) for r in RankHistory.query.all())
+          == backfilled, "Rank history: missing earlier weeks roll the season from week 1")
+    check(sum(1 for q, _ in stats.queries if 'FROM weekly_results' in q) == 1,
+          "Rank history: backfill reads weekly results once")
+    result = app.test_cli_runner().invoke(args=['backfill-rank-history'])
+    check(result.exit_code == 0 and 'season(s)' in result.output, "Rank history: backfill command", result.output)
+    data = http(lambda: client.get(f'/standings/rank-history/{sid}.json')).get_json()
+    check(data['weeks'] == [1, 2] and len(data['players'][0]) == 3 and data['players'][0][2][-1] == 1,
+          "Rank history: chart JSON", f"got {data}")
+    resp = http(lambda: client.get(f'/standings/rank-history/{sid}'))
+    check(resp.status_code == 200 and b'rank-chart' in resp.data, "Rank history: chart page renders")
+    leader = ranks_at(sid, last_week)[0]
+    http(lambda: admin_client.post(f'/admin/users/{leader}/toggle'))
+    dropped = ranks_at(sid, last_week)
+    http(lambda: admin_client.post(f'/admin/users/{leader}/toggle'))
+    others = [e['user'].id for e in calculate_yearly_standings(db.session.get(Season, sid)) if e['user'].id != leader]
+    check(dropped == others and ranks_at(sid, last_week)[0] == leader,
+          "Rank history: deactivating a player reranks the active season", f"{dropped}")
+
+    # ================================================================
+    print("\n=== PRIZE RACE ===")
+    # ================================================================
+    from app.race import Contender, yearly_statuses, weekly_statuses, season_race, CLINCHED, ALIVE, ELIMINATED
+    field = [Contender(1, 'a', 100), Contender(2, 'b', 40), Contender(3, 'c', 10), Contender(4, 'd', 95, can_qualify=False)]
+    st = yearly_statuses(field, 1)
+    check(st == {1: CLINCHED, 2: ELIMINATED, 3: ELIMINATED, 4: ELIMINATED},
+          "Race: yearly clinch and elimination from bounds", f"got {st}")
+    st = yearly_statuses(field, 2)
+    check(st[1] == ALIVE and st[2] == ALIVE and st[3] == ELIMINATED, "Race: more open games keep rivals alive", f"got {st}")
+    # same side of a live game cannot separate two players
+    same = [Contender(1, 'a', 50, locked={9: 'KC'}), Contender(2, 'b', 30, locked={9: 'KC'})]
+    split = [Contender(1, 'a', 50, locked={9: 'KC'}), Contender(2, 'b', 30, locked={9: 'BUF'})]
+    check(yearly_statuses(same, 0) == {1: CLINCHED, 2: ELIMINATED}, "Race: shared live pick tightens bounds")
+    check(yearly_statuses(split, 0) == {1: ALIVE, 2: ALIVE}, "Race: opposite live picks can still swing")
+    check(yearly_statuses([Contender(1, 'a', 20), Contender(2, 'b', 20)], 0) == {1: ALIVE, 2: ALIVE},
+          "Race: exact ties stay alive")
+    st = yearly_statuses([Contender(1, 'a', 100, is_qualified=False), Contender(2, 'b', 10)], 1)
+    check(st[2] == ALIVE, "Race: a rival who may still miss qualifying eliminates nobody", f"got {st}")
+    check(st[1] == ALIVE, "Race: no clinch until the leader is sure to qualify", f"got {st}")
+    ws = weekly_statuses([Contender(1, 'a', 0, weekly_wins=5, wpww=40), Contender(2, 'b', 0, weekly_wins=2, wpww=30),
+                          Contender(3, 'c', 0, weekly_wins=4, wpww=35)], 2, 32)
+    check(ws == {1: ALIVE, 2: ELIMINATED, 3: ALIVE}, "Race: weekly statuses", f"got {ws}")
+    ws = weekly_statuses([Contender(1, 'a', 0, weekly_wins=5, wpww=40), Contender(2, 'b', 0, weekly_wins=3)], 1, 16)
+    check(ws == {1: CLINCHED, 2: ELIMINATED}, "Race: weekly clinch", f"got {ws}")
+    check(weekly_statuses([Contender(1, 'a', 10, weekly_wins=1)], 3, 40) == {1: ALIVE},
+          "Race: lone contender stays alive while weeks remain")
+    check(weekly_statuses([Contender(1, 'a', 10, weekly_wins=1)], 0, 0) == {1: CLINCHED},
+          "Race: lone contender clinches once no weeks remain")
+    check(weekly_statuses([Contender(1, 'a', 10, weekly_wins=4, wpww=30)], 3, 40) == {1: CLINCHED},
+          "Race: lone contender clinches when a newcomer can't catch up")
+    import random
+    rng = random.Random(7)
+    big = [Contender(i, str(i), rng.randint(-200, 400), weekly_wins=rng.randint(0, 5), wpww=rng.randint(0, 60))
+           for i in range(500)]
+    t0 = time.perf_counter()
+    st = yearly_statuses(big, 16)
+    weekly_statuses(big, 1, 16)
+    elapsed = time.perf_counter() - t0
+    leader = max(big, key=lambda c: c.points)
+    check(elapsed < 0.5 and st[leader.user_id] != ELIMINATED, "Race: 500 players decided quickly",
+          f"{elapsed*1000:.0f}ms")
+    brute = {a.user_id: ELIMINATED if any(b.points - a.points > 30 * 16 for b in big if b.can_qualify) else
+             CLINCHED if all(a.points - b.points > 30 * 16 for b in big if b is not a) else ALIVE for a in big}
+    check(st == brute, "Race: pruned yearly statuses match pairwise check")
+
+    season = db.session.get(Season, sid)
+    rows = season_race(season)
+    order = [e['user'].id for e in calculate_yearly_standings(season)]
+    unranked = {u.id for u in User.query.filter_by(is_active_player=True)} - set(order)
+    check([r['user_id'] for r in rows][:len(order)] == order and {r['user_id'] for r in rows[len(order):]} == unranked
+          and {r['yearly'] for r in rows} <= {CLINCHED, ALIVE, ELIMINATED},
+          "Race: one row per yearly-standings player, then active players without results")
+    from app.race import load_contenders
+    late = User(username='latecomer', email='late@test.com', display_name='Late', is_active_player=True)
+    late.set_password('secret')
+    db.session.add(late)
+    db.session.commit()
+    contenders = {c.user_id: c for c in load_contenders(season)[0]}
+    check(late.id in contenders and contenders[late.id].fixed == 0 and contenders[late.id].points == 0,
+          "Race: an active player with no results yet is a contender from zero")
+    check(not any(c.is_qualified for c in contenders.values()),
+          "Race: nobody is sure to qualify before the last two weeks", str([c.user_id for c in contenders.values()
+                                                                           if c.is_qualified]))
+    late.is_active_player = False
+    db.session.commit()
+    check(all(r['yearly'] != CLINCHED for r in rows), "Race: nobody clinches with weeks left")
+    with capture_queries() as stats:
+        season_race(season)
+    check(not any('FROM weekly_results' in q or 'FROM picks' in q for q, _ in stats.queries),
+          "Race: second call served from cache", f"{stats.count} queries")
+    old_rows = season_race(old)
+    winners = {w['user'].id for w in get_yearly_winners(old)}
+    check({r['user_id'] for r in old_rows if r['yearly'] == CLINCHED} == winners, "Race: finished season uses winners")
+    resp = http(lambda: client.get(f'/standings/race/{sid}'))
+    check(resp.status_code == 200 and b'Prize Race' in resp.data, "Race: page renders")
+
+    # ================================================================
+    print("\n=== LIVE WIN ODDS ===")
+    # ================================================================
+    from app.live_odds import week_outlook, week_win_odds, margin_distribution
+    from app.picks_grid import invalidate_picks_grid
+    from app.models import spread_points
+    def game(gid, spread=3, fav='home', score=None, final=False):
+        g = Game(id=gid, home_team=f'H{gid}', away_team=f'A{gid}', spread=spread, favorite=fav, is_final=final)
+        if score:
+            g.home_score, g.away_score = score
+        return g
+    finals = [game(i, score=(20, 10), final=True) for i in range(5)]
+    odds = week_outlook(finals, [(1, i, f'H{i}') for i in range(5)] + [(2, i, f'A{i}') for i in range(5)]
+                        + [(3, i, f'H{i}') for i in range(3)])
+    check(odds == {1: 1.0, 2: 0.0, 3: 0.0}, "Win odds: finished week is certain, short entries ineligible", f"got {odds}")
+    # 7 points each: 7 x +1 (seven wins) against +15,+15,-15,-15,+7 spread over five picks
+    even = [game(i, spread=3, fav='home', score=(s, 0), final=True) for i, s in enumerate([4, 4, 4, 4, 4, 4, 4])]
+    even += [game(7 + i, spread=3, fav='home', score=(s, 0), final=True) for i, s in enumerate([30, 30, -30, -30, 8])]
+    a = [(1, i, f'H{i}') for i in range(7)]
+    b = [(2, 7 + i, f'H{7 + i}') for i in range(5)]
+    odds = week_outlook(even, a + b)
+    check(odds[1] == 1.0, "Win odds: points tie goes to more winning picks", f"got {odds}")
+    odds = week_outlook(finals, [(1, i, f'H{i}') for i in range(5)] + [(2, i, f'H{i}') for i in range(5)])
+    check(odds == {1: 0.5, 2: 0.5}, "Win odds: exact tie splits", f"got {odds}")
+
+    import math
+    from itertools import product as cartesian
+    def brute_force(games, picks):
+        """Winning chances by walking every joint final margin of the unfinished games."""
+        by_id = {g.id: g for g in games}
+        open_games = [g for g in games if not g.is_final]
+        users = sorted({u for u, _, _ in picks})
+        chances = dict.fromkeys(users, 0.0)
+        for combo in cartesian(*(margin_distribution(g) for g in open_games)):
+            margin = {g.id: m for g, (m, _) in zip(open_games, combo)}
+            totals = {u: [0, 0] for u in users}
+            for u, gid, team in picks:
+                g = by_id[gid]
+                pts = g.calculate_points(team) if g.is_final else spread_points(
+                    margin[gid], 0, g.spread, g.favorite, team == g.favored_team)
+                totals[u][0] += pts
+                totals[u][1] += pts > 0
+            top = max(totals.values())
+            winners = [u for u in users if totals[u] == top]
+            weight = math.prod(q for _, q in combo)
+            for u in winners:
+                chances[u] += weight / len(winners)
+        return chances
+    live = [game(0, spread=3.5, score=(14, 10)), game(1, spread=6, fav='away', score=(7, 3))]
+    live += [game(2 + i, score=(21, 20), final=True) for i in range(3)]
+    picks = ([(1, 0, 'H0'), (1, 1, 'H1')] + [(1, 2 + i, 'H%d' % (2 + i)) for i in range(3)] +
+             [(2, 0, 'A0'), (2, 1, 'H1')] + [(2, 2 + i, 'A%d' % (2 + i)) for i in range(3)] +
+             [(3, 0, 'A0'), (3, 1, 'A1'), (3, 2, 'A2'), (3, 3, 'H3')])
+    expect = brute_force(live, picks)
+    odds = week_outlook(live, picks)
+    check(all(abs(odds[u] - expect[u]) < 1e-9 for u in expect) and abs(sum(odds.values()) - 1) < 1e-9,
+          "Win odds: joint outcomes match brute force over shared games", f"{odds} vs {expect}")
+    # A leads by 10 and the only open game is A on home, B on away: B wins iff A's result there is below -5,
+    # and at exactly -5 both have one winning pick and split the week
+    lead = [game(0, spread=1, score=(0, 0)), game(1, spread=0, score=(5, 0), final=True)]
+    lead += [game(2 + i, spread=0, score=(0, 0), final=True) for i in range(3)]
+    lead_picks = [(1, i, f'H{i}') for i in range(5)] + [(2, i, f'A{i}') for i in range(5)]
+    odds = week_outlook(lead, lead_picks)
+    b_wins = sum(q if spread_points(m, 0, 1, 'home', True) < -5 else q / 2 for m, q in margin_distribution(lead[0])
+                 if spread_points(m, 0, 1, 'home', True) <= -5)
+    check(abs(odds[2] - b_wins) < 1e-9 and abs(odds[1] + odds[2] - 1) < 1e-9,
+          "Win odds: a shared game moves both players at once", f"{odds} vs {b_wins}")
+    # twelve open games, split on every other one: B wins iff the summed difference over the split games
+    # overturns A's lead from the finished ones
+    split = [game(i, spread=1 + i % 4 * 2.5, fav=('home', 'away')[i % 2], score=(i, 7) if i < 4 else None)
+             for i in range(12)] + [game(12 + i, score=(17, 14), final=True) for i in range(4)]
+    split_picks = [(1, g.id, g.home_team) for g in split] + [(2, g.id, g.away_team if g.id % 2 else g.home_team)
+                                                              for g in split]
+    diff = {(0, 0): 1.0}
+    for g in split[1:12:2]:
+        step = {}
+        for m, q in margin_distribution(g):
+            pts = spread_points(m, 0, g.spread, g.favorite, g.favorite == 'home')
+            for (d, w), r in diff.items():
+                key = (d + 2 * pts, w + (pts > 0) - (pts < 0))
+                step[key] = step.get(key, 0.0) + q * r
+        diff = step
+    a_wins = sum(r if (d, w) > (0, 0) else r / 2 if (d, w) == (0, 0) else 0 for (d, w), r in diff.items())
+    odds = week_outlook(split, split_picks)
+    check(odds and abs(odds[1] - a_wins) < 1e-9 and abs(odds[1] + odds[2] - 1) < 1e-9,
+          "Win odds: twelve open games split on six are exact", f"{odds} vs {a_wins}")
+    # ten open games, but the field only disagrees on two of them: the rest move every total alike
+    wide = [game(i, spread=3.5 + i, score=(10 + i, 7) if i < 3 else None) for i in range(10)]
+    wide += [game(10 + i, score=(24, 20 + 3 * i), final=True) for i in range(4)]
+    choose = {1: 'HAHA', 2: 'AHAH', 3: 'HHAA', 4: 'AAHH', 5: 'HAAH'}
+    wide_picks = [(u, g.id, (g.home_team if c[g.id - 10] == 'H' else g.away_team) if g.is_final else
+                   (g.home_team if g.id in (1, 5) or (g.id == 0 and u % 2) or (g.id == 2 and u > 2) else g.away_team))
+                  for u, c in choose.items() for g in wide]
+    contested = {0, 2}
+    expect = brute_force([g for g in wide if g.is_final or g.id in contested],
+                         [p for p in wide_picks if wide[p[1]].is_final or p[1] in contested])
+    odds = week_outlook(wide, wide_picks)
+    check(all(abs(odds[u] - expect[u]) < 1e-9 for u in expect) and abs(sum(odds.values()) - 1) < 1e-9,
+          "Win odds: ten open games match brute force over the two the field splits on", f"{odds} vs {expect}")
+    pregame = [game(i, spread=3 + i) for i in range(6)]
+    odds = week_outlook(pregame, [(u, i, f'H{i}' if (u + i) % 2 else f'A{i}') for u in range(1, 5) for i in range(6)])
+    check(all(abs(p - 0.25) < 1e-9 for p in odds.values()), "Win odds: before kickoff either side is even")
+
+    rng = random.Random(11)
+    field = [game(i, spread=rng.choice([1.5, 3, 6.5, 7, 10]), fav=rng.choice(['home', 'away'])) for i in range(16)]
+    for g in field[:6]:
+        g.home_score, g.away_score, g.is_final = rng.randint(0, 35), rng.randint(0, 35), True
+    for g in field[6:9]:
+        g.home_score, g.away_score = rng.randint(0, 21), rng.randint(0, 21)
+    many = [(u, g.id, rng.choice([g.home_team, g.away_team])) for u in range(100) for g in field]
+    t0 = time.perf_counter()
+    odds = week_outlook(field, many)
+    elapsed = time.perf_counter() - t0
+    # generous bound: a guard against walking the whole week before giving up, not a timing target
+    check(odds == {} and elapsed < 10.0, "Win odds: a week too open to call exactly shows no odds",
+          f"{len(odds)} odds in {elapsed*1000:.0f}ms")
+
+    w3 = db.session.get(Week, w3_id)
+    boss_id = User.query.filter_by(username='boss').one().id
+    for i in range(2):
+        extra = add_game(w3, f"LH{i}", f"LA{i}", spread=3, fav="home")
+        db.session.add(Pick(user_id=viewer_id, game_id=extra.id, picked_team=f"LH{i}"))
+        db.session.add(Pick(user_id=boss_id, game_id=extra.id, picked_team=f"LA{i}"))
+    g1 = db.session.get(Game, cg[1][0])
+    g1.home_score, g1.away_score = 21, 0
+    db.session.commit()
+    invalidate_picks_grid(w3_id)
+    data = http(lambda: client.get(f'/picks/week/{w3_id}/win-odds.json')).get_json()
+    check(set(data) == {str(viewer_id), str(boss_id)} and data[str(viewer_id)] > 0.5
+          and abs(sum(data.values()) - 1) < 1e-9, "Win odds: JSON for the open week", f"got {data}")
+    with capture_queries() as stats:
+        week_win_odds(w3_id)
+    check(not any('FROM picks' in q for q, _ in stats.queries), "Win odds: cached until picks or scores change")
+    resp = http(lambda: client.get(f'/picks/week/{w3_id}'))
+    check(b'Chance to win the week' in resp.data, "Win odds: shown with others' picks")
+    check(http(lambda: admin_client.get(f'/picks/week/{w3_id}/win-odds.json')).status_code == 403,
+          "Win odds: hidden until others' picks are viewed")
+
+    # ================================================================
+    print("\n=== HALF-POINT SCORING ===")
+    # ================================================================
+    from app.models import spread_points_x2, to_halves
+    from app.leaderboard import all_time_leaderboard
+    from app.migrations import upgrade_schema, rebuild_read_models
+    from sqlalchemy import create_engine, inspect as sa_inspect, text as sa_text
+    check([spread_points_x2(24, 17, 7, 'home', True), spread_points_x2(24, 17, 13, 'home', False),
+           spread_points_x2(40, 0, 7, 'home', True), spread_points_x2(17, 24, 3, 'home', True)] == [7, -1, 30, -17],
+          "Half points: kernel works in integer half points")
+    g = Game(home_team='H', away_team='A', spread=6.5, favorite='home', home_score=20, away_score=13)
+    check(g.spread_x2 == 13 and g.spread == 6.5 and g.calculate_points_x2('H') == 1 and g.calculate_points('A') == -0.5,
+          "Half points: spread and points read back in points")
+    r = WeeklyResult.query.filter(WeeklyResult.total_points_x2 % 2 == 0).first()
+    check(isinstance(r.total_points_x2, int) and r.total_points == r.total_points_x2 / 2 and to_halves(r.total_points)
+          == r.total_points_x2, "Half points: weekly totals stored as integers")
+    check(WeeklyResult.query.filter(WeeklyResult.total_points > 1000).count() == 0,
+          "Half points: float names still usable in queries")
+    before = [(a.user_id, a.total_points) for a in all_time_leaderboard()]
+    rebuild_read_models()
+    check([(a.user_id, a.total_points) for a in all_time_leaderboard()] == before, "Half points: read-model rebuild is stable")
+
+    legacy_path = os.path.join(_cache_dir.name, 'legacy.db')
+    legacy = create_engine(f'sqlite:///{legacy_path}')
+    with legacy.begin() as conn:
+        conn.execute(sa_text('CREATE TABLE games (id INTEGER PRIMARY KEY, spread FLOAT)'))
+        conn.execute(sa_text('CREATE TABLE picks (id INTEGER PRIMARY KEY, points FLOAT)'))
+        conn.execute(sa_text('CREATE TABLE weekly_results (id INTEGER PRIMARY KEY, total_points FLOAT DEFAULT 0)'))
+        conn.execute(sa_text('CREATE TABLE all_time_standings (user_id INTEGER PRIMARY KEY, total_points FLOAT)'))
+        conn.execute(sa_text('CREATE INDEX ix_all_time_standings_total_points ON all_time_standings (total_points)'))
+        conn.execute(sa_text("INSERT INTO games VALUES (1, 3.5), (2, NULL), (3, -7)"))
+        conn.execute(sa_text("INSERT INTO picks VALUES (1, -15), (2, 0.5), (3, NULL)"))
+        conn.execute(sa_text("INSERT INTO weekly_results VALUES (1, 21.5)"))
+    rebuild = upgrade_schema(legacy)
+    with legacy.connect() as conn:
+        games = conn.execute(sa_text('SELECT * FROM games ORDER BY id')).all()
+        picks = conn.execute(sa_text('SELECT * FROM picks ORDER BY id')).all()
+        weekly = conn.execute(sa_text('SELECT * FROM weekly_results')).all()
+    check(games == [(1, 7), (2, None), (3, -14)] and picks == [(1, -30), (2, 1), (3, None)] and weekly == [(1, 43)],
+          "Half points: migration converts existing rows", f"{games} {picks} {weekly}")
+    check(rebuild and 'all_time_standings' not in sa_inspect(legacy).get_table_names(),
+          "Half points: migration drops read models for rebuilding")
+    check(upgrade_schema(legacy) is True and 'spread_x2' in {c['name'] for c in sa_inspect(legacy).get_columns('games')},
+          "Half points: a rebuild interrupted before it finished is still pending at the next boot")
+    db.metadata.create_all(legacy)  # as create_all does at boot, before the rebuild clears the marker
+    with legacy.begin() as conn:
+        conn.execute(sa_text("DELETE FROM schema_state WHERE name = 'rebuild_read_models'"))
+    check(upgrade_schema(legacy) is False, "Half points: migration is idempotent")
+    legacy.dispose()
+    for seeded in (True, False):
+        baseline = create_engine(f'sqlite:///{os.path.join(_cache_dir.name, f"baseline-{seeded}.db")}')
+        with baseline.begin() as conn:
+            conn.execute(sa_text('CREATE TABLE weekly_results (id INTEGER PRIMARY KEY, total_points_x2 INTEGER)'))
+            conn.execute(sa_text('CREATE TABLE picks (id INTEGER PRIMARY KEY, points_x2 INTEGER)'))
+            if seeded:
+                conn.execute(sa_text('INSERT INTO weekly_results VALUES (1, 14)'))
+        check(upgrade_schema(baseline) is seeded,
+              f"Migration: read models missing from a database {'with' if seeded else 'without'} results "
+              f"{'are' if seeded else 'are not'} rebuilt")
+        baseline.dispose()
+    with db.engine.begin() as conn:
+        conn.execute(sa_text("INSERT INTO schema_state (name, value) VALUES ('rebuild_read_models', '1')"))
+    check(upgrade_schema(db.engine) is True, "Half points: pending rebuild marker is reported")
+    rebuild_read_models()
+    check(upgrade_schema(db.engine) is False, "Half points: the rebuild clears the marker in its commit")
+
+    # ================================================================
+    print("\n=== WHAT-IF ENGINE ===")
+    # ================================================================
+    from app.engine import SeasonSnapshot, WeekRec, GameRec, PickRec, UserRec
+    for w in Week.query.filter_by(season_id=sid, is_completed=True).all():
+        calculate_week_results(w)  # earlier sections edit games without recalculating
+    for season in (db.session.get(Season, sid), old):
+        season.total_weeks  # refresh the expired row now so the count below sees only the snapshot query
+        with capture_queries() as stats:
+            snap = SeasonSnapshot.load(db.session, season)
+        check(stats.count == 1, f"Engine: season loads in one query ({season.year})", f"{stats.count} queries")
+        mine = [(r['user'].id, r['total_points'], r['weekly_wins'], r['is_qualified']) for r in snap.yearly_standings()]
+        stored = [(r['user'].id, r['total_points'], r['weekly_wins'], r['is_qualified'])
+                  for r in calculate_yearly_standings(season)]
+        check(mine == stored, f"Engine: snapshot standings match stored results ({season.year})", f"{mine} vs {stored}")
+        check([w['user'].id for w in snap.weekly_prize()['winners']] ==
+              [w['user'].id for w in calculate_weekly_prize_winner(season)['winners']],
+              f"Engine: snapshot weekly prize matches ({season.year})")
+    snap = SeasonSnapshot.load(db.session, old)
+    leader = snap.yearly_winners()[0]['user'].id
+    last = snap.completed_weeks()[-1].id
+    flipped = snap
+    for p in [p for p in snap.picks[last] if p.user_id == leader]:
+        g = next(g for g in snap.games[last] if g.id == p.game_id)
+        margin = 40 if p.picked_team == g.away_team else -40
+        flipped = flipped.with_score(g.id, max(margin, 0), max(-margin, 0))
+    check(leader not in [w['user'].id for w in flipped.yearly_winners()], "Engine: what-if scores can flip the winner")
+    check(snap.yearly_winners()[0]['user'].id == leader, "Engine: what-ifs leave the original snapshot alone")
+    pick = snap.picks[last][0]
+    g = next(g for g in snap.games[last] if g.id == pick.game_id)
+    other = g.away_team if pick.picked_team == g.home_team else g.home_team
+    swapped = snap.with_pick(pick.user_id, pick.game_id, other)
+    before = next(r for r in snap.results(last) if r.user_id == pick.user_id).total_points_x2
+    after = next(r for r in swapped.results(last) if r.user_id == pick.user_id).total_points_x2
+    check(after == before - 2 * pick.points_x2, "Engine: what-if pick on the other side", f"{before} -> {after}")
+    check(len(SeasonSnapshot.load(db.session, old).with_completed(last, False).completed_weeks()) ==
+          len(snap.completed_weeks()) - 1, "Engine: what-if week not completed")
+
+    rng = random.Random(5)
+    weeks = [WeekRec(w, w, True) for w in range(1, 19)]
+    games = {w.id: [GameRec(w.id * 100 + i, w.id, f'H{i}', f'A{i}', rng.choice([3, 7, 13]), 'home',
+                            rng.randint(0, 35), rng.randint(0, 35), True) for i in range(16)] for w in weeks}
+    picks = {w.id: [PickRec(u, g.id, rng.choice([g.home_team, g.away_team])) for u in range(1, 21) for g in games[w.id]]
+             for w in weeks}
+    big = SeasonSnapshot(18, weeks, games, picks, {u: UserRec(u, f'u{u}', f'U{u}') for u in range(1, 21)})
+    big.yearly_winners()
+    import app.engine as engine_module
+    real_score_week, scored_weeks = engine_module.score_week, []
+    def counting_score_week(week_id, *args, **kwargs):
+        scored_weeks.append(week_id)
+        return real_score_week(week_id, *args, **kwargs)
+    engine_module.score_week = counting_score_week
+    try:
+        for i in range(1000):
+            big.with_score(1800 + i % 16, i % 40, 20).yearly_winners()
+    finally:
+        engine_module.score_week = real_score_week
+    check(scored_weeks == [18] * 1000, "Engine: each what-if rescores only the week it changes",
+          f"{len(scored_weeks)} weeks scored")
+
+    # ================================================================
+    print("\n=== SEASON RECOMPUTE ===")
+    # ================================================================
+    from app.recompute import recompute_season
+    from sqlalchemy import insert
+    def result_rows(season_id):
+        return sorted((r.user_id, r.week_id, r.total_points_x2, r.num_picks, r.winning_picks, r.weekly_win_share,
+                       r.is_eligible) for r in WeeklyResult.query.join(Week).filter(Week.season_id == season_id))
+    season = db.session.get(Season, sid)
+    for w in Week.query.filter_by(season_id=sid).all():
+        calculate_week_results(w)
+    expected = result_rows(sid)
+    expected_points = sorted((p.id, p.points_x2) for p in Pick.query.join(Game).join(Week).filter(Week.season_id == sid))
+    week_ids = [w.id for w in Week.query.filter_by(season_id=sid)]
+    final_games = db.session.query(Game.id).filter(Game.week_id.in_(week_ids), Game.is_final.is_(True))
+    Pick.query.filter(Pick.game_id.in_(final_games)).update(
+        {Pick.points_x2: 0}, synchronize_session=False)
+    WeeklyResult.query.filter(WeeklyResult.week_id.in_(week_ids)).update(
+        {WeeklyResult.total_points_x2: 0, WeeklyResult.weekly_win_share: 0}, synchronize_session=False)
+    db.session.commit()
+    seen = []
+    summary = recompute_season(db.session.get(Season, sid), progress=lambda done, total, wn: seen.append((done, total)))
+    check(result_rows(sid) == expected, "Recompute: weekly results match week-by-week calculation")
+    check(sorted((p.id, p.points_x2) for p in Pick.query.join(Game).join(Week).filter(Week.season_id == sid))
+          == expected_points, "Recompute: pick points rescored")
+    check(seen == [(i, summary['weeks']) for i in range(1, summary['weeks'] + 1)] and summary['weeks'] > 0,
+          "Recompute: progress reported once per week", str(seen))
+    check(summary['results'] == len(expected), "Recompute: summary counts results", str(summary))
+    from sqlalchemy import event
+    from sqlalchemy.orm import Session as OrmSession
+    commits = []
+    count_commit = lambda session: commits.append(session)
+    event.listen(OrmSession, 'after_commit', count_commit)
+    try:
+        calculate_week_results(Week.query.filter_by(season_id=sid, week_number=1).one())
+        results_commits = len(commits)
+        recompute_season(db.session.get(Season, sid))
+    finally:
+        event.remove(OrmSession, 'after_commit', count_commit)
+    check((results_commits, len(commits)) == (1, 2), "Recompute: results and read models commit together",
+          f"{results_commits} then {len(commits) - results_commits} commits")
+    WeeklyResult.query.filter(WeeklyResult.week_id.in_(week_ids)).delete(synchronize_session=False)
+    db.session.commit()
+    recompute_season(db.session.get(Season, sid), workers=2)
+    check(result_rows(sid) == expected, "Recompute: worker pool gives the same results")
+    result = app.test_cli_runner().invoke(args=['recompute-season', str(season.year)])
+    check(result.exit_code == 0 and 'week(s)' in result.output and result_rows(sid) == expected,
+          "Recompute: CLI command", result.output)
+    check(app.test_cli_runner().invoke(args=['recompute-season', '1999']).exit_code != 0,
+          "Recompute: CLI rejects unknown season")
+
+    rng = random.Random(46)
+    big = Season(year=2030, is_active=False, entry_fee=30, total_weeks=18)
+    db.session.add(big)
+    db.session.flush()
+    first_uid = db.session.query(db.func.max(User.id)).scalar() + 1
+    db.session.execute(insert(User), [{'username': f'rc{i}', 'email': f'rc{i}@test.com', 'display_name': f'Rc{i}',
+                                       'password_hash': 'x', 'is_active_player': True} for i in range(200)])
+    big_weeks = [Week(season_id=big.id, week_number=n, is_completed=True) for n in range(1, 19)]
+    db.session.add_all(big_weeks)
+    db.session.flush()
+    db.session.execute(insert(Game), [{'week_id': w.id, 'home_team': f'H{i}', 'away_team': f'A{i}',
+                                       'spread_x2': rng.choice([3, 6, 7, 14, 27]), 'favorite': 'home',
+                                       'home_score': rng.randint(0, 40), 'away_score': rng.randint(0, 40),
+                                       'is_final': True} for w in big_weeks for i in range(16)])
+    big_games = db.session.query(Game.id, Game.home_team, Game.away_team).join(Week).filter(Week.season_id == big.id).all()
+    db.session.execute(insert(Pick), [{'user_id': u, 'game_id': gid, 'picked_team': rng.choice([home, away])}
+                                      for gid, home, away in big_games for u in range(first_uid, first_uid + 200)])
+    db.session.commit()
+    with capture_queries() as stats:
+        summary = recompute_season(big)
+    check(summary == {'weeks': 18, 'picks': 18 * 16 * 200, 'results': 18 * 200},
+          "Recompute: full season of 200 players rebuilt", str(summary))
+    check(stats.count <= 30, "Recompute: 18 weeks x 200 players in a fixed number of statements",
+          f"{stats.count} statements")
+    wk = big_weeks[-1]
+    fresh = sorted((r.user_id, r.total_points_x2, r.winning_picks, r.weekly_win_share)
+                   for r in WeeklyResult.query.filter_by(week_id=wk.id))
+    calculate_week_results(db.session.get(Week, wk.id))
+    check(fresh == sorted((r.user_id, r.total_points_x2, r.winning_picks, r.weekly_win_share)
+                          for r in WeeklyResult.query.filter_by(week_id=wk.id)),
+          "Recompute: large season matches week-by-week calculation")
+    User.query.filter(User.id >= first_uid).update({User.is_active_player: False}, synchronize_session=False)
+    db.session.commit()
+
+    # ================================================================
+    print("\n=== BACKGROUND JOBS ===")
+    # ================================================================
+    import threading
+    from app.jobs import job_runner, job, job_key
+    from app.models import Job
+    from sqlalchemy.exc import IntegrityError
+    w1_id = Week.query.filter_by(season_id=sid, week_number=1).one().id
+    WeeklyResult.query.filter_by(week_id=w1_id).delete()
+    db.session.commit()
+    resp = http(lambda: admin_client.post(f'/admin/weeks/{w1_id}/calculate'))
+    done_job = Job.query.order_by(Job.id.desc()).first()
+    check(resp.status_code == 302 and resp.headers['Location'].endswith(f'/admin/jobs/{done_job.id}'),
+          "Jobs: admin action redirects to the job page", resp.headers.get('Location', ''))
+    check(done_job.status == 'done' and done_job.message.startswith('Results calculated')
+          and WeeklyResult.query.filter_by(week_id=w1_id).count() > 0, "Jobs: inline job runs and records its result",
+          f"{done_job.status} {done_job.error}")
+    check(done_job.duration is not None and done_job.duration >= 0, "Jobs: duration recorded")
+    data = http(lambda: admin_client.get(f'/admin/jobs/{done_job.id}.json')).get_json()
+    check(data['status'] == 'done' and data['finished'] and data['message'] == done_job.message,
+          "Jobs: status JSON for polling", str(data))
+    check(b'Results calculated' in http(lambda: admin_client.get('/admin/jobs')).data, "Jobs: list page")
+    check(http(lambda: admin_client.get(f'/admin/jobs/{done_job.id}')).status_code == 200, "Jobs: status page")
+    check(http(lambda: client.get(f'/admin/jobs/{done_job.id}.json')).status_code == 302, "Jobs: status is admin-only")
+    bad, created = job_runner.submit('calculate_results', week_id=999999)
+    check(created and bad.status == 'failed' and 'LookupError' in bad.error, "Jobs: failure records the error",
+          str(bad.error))
+
+    running = Job(kind='calculate_results', key=job_key('calculate_results', {'week_id': w1_id}),
+                  status='running', worker_pid=os.getpid())
+    db.session.add(running)
+    db.session.commit()
+    running_id, running_key = running.id, running.key
+    resp = http(lambda: admin_client.post(f'/admin/weeks/{w1_id}/calculate'))
+    check(resp.headers['Location'].endswith(f'/admin/jobs/{running_id}')
+          and Job.query.filter(Job.key == running_key, Job.status != 'done').count() == 1, "Jobs: a second click joins the job in flight")
+    db.session.add(Job(kind='calculate_results', key=running_key, status='queued'))
+    try:
+        db.session.commit()
+        check(False, "Jobs: unique index allows one active job per key")
+    except IntegrityError:
+        db.session.rollback()
+        check(True, "Jobs: unique index allows one active job per key")
+    check(job_runner.recover() == 1 and db.session.get(Job, running_id).status == 'failed',
+          "Jobs: startup recovery fails jobs left running")
+    again, created = job_runner.submit('calculate_results', week_id=w1_id)
+    check(created and again.status == 'done', "Jobs: a finished job frees its key")
+
+    gate = threading.Event()
+    @job('test_wait')
+    def _test_wait(progress, n):
+        progress(1, 2, 'waiting')
+        gate.wait(10)
+        return f'waited {n}'
+    job_runner.configure(app, 2)
+    try:
+        queued, _ = job_runner.submit('test_wait', n=1)
+        queued_id = queued.id
+        # the job blocks on the gate, so a submit that waited for it could not have returned yet
+        db.session.expire_all()
+        check(db.session.get(Job, queued_id).status in ('queued', 'running') and not gate.is_set(),
+              "Jobs: submit returns while the job runs")
+        dup, created = job_runner.submit('test_wait', n=1)
+        check(not created and dup.id == queued_id, "Jobs: duplicate submit while running is refused")
+        gate.set()
+        job_runner.wait(10)
+        db.session.expire_all()
+        finished = db.session.get(Job, queued_id)
+        check(finished.status == 'done' and finished.message == 'waited 1' and finished.progress_total == 2,
+              "Jobs: pooled job finishes with progress", f"{finished.status} {finished.message}")
+        rc, _ = job_runner.submit('recompute_season', season_id=sid)
+        rc_id = rc.id
+        job_runner.wait(60)
+        db.session.expire_all()
+        rc = db.session.get(Job, rc_id)
+        check(rc.status == 'done' and rc.progress_total and rc.progress_done == rc.progress_total,
+              "Jobs: season recompute reports per-week progress", f"{rc.status} {rc.progress_done}/{rc.progress_total}")
+    finally:
+        job_runner.configure(app, 0)
+
+    # ================================================================
+    print("\n=== BULK ENROLLMENT ===")
+    # ================================================================
+    from app.entries import enroll_active_players, mark_paid
+    enroll_season = Season(year=2031, is_active=False, entry_fee=25, total_weeks=18)
+    db.session.add(enroll_season)
+    db.session.commit()
+    es_id = enroll_season.id
+    first_bulk = db.session.query(db.func.max(User.id)).scalar() + 1
+    db.session.execute(insert(User), [{'username': f'en{i}', 'email': f'en{i}@test.com', 'display_name': f'En{i}',
+                                       'password_hash': 'x', 'is_active_player': i % 10 != 0} for i in range(2000)])
+    db.session.commit()
+    active_count = User.query.filter_by(is_active_player=True).count()
+    boss_uid = User.query.filter_by(username='boss').one().id
+    db.session.add(SeasonEntry(season_id=es_id, user_id=boss_uid, has_paid=True, amount_paid=25))
+    db.session.commit()
+    enroll_season = db.session.get(Season, es_id)
+    with capture_queries() as stats:
+        added = enroll_active_players(enroll_season)
+    check(added == active_count - 1, "Enrollment: adds every active player not already entered",
+          f"{added} vs {active_count - 1}")
+    check(stats.count <= 3, "Enrollment: constant queries for 2000 players", f"{stats.count} queries")
+    check(SeasonEntry.query.filter_by(season_id=es_id).filter(SeasonEntry.created_at.is_(None)).count() == 0
+          and SeasonEntry.query.filter_by(season_id=es_id, user_id=boss_uid).one().has_paid,
+          "Enrollment: new entries get defaults, existing entries untouched")
+    check(enroll_active_players(db.session.get(Season, es_id)) == 0, "Enrollment: running twice adds nobody")
+    inactive = User.query.filter(User.id >= first_bulk, User.is_active_player.is_(False)).first().id
+    targets = list(range(first_bulk, first_bulk + 1000)) + [boss_uid, inactive]
+    enroll_season = db.session.get(Season, es_id)
+    with capture_queries() as stats:
+        counts = mark_paid(enroll_season, targets)
+    inactive_in_range = sum(1 for i in range(1000) if i % 10 == 0)
+    check(counts == {'updated': 1000 - inactive_in_range, 'entered': inactive_in_range},
+          "Enrollment: mark paid counts updated and newly entered players", str(counts))
+    check(stats.count <= 4, "Enrollment: mark paid in constant queries", f"{stats.count} queries")
+    check(SeasonEntry.query.filter_by(season_id=es_id, has_paid=True).filter(SeasonEntry.amount_paid != 25).count() == 0,
+          "Enrollment: paid entries record the entry fee")
+    check(mark_paid(db.session.get(Season, es_id), targets) == {'updated': 0, 'entered': 0},
+          "Enrollment: marking paid again changes nothing")
+    resp = http(lambda: admin_client.post(f'/admin/seasons/{es_id}/entries/mark-paid',
+                                          data={'paid': '0', 'user_id': [str(first_bulk + 1), str(first_bulk + 2)]}))
+    check(resp.status_code == 302 and SeasonEntry.query.filter_by(season_id=es_id, has_paid=False).filter(
+        SeasonEntry.user_id.in_([first_bulk + 1, first_bulk + 2])).count() == 2, "Enrollment: bulk mark unpaid route")
+    check(SeasonEntry.query.filter_by(season_id=es_id, user_id=first_bulk + 1).one().amount_paid == 25,
+          "Enrollment: marking unpaid keeps the recorded amount")
+    resp = http(lambda: admin_client.post(f'/admin/seasons/{es_id}/entries/add-all'))
+    check(Job.query.order_by(Job.id.desc()).first().message == 'Added 0 players to season 2031.',
+          "Enrollment: add-all job reports its count")
+    User.query.filter(User.id >= first_bulk).update({User.is_active_player: False}, synchronize_session=False)
+    db.session.commit()
+
+    # ================================================================
+    print("\n=== USER IMPORT ===")
+    # ================================================================
+    import io
+    from app.user_import import parse_rows, import_users, ImportFormatError
+    csv_rows = parse_rows("Username,Email,Password,Display_Name,Is_Admin\nimp1,imp1@test.com,secret1,Imp One,no\n")
+    check(csv_rows == [{'username': 'imp1', 'email': 'imp1@test.com', 'password': 'secret1',
+                        'display_name': 'Imp One', 'is_admin': 'no'}], "Import: CSV rows keyed by lower-case header",
+          str(csv_rows))
+    nd_rows = parse_rows('{"username": "imp2", "email": "imp2@test.com", "password": "secret2", "is_admin": true}\n\n')
+    check(len(nd_rows) == 1 and nd_rows[0]['is_admin'] is True, "Import: NDJSON rows")
+    try:
+        parse_rows('{"username": "x"}\nnot json\n')
+        check(False, "Import: bad NDJSON line rejected")
+    except ImportFormatError as e:
+        check('Line 2' in str(e), "Import: bad NDJSON line rejected", str(e))
+    rows = csv_rows + nd_rows + [
+        {'username': 'imp3', 'email': 'imp3@test.com', 'password': 'secret3', 'is_active_player': '0'},
+        {'username': 'imp4', 'email': 'imp4@test.com', 'password': ''},
+        {'username': 'imp5', 'email': 'imp5@test.com', 'password': 'abc'},
+        {'username': 'IMP1', 'email': 'other@test.com', 'password': 'secret'},
+        {'username': 'imp6', 'email': 'IMP2@test.com', 'password': 'secret'},
+        {'username': 'boss', 'email': 'new-boss@test.com', 'password': 'secret'},
+        {'username': 'imp7', 'email': 'boss@test.com', 'password': 'secret'},
+        {'username': 'imp8', 'email': 'imp8@test.com', 'password': 'secret', 'is_admin': 'maybe'},
+    ]
+    boss_email = User.query.filter_by(username='boss').one().email
+    rows[-2]['email'] = boss_email
+    with capture_queries() as stats:
+        report = import_users(rows, workers=2, batch_size=2)
+    check([e['status'] for e in report] == ['created'] * 3 + ['error'] * 7, "Import: per-row report",
+          str([(e['row'], e['error']) for e in report]))
+    errors = [e['error'] for e in report[3:]]
+    check(errors[0] == 'missing password' and 'at least 4' in errors[1] and errors[2] == 'username repeats row 1'
+          and errors[3] == 'email repeats row 2' and errors[4] == 'username already exists'
+          and errors[5] == 'email already in use' and 'yes/no' in errors[6], "Import: each row says what was wrong",
+          str(errors))
+    check(stats.count == 3, "Import: one lookup query plus batched inserts", f"{stats.count} queries")
+    imp = {u.username: u for u in User.query.filter(User.username.in_(['imp1', 'imp2', 'imp3']))}
+    check(imp['imp1'].display_name == 'Imp One' and not imp['imp1'].is_admin and imp['imp2'].is_admin
+          and imp['imp2'].display_name == 'imp2' and not imp['imp3'].is_active_player,
+          "Import: fields and flags stored")
+    check(imp['imp3'].check_password('secret3') and imp['imp3'].password_hash.startswith('pbkdf2:sha256'),
+          "Import: passwords hashed with pbkdf2:sha256")
+    report = import_users([{'username': 'BOSS', 'email': 'boss2@test.com', 'password': 'secret'},
+                           {'username': 'imp11', 'email': boss_email.upper(), 'password': 'secret'}])
+    check([e['error'] for e in report] == ['username already exists', 'email already in use'],
+          "Import: existing users matched case-insensitively", str(report))
+    import app.user_import as user_import
+    def no_fork(*args, **kwargs):
+        raise AssertionError('process pool forked from the web worker')
+    hash_workers, forking = app.config['IMPORT_HASH_WORKERS'], user_import.ProcessPoolExecutor
+    app.config['IMPORT_HASH_WORKERS'], user_import.ProcessPoolExecutor = 2, no_fork
+    try:
+        resp = http(lambda: admin_client.post('/admin/users/import', content_type='multipart/form-data', data={
+            'file': (io.BytesIO(b'username,email,password\nimp9,imp9@test.com,secret9\nimp12,imp12@test.com,s12345\n'
+                                b'imp1,x@test.com,secret\n'), 'players.csv')}))
+    finally:
+        app.config['IMPORT_HASH_WORKERS'], user_import.ProcessPoolExecutor = hash_workers, forking
+    import_job = Job.query.order_by(Job.id.desc()).first()
+    check(resp.status_code == 302 and resp.headers['Location'].endswith(f'/admin/jobs/{import_job.id}')
+          and import_job.kind == 'import_users' and import_job.status == 'done'
+          and User.query.filter(User.username.in_(['imp9', 'imp12'])).count() == 2,
+          "Import: upload runs as a background job hashing on threads",
+          f"{import_job.kind} {import_job.status} {import_job.error}")
+    check('secret' not in import_job.params, "Import: passwords never stored with the job", import_job.params)
+    resp = http(lambda: admin_client.get(f'/admin/jobs/{import_job.id}'))
+    check(b'Created 2 of 3' in resp.data and b'username already exists' in resp.data,
+          "Import: job page shows the per-row report", resp.data[-300:].decode(errors='replace'))
+    resp = http(lambda: admin_client.post('/admin/users/import', content_type='multipart/form-data', data={
+        'file': (io.BytesIO(b'username,email,password\nimp1,x@test.com,secret\n'), 'again.csv')}))
+    check(resp.status_code == 200 and b'Created 0 of 1' in resp.data, "Import: nothing to create reports at once")
+    with tempfile.NamedTemporaryFile('w', suffix='.ndjson', delete=False) as f:
+        f.write('{"username": "imp10", "email": "imp10@test.com", "password": "secret10"}\n')
+    result = app.test_cli_runner().invoke(args=['import-users', f.name, '--workers', '1'])
+    os.unlink(f.name)
+    check(result.exit_code == 0 and 'Created 1 of 1' in result.output
+          and User.query.filter_by(username='imp10').count() == 1, "Import: CLI command", result.output)
+
+    # ================================================================
+    print("\n=== ADMIN USER LIST ===")
+    # ================================================================
+    from app.user_search import search_users, PAGE_SIZE
+    all_names = [n for (n,) in db.session.query(User.username).order_by(User.username)]
+    walked, page = [], search_users()
+    while True:
+        walked += [u.username for u in page.users]
+        if not page.has_next:
+            break
+        page = search_users(after=page.last)
+    check(walked == all_names and len(all_names) > 20 * PAGE_SIZE, "User list: keyset pages cover every user once",
+          f"{len(walked)} vs {len(all_names)}")
+    second = search_users(after=search_users().last)
+    back = search_users(before=second.first)
+    check([u.username for u in back.users] == all_names[:PAGE_SIZE] and not back.has_prev and back.has_next,
+          "User list: previous page from before=")
+    check({u.username for u in search_users(q='IMP').users} >= {'imp1', 'imp2', 'imp3', 'imp9', 'imp10'}
+          and all(u.username.startswith('imp') for u in search_users(q='imp').users),
+          "User list: case-insensitive username prefix search")
+    check([u.username for u in search_users(q='rc12').users] == ['rc12'] + [f'rc12{i}' for i in range(10)],
+          "User list: display name prefix search", str([u.username for u in search_users(q='rc12').users]))
+    check([u.username for u in search_users(q='en199@').users] == ['en199'], "User list: email prefix search")
+    admins = search_users(admin=True).users
+    check(admins and all(u.is_admin for u in admins) and all(not u.is_active_player for u in search_users(active=False).users),
+          "User list: admin and active filters")
+    paid = search_users(paid=True, season_id=es_id, limit=5000).users
+    check(len(paid) == SeasonEntry.query.filter_by(season_id=es_id, has_paid=True).count() and paid,
+          "User list: paid-for-season filter", str(len(paid)))
+    unpaid = search_users(paid=False, season_id=es_id, limit=5000).users
+    check(len(paid) + len(unpaid) == len(all_names), "User list: unpaid filter is the complement")
+    plan = ' '.join(str(r) for r in db.session.execute(db.text(
+        "EXPLAIN QUERY PLAN SELECT id FROM users WHERE (lower(username) >= 'a' AND lower(username) < 'b') "
+        "OR (lower(display_name) >= 'a' AND lower(display_name) < 'b') OR (lower(email) >= 'a' AND lower(email) < 'b')")))
+    check('ix_users_username_lower' in plan and 'ix_users_email_lower' in plan, "User list: search uses indexes", plan)
+    first_n = count_queries(lambda: admin_client.get('/admin/users'))
+    deep = all_names[-3 * PAGE_SIZE]
+    deep_n = count_queries(lambda: admin_client.get('/admin/users', query_string={'after': deep}))
+    resp = http(lambda: admin_client.get('/admin/users'))
+    check(resp.status_code == 200 and resp.data.count(b'<code>') >= PAGE_SIZE and b'after=' in resp.data,
+          "User list: page renders with a next link")
+    check(first_n == deep_n, "User list: same queries on the first and a deep page", f"{first_n} vs {deep_n}")
+    resp = http(lambda: admin_client.get('/admin/users', query_string={'season': es_id, 'paid': 'paid', 'q': 'en1'}))
+    check(resp.status_code == 200 and b'Paid 2031' in resp.data and b'btn-primary">Paid 2031' in resp.data,
+          "User list: filter chips rendered and marked")
+    target = User.query.filter_by(username='imp9').one()
+    target_id, was = target.id, target.is_active_player
+    resp = http(lambda: admin_client.post(f'/admin/users/{target_id}/toggle', data={'next': '/admin/users?q=imp'}))
+    check(resp.headers['Location'].endswith('/admin/users?q=imp'), "User list: actions return to the same list",
+          resp.headers['Location'])
+    resp = http(lambda: admin_client.post(f'/admin/users/{target_id}/toggle', data={'next': 'https://evil.example/'}))
+    check(resp.headers['Location'].endswith('/admin/users'), "User list: next must be the user list")
+    db.session.expire_all()
+    check(db.session.get(User, target_id).is_active_player == was, "User list: toggled twice")
+
     # ================================================================
     print(f"\n{'='*50}")
     print(f"RESULTS: {passed} passed, {failed} failed")